@@ -0,0 +1,5 @@
+# app/__init__.py
+import time
+
+# Момент импорта пакета — от него считается время старта (см. bot._post_init)
+STARTED = time.perf_counter()
@@ -0,0 +1,191 @@
+# app/archive.py
+"""
+Архив холодной истории.
+
+Вместо удаления старых сообщений (db._cleanup_old_messages) задача
+JobQueue раз в ARCHIVE_INTERVAL_SEC переносит сообщения старше
+ARCHIVE_AFTER_DAYS из messages в файлы ARCHIVE_DIR/YYYY/MM/YYYY-MM-DD.jsonl.gz.
+Горячая таблица остаётся маленькой, история не теряется.
+
+Хранение в messages при включённом архиве: не «последние 100 на
+пользователя» (как у очистки без архива), а всё за ARCHIVE_AFTER_DAYS,
+но не больше ARCHIVE_KEEP_PER_USER последних — более старое сверх лимита
+тоже уходит в архив, не дожидаясь срока. Ещё не свёрнутое в конспект
+остаётся в таблице в обоих случаях.
+
+Файл дня — цепочка gzip-членов (каждая пачка дописывается отдельным
+членом, файл при этом остаётся обычным .gz для zcat). Смещение и длина
+каждого члена лежат в archive_segments — читатель берёт только нужные
+дни и не разжимает лишнего. Член дописывается и fsync-ается до того,
+как сообщения удаляются из базы; оборванная запись остаётся в файле
+мусором, на который не ссылается индекс.
+
+С конспектами (app/summarizer.py) переносятся только свёрнутые сообщения.
+
+    python -m app.archive run                       — перенести сейчас
+    python -m app.archive export [--since ДАТА] [--until ДАТА] [--user ID]
+"""
+from __future__ import annotations
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional
+
+from telegram.ext import Application, ContextTypes
+
+from .config import settings
+from .metrics import Counter, job
+import app.db as db
+
+log = logging.getLogger(__name__)
+
+ARCHIVED = Counter("alina_archived_messages_total", "Сообщения, перенесённые в архив")
+
+_PAUSE = 0.05   # между пачками, сек — отдаём блокировку записи боту
+
+# Проверка лимита на пользователя: с какого id смотреть новые сообщения и кто
+# в прошлый раз остался сверх лимита (не свёрнутое в конспект не переносится).
+# После рестарта первый запуск проверяет всех.
+_overflow_after = 0
+_overflow_left: List[int] = []
+
+
+def _segment_path(day: str) -> str:
+    """Путь файла дня относительно ARCHIVE_DIR"""
+    return os.path.join(day[:4], day[5:7], f"{day}.jsonl.gz")
+
+
+def _append_member(rel_path: str, rows: List[Dict]) -> Dict:
+    """Дописывает пачку строк отдельным gzip-членом; возвращает запись для индекса"""
+    payload = "".join(
+        json.dumps({k: r[k] for k in ("id", "user_id", "role", "content", "ts")}, ensure_ascii=False) + "\n"
+        for r in rows
+    ).encode()
+    data = gzip.compress(payload, compresslevel=6, mtime=0)
+    path = os.path.join(settings.archive_dir, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return {
+        "day": rows[0]["ts"][:10], "path": rel_path, "offset": offset, "length": len(data),
+        "first_id": rows[0]["id"], "last_id": rows[-1]["id"], "rows": len(rows),
+    }
+
+
+def archive_old(days: Optional[int] = None, batch: Optional[int] = None,
+                keep: Optional[int] = None) -> int:
+    """
+    Переносит сообщения старше days дней и сверх keep последних у каждого
+    пользователя; возвращает их число (синхронно, из потока)
+    """
+    global _overflow_after, _overflow_left
+    days = settings.archive_after_days if days is None else days
+    batch = batch or settings.archive_batch
+    keep = settings.archive_keep_per_user if keep is None else keep
+    before = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    summarized_only = settings.summary_enabled
+    total = 0
+    # Граница по индексу messages(ts): нечего переносить — без скана таблицы
+    upto = db.archive_upto(before)
+    if upto is not None:
+        total += _move(lambda after: db.archive_candidates(after, upto, batch, summarized_only, before_ts=before),
+                       batch)
+    if keep > 0:
+        over, last_id = db.archive_overflow(keep, _overflow_after, _overflow_left)
+        for o in over:
+            total += _move(lambda after, o=o: db.archive_candidates(
+                after, o["upto_id"], batch, summarized_only, user_id=o["user_id"],
+            ), batch)
+        _overflow_after = last_id
+        _overflow_left = [o["user_id"] for o in over] if summarized_only else []
+    return total
+
+
+def _move(fetch, batch: int) -> int:
+    """Переносит пачки fetch(after_id) в архив, пока они не кончатся"""
+    after_id, total = 0, 0
+    while True:
+        rows = fetch(after_id)
+        if not rows:
+            return total
+        after_id = rows[-1]["id"]
+        moved = [r for r in rows if r["eligible"]]
+        if moved:
+            segments = [
+                _append_member(_segment_path(day), list(group))
+                for day, group in groupby(moved, key=lambda r: r["ts"][:10])
+            ]
+            db.commit_archive(segments, [r["id"] for r in moved])
+            ARCHIVED.inc(amount=len(moved))
+            total += len(moved)
+        if len(rows) < batch:
+            return total
+        time.sleep(_PAUSE)
+
+
+def iter_messages(since_day: Optional[str] = None, until_day: Optional[str] = None,
+                  user_id: Optional[int] = None) -> Iterator[Dict]:
+    """Потоково читает архив за дни [since_day, until_day] (YYYY-MM-DD) по порядку"""
+    f, opened = None, None
+    try:
+        for seg in db.archive_segments(since_day, until_day):
+            if seg["path"] != opened:
+                if f is not None:
+                    f.close()
+                f = open(os.path.join(settings.archive_dir, seg["path"]), "rb")
+                opened = seg["path"]
+            f.seek(seg["offset"])
+            for line in gzip.decompress(f.read(seg["length"])).splitlines():
+                rec = json.loads(line)
+                if user_id is None or rec["user_id"] == user_id:
+                    yield rec
+    finally:
+        if f is not None:
+            f.close()
+
+
+@job("archive")
+async def _archive_job(context: ContextTypes.DEFAULT_TYPE):
+    moved = await asyncio.to_thread(archive_old)
+    if moved:
+        log.info("история перенесена в архив", extra={"messages": moved})
+
+
+def schedule_archive(app: Application, interval_sec: Optional[int] = None):
+    jq = getattr(app, "job_queue", None)
+    if jq is None or not settings.archive_enabled:
+        return
+    jq.run_repeating(
+        _archive_job, interval=interval_sec or settings.archive_interval_sec, first=300, name="archive:cold",
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    ap = argparse.ArgumentParser(prog="python -m app.archive")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="перенести старую историю сейчас")
+    run.add_argument("--days", type=int, default=None)
+    exp = sub.add_parser("export", help="выгрузить архив в stdout (JSONL)")
+    exp.add_argument("--since", default=None)
+    exp.add_argument("--until", default=None)
+    exp.add_argument("--user", type=int, default=None)
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    db.init()
+    if args.cmd == "run":
+        print(f"перенесено сообщений: {archive_old(args.days)}")
+    else:
+        for rec in iter_messages(args.since, args.until, args.user):
+            sys.stdout.write(json.dumps(rec, ensure_ascii=False) + "\n")
@@ -1,57 +1,70 @@
 # app/bot.py
 import asyncio
+import json
+import logging
 import time
 import re
-import sys
-import traceback
+from functools import lru_cache
+from types import SimpleNamespace
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.constants import ParseMode
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, ContextTypes,
-    CallbackQueryHandler, PreCheckoutQueryHandler, filters
+    CallbackQueryHandler, PreCheckoutQueryHandler, ChatMemberHandler, filters
 )
 
 from .config import settings
 from .prompts import SYSTEM_PROMPT, TECH_BOUNDARY, AVOID_PATTERNS
-from .llm_client import LLMClient
+from .classifier import classify
 from .typing_sim import human_typing
+from .render import send_text
+from .outbox import outbox, REMINDER
 import app.db as db
-from .payments import send_stars_invoice, precheckout_stars, on_successful_payment
-from .reminders import schedule_one, deschedule_one, reschedule_all_for_user, _tzinfo_from_str
+from . import (
+    STARTED, tracing, metrics, logs, loopmon, usage, summarizer, archive, drain, persistence,
+    reminders, broadcast,
+)
+from .payments import (
+    send_stars_invoice, precheckout_stars, on_successful_payment, schedule_payment_expiry
+)
+from .reminders import reschedule_all_for_user, _tzinfo_from_str
 
 
 # -------------------- инициализация --------------------
+# При импорте — никакой работы с базой и сетью: схема, клиенты и фоновые
+# задачи поднимаются в _post_init, тяжёлые модули (openai, numpy) —
+# при первом использовании.
+
+log = logging.getLogger(__name__)
+_IMPORTED = time.perf_counter()
+
+
+def _get_llm():
+    from .llm_client import get
+    return get()
+
+
+_llm_warmup = None      # asyncio.Future прогрева клиента LLM в потоке (см. _post_init)
+
+
+def _warmup_done(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        log.error("не удалось создать клиент LLM при старте", exc_info=fut.exception())
 
-db.init()
-llm = LLMClient()
 
 # простой рейт-лимит: не чаще 1 сообщения в секунду от пользователя
 LAST_SEEN = {}
-
-# для «узкой» кнопки корзины: визуальный наполнитель
-FILLER = " " * 10
+RATE_LIMITED = metrics.Counter("alina_rate_limited_total", "Сообщения, отклонённые рейт-лимитом")
+JOBS_SCHEDULED = metrics.Gauge("alina_jobs_scheduled", "Задач в JobQueue (напоминания, продления и т.п.)")
+STARTUP = metrics.Gauge("alina_startup_seconds", "Время старта процесса по этапам", ("phase",))
 
 MONTHS_RU = {
     1: "января", 2: "февраля", 3: "марта", 4: "апреля", 5: "мая", 6: "июня",
     7: "июля", 8: "августа", 9: "сентября", 10: "октября", 11: "ноября", 12: "декабря"
 }
 
-TECH_KEYWORDS = [
-    "алгоритм", "код", "программ", "python", "javascript", "java", "sql",
-    "функци", "класс", "метод", "массив", "цикл", "for", "while", "if",
-    "дейкстр", "граф", "дерев", "хеш", "сложност", "big o", "o(n)",
-    "база данн", "таблиц", "запрос", "индекс", "join", "select",
-    "компил", "интерпрет", "debug", "git", "docker", "api", "rest",
-    "матриц", "вектор", "интеграл", "производн", "уравнен", "формул",
-    "машинн", "нейрон", "ml", "ai", "датасет", "модел", "обучен",
-    "структур данн", "стек", "очеред", "связн списк", "рекурс",
-    "```", "def ", "class ", "function", "import", "return", "console.log"
-]
-
-
 # -------------------- вспомогательные функции --------------------
 
 def _encode_hhmm(hhmm: str) -> str:
@@ -68,18 +81,15 @@ def format_dt(dt: datetime) -> str:
 
 
 def _sub_state(user_row):
-    """Проверяет состояние подписки"""
-    su = user_row.get("sub_until") if isinstance(user_row, dict) else user_row["sub_until"]
-    if not su:
-        return False, None, None
-    try:
-        until = datetime.fromisoformat(su)
-    except Exception:
+    """Проверяет состояние подписки (для отображения: возвращает даты)"""
+    until_ts = int(user_row["sub_until_ts"] or 0)
+    if not until_ts:
         return False, None, None
-    now = datetime.now(timezone.utc).replace(tzinfo=None)
-    if until <= now:
+    until = datetime.fromtimestamp(until_ts, timezone.utc).replace(tzinfo=None)
+    now_ts = int(time.time())
+    if until_ts <= now_ts:
         return False, until, timedelta(0)
-    return True, until, until - now
+    return True, until, timedelta(seconds=until_ts - now_ts)
 
 
 def _humanize_td(td: timedelta) -> str:
@@ -99,10 +109,7 @@ def _humanize_td(td: timedelta) -> str:
 
 def is_tech_question(text: str) -> bool:
     """Определяет, является ли вопрос техническим"""
-    if not text:
-        return False
-    t = text.lower()
-    return any(keyword in t for keyword in TECH_KEYWORDS)
+    return classify(text).tech
 
 
 def is_rate_limited(user_id: int) -> bool:
@@ -111,25 +118,14 @@ def is_rate_limited(user_id: int) -> bool:
     last = LAST_SEEN.get(user_id, 0)
     if now - last < 1.0:
         LAST_SEEN[user_id] = now
+        RATE_LIMITED.inc()
         return True
     LAST_SEEN[user_id] = now
     return False
 
 
-async def check_subscription(user_id: int) -> tuple[bool, dict]:
-    """Проверяет подписку и возвращает (has_access, user_data)"""
-    u = await asyncio.to_thread(db.get_user, user_id)
-    active, _, _ = _sub_state(u)
-    
-    if active:
-        return True, u
-    
-    # Проверяем бесплатные сообщения
-    free_left = u.get("free_left", 0)
-    if free_left > 0:
-        return True, u
-    
-    return False, u
+def is_admin(user_id: int) -> bool:
+    return user_id in settings.admin_ids
 
 
 def _sanitize_name_address(reply: str, tg_user, db_name: str | None) -> str:
@@ -155,9 +151,14 @@ def _sanitize_name_address(reply: str, tg_user, db_name: str | None) -> str:
     if not banned:
         return reply
 
-    escaped = [re.escape(x) for x in sorted(banned, key=len, reverse=True)]
-    pattern = r"^\s*(?:%s)\s*[,:\-–—]\s*" % "|".join(escaped)
-    return re.sub(pattern, "", reply, flags=re.IGNORECASE)
+    return _name_address_re(tuple(sorted(banned, key=lambda x: (-len(x), x)))).sub("", reply, count=1)
+
+
+@lru_cache(maxsize=4096)
+def _name_address_re(banned: tuple[str, ...]) -> re.Pattern:
+    """Скомпилированный шаблон обращения по имени; кэшируется на набор имён пользователя"""
+    escaped = [re.escape(x) for x in banned]
+    return re.compile(r"^\s*(?:%s)\s*[,:\-–—]\s*" % "|".join(escaped), re.IGNORECASE)
 
 
 # -------------------- tz --------------------
@@ -174,11 +175,11 @@ async def _apply_tz(update, context, tz_text: str):
             _ = ZoneInfo(tz_text)
             tz_str = tz_text
         except Exception:
-            await update.message.reply_text("не узнала такой часовой пояс... попробуй, например, Europe/Moscow или UTC+3")
+            await outbox.reply(update.message, "не узнала такой часовой пояс... попробуй, например, Europe/Moscow или UTC+3")
             return
     db.set_tz(user_id, tz_str)
     reschedule_all_for_user(context.application, user_id)
-    await update.message.reply_text(f"окей, запомнила: {tz_str}")
+    await outbox.reply(update.message, f"окей, запомнила: {tz_str}")
 
 
 async def tz_cmd(update, context):
@@ -187,7 +188,7 @@ async def tz_cmd(update, context):
     if not arg:
         context.user_data["await_tz"] = True
         cur = db.get_tz(user_id) or "не задан"
-        await update.message.reply_text(
+        await outbox.reply(update.message, 
             f"напиши свой часовой пояс одним сообщением (например, Europe/Moscow или UTC+3).\n"
             f"сейчас у тебя: {cur}"
         )
@@ -197,26 +198,6 @@ async def tz_cmd(update, context):
 
 # -------------------- reminders UI --------------------
 
-def _reminders_kb(user_id: int):
-    rs = db.list_reminders(user_id)
-    rows = []
-    for r in rs:
-        state = "вкл" if r["active"] else "выкл"
-        rid = r["id"]
-        rtype = r.get("rtype") or "checkin"
-        label = f"⏰ {r['time_local']} ({state}) — {rtype}{FILLER}"
-        rows.append([
-            InlineKeyboardButton(label, callback_data=f"rem|toggle|{rid}"),
-            InlineKeyboardButton("🗑", callback_data=f"rem|del|{rid}")
-        ])
-    rows += [
-        [InlineKeyboardButton("Добавить «Доброе утро» (09:00)", callback_data="rem|add|morning|0900")],
-        [InlineKeyboardButton("Добавить «Вечерний привет» (21:00)", callback_data="rem|add|evening|2100")],
-        [InlineKeyboardButton("Добавить своё время…", callback_data="rem|add|custom")],
-    ]
-    return InlineKeyboardMarkup(rows)
-
-
 async def reminders_cmd(update, context):
     u = db.get_user(update.effective_user.id)
     tz = db.get_tz(u["user_id"]) or "UTC"
@@ -225,7 +206,7 @@ async def reminders_cmd(update, context):
         f"твой часовой пояс: {tz}\n\n"
         "нажми, чтобы включить/выключить или добавить новые напоминания."
     )
-    await update.message.reply_text(text, reply_markup=_reminders_kb(u["user_id"]))
+    await outbox.reply(update.message, text, reply_markup=await reminders.keyboard(u["user_id"]))
 
 
 # -------------------- основные команды --------------------
@@ -251,7 +232,7 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "наше знакомство подошло к концу...\n"
                 "если хочешь продолжить общение — /subscribe 💛"
             )
-    await update.message.reply_text(text)
+    await outbox.reply(update.message, text)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -276,11 +257,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     reschedule_all_for_user(context.application, update.effective_user.id)
-    await update.message.reply_text(text)
+    await outbox.reply(update.message, text)
 
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await outbox.reply(update.message, 
         "я всегда рядом, если захочешь поговорить 💛\n\n"
         "вот что можно настроить:\n\n"
         "• /reminders — если хочешь, чтобы я писала первой\n"
@@ -309,7 +290,7 @@ async def subscribe(update, context):
             "выбери, на сколько времени мне остаться 💛"
         )
     
-    await update.message.reply_text(text, reply_markup=kb)
+    await outbox.reply(update.message, text, reply_markup=kb)
 
 
 # -------------------- callbacks --------------------
@@ -323,27 +304,16 @@ async def on_cb(update, context):
 
     # Обработка reminders
     if parts[:2] == ["rem", "toggle"] and len(parts) == 3:
-        rid = int(parts[2])
-        rs = db.list_reminders(user_id)
-        cur = next((r for r in rs if r["id"] == rid), None)
-        if not cur:
+        kb = await reminders.toggle(context.application, user_id, int(parts[2]))
+        if kb is None:
             await q.edit_message_text("не нашла такое напоминание...")
             return
-        new_active = 0 if cur["active"] else 1
-        db.toggle_reminder(user_id, rid, new_active)
-        if new_active:
-            tz = db.get_tz(user_id) or "UTC"
-            schedule_one(context.application, user_id, rid, cur["rtype"], cur["time_local"], tz)
-        else:
-            deschedule_one(context.application, user_id, rid)
-        await q.edit_message_reply_markup(reply_markup=_reminders_kb(user_id))
+        await q.edit_message_reply_markup(reply_markup=kb)
         return
 
     if parts[:2] == ["rem", "del"] and len(parts) == 3:
-        rid = int(parts[2])
-        deschedule_one(context.application, user_id, rid)
-        db.delete_reminder(user_id, rid)
-        await q.edit_message_reply_markup(reply_markup=_reminders_kb(user_id))
+        kb = await reminders.delete(context.application, user_id, int(parts[2]))
+        await q.edit_message_reply_markup(reply_markup=kb)
         return
 
     if parts[:2] == ["rem", "add"]:
@@ -353,15 +323,24 @@ async def on_cb(update, context):
             return
 
         if len(parts) == 4:
-            rtype = parts[2]
-            hhmm = _decode_hhmm(parts[3])
-            rid = db.add_reminder(user_id, rtype, hhmm)
-            tz = db.get_tz(user_id) or "UTC"
-            schedule_one(context.application, user_id, rid, rtype, hhmm, tz)
+            kb = await reminders.add(context.application, user_id, parts[2], _decode_hhmm(parts[3]))
             await q.edit_message_text("добавила! 🌿")
-            await q.message.reply_text("твои напоминания:", reply_markup=_reminders_kb(user_id))
+            await outbox.reply(q.message, "твои напоминания:", reply_markup=kb)
             return
 
+    # Рассылки (только админы)
+    if parts[0] == "bc" and len(parts) == 3 and is_admin(user_id):
+        bid = int(parts[2])
+        if parts[1] == "go":
+            ok = await broadcast.start(context.application, bid)
+            await q.edit_message_reply_markup(reply_markup=None)
+            await outbox.reply(q.message, f"рассылка #{bid} запущена" if ok else f"рассылку #{bid} уже не запустить")
+        elif parts[1] == "cancel":
+            ok = await broadcast.cancel(bid)
+            await q.edit_message_reply_markup(reply_markup=None)
+            await outbox.reply(q.message, f"рассылка #{bid} отменена" if ok else f"рассылку #{bid} уже не отменить")
+        return
+
     # Обработка платежей
     if data.startswith("pay_stars:"):
         plan = data.split(":", 1)[1]
@@ -373,9 +352,33 @@ async def on_cb(update, context):
 
 # -------------------- основная логика сообщений --------------------
 
-def build_messages(user_id: int, db_name: str | None, user_text: str):
-    """Строит массив сообщений для LLM"""
-    history = db.last_dialog(user_id, limit=20)
+async def build_messages(user_id: int, db_name: str | None, user_text: str):
+    """Строит массив сообщений для LLM, возвращает (msgs, классификация запроса)"""
+    # Чтение и распаковка истории — в потоке, как и остальные запросы хода
+    with tracing.span("history"):
+        if settings.summary_enabled:
+            # Конспект старого + не свёрнутый хвост: размер промпта не растёт с историей
+            summary, history = await asyncio.to_thread(
+                db.dialog_context, user_id, limit=summarizer.context_limit(),
+            )
+            summarizer.maybe_schedule(user_id, len(history))
+        else:
+            summary, history = None, await asyncio.to_thread(db.last_dialog, user_id, limit=20)
+    recalled = []
+    if settings.memory_enabled:
+        # Эмбеддинг и перебор векторов — в потоке, не на event loop
+        with tracing.span("memory"):
+            recalled = await asyncio.to_thread(
+                db.recall_memories, user_id, user_text, k=settings.memory_top_k,
+                min_score=settings.memory_min_score, exclude={h["content"] for h in history} | {user_text},
+            )
+    with tracing.span("prompt_build"):
+        return _assemble_messages(history, db_name, user_text, summary, recalled)
+
+
+def _assemble_messages(history, db_name: str | None, user_text: str, summary: str | None = None,
+                       recalled=()):
+    kind = classify(user_text)
     
     msgs = [
         {"role": "system", "content": SYSTEM_PROMPT},
@@ -386,12 +389,21 @@ def build_messages(user_id: int, db_name: str | None, user_text: str):
         msgs.append({"role": "system", "content": f"Собеседник попросил звать его: {db_name}."})
     
     # Если технический вопрос - добавляем ограничение
-    if is_tech_question(user_text):
+    if kind.tech:
         msgs.append({"role": "system", "content": TECH_BOUNDARY})
         msgs.append({
             "role": "system",
             "content": "ПОМНИ: ты НЕ помогаешь с техническими вопросами. Отвечай как обычная девушка, которая в этом не разбирается."
         })
+
+    if summary:
+        msgs.append({"role": "system", "content": f"Что ты помнишь о собеседнике из прошлых разговоров: {summary}"})
+    if recalled:
+        quotes = "; ".join(f"«{r[:300]}»" for r in recalled)
+        msgs.append({
+            "role": "system",
+            "content": f"Раньше собеседник писал тебе: {quotes}. Вспоминай это, только если к месту.",
+        })
     
     # Добавляем историю
     for h in history:
@@ -399,24 +411,19 @@ def build_messages(user_id: int, db_name: str | None, user_text: str):
     
     msgs.append({"role": "user", "content": user_text})
     
-    # Определяем verbosity на основе контекста
-    if is_tech_question(user_text):
-        verbosity = "short"
-    elif any(word in user_text.lower() for word in ["20", "15", "много", "несколько", "факт", "список"]):
-        verbosity = "long"  # Для длинных списков
-    else:
-        verbosity = "normal"
-    
-    return msgs, verbosity
+    # verbosity определяет классификатор: tech → short, просьба о фактах/списке → long
+    return msgs, kind
 
 
+@tracing.traced("on_text")
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
     user_id = update.effective_user.id
     text_in = (update.message.text or "").strip()
+    tracing.annotate(user_id=user_id, chars_in=len(text_in))
 
-    # Отладка входящего сообщения
-    print(f"[BOT] Получено от {user_id}: {text_in[:100]}...")
+    # Текст сообщений в лог не пишем — только размер
+    log.debug("входящее сообщение", extra={"user_id": user_id, "chars": len(text_in)})
 
     # Ожидание ввода часового пояса
     if context.user_data.get("await_tz"):
@@ -426,8 +433,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Проверка рейт-лимита
-    if is_rate_limited(user_id):
-        await update.message.reply_text("секунду... печатаю 🌿")
+    with tracing.span("rate_limit"):
+        limited = is_rate_limited(user_id)
+    if limited:
+        tracing.annotate(outcome="rate_limited")
+        await outbox.reply(update.message, "секунду... печатаю 🌿")
         return
 
     # Ожидание времени для напоминания
@@ -438,16 +448,13 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 hh, mm = txt.split(":")
                 h, m = int(hh), int(mm)
                 if 0 <= h <= 23 and 0 <= m <= 59:
-                    hhmm = f"{h:02d}:{m:02d}"
-                    rid = db.add_reminder(user_id, "checkin", hhmm)
-                    tz = db.get_tz(user_id) or "UTC"
-                    schedule_one(context.application, user_id, rid, "checkin", hhmm, tz)
+                    kb = await reminders.add(context.application, user_id, "checkin", f"{h:02d}:{m:02d}")
                     context.user_data["await_custom_time"] = False
-                    await update.message.reply_text("добавила ⏰", reply_markup=_reminders_kb(user_id))
+                    await outbox.reply(update.message, "добавила ⏰", reply_markup=kb)
                     return
             except Exception:
                 pass
-        await update.message.reply_text("не похоже на время... напиши, например, 09:30")
+        await outbox.reply(update.message, "не похоже на время... напиши, например, 09:30")
         return
 
     if "зови меня" in text_in.lower():
@@ -455,34 +462,50 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             name = text_in.split("зови меня", 1)[1].strip(" :,.!?\n\t")
             if name and len(name) <= 50:
                 db.set_name(user_id, name)
-                await update.message.reply_text(f"хорошо, буду звать тебя {name} 💛")
+                await outbox.reply(update.message, f"хорошо, буду звать тебя {name} 💛")
                 return
         except Exception:
             pass
+
+    # Идёт остановка: не начинаем ответ, отвечаем после рестарта
+    if drain.draining():
+        tracing.annotate(outcome="deferred")
+        await drain.defer([{
+            "user_id": user_id, "chat_id": update.effective_chat.id, "text": text_in,
+            "names": drain.names_of(update.effective_user), "charged": 0,
+        }], "draining")
+        return
     
-    # Проверка доступа (подписка или бесплатные сообщения)
-    has_access, u = await check_subscription(user_id)
+    # Проверка доступа и списание бесплатного сообщения — одним запросом
+    with tracing.span("entitlement"):
+        quota = await asyncio.to_thread(db.consume_message_quota, user_id)
     
-    if not has_access:
-        await update.message.reply_text(
+    if not quota.allowed:
+        tracing.annotate(outcome="no_quota")
+        await outbox.reply(update.message, 
             "ой, мы исчерпали время знакомства...\n\n"
             "если хочешь, чтобы я осталась рядом — нажми /subscribe 💛"
         )
         return
-    
-    # Уменьшаем счетчик бесплатных сообщений если нет подписки
-    active, _, _ = _sub_state(u)
-    if not active:
-        db.update_user(user_id, free_left=(u["free_left"] - 1))
 
     # Сохраняем сообщение пользователя
-    db.add_msg(user_id, "user", text_in)
-    
-    # Генерируем ответ
-    db_name = u["name"]
-    msgs, pref_verbosity = build_messages(user_id, db_name, text_in)
+    with tracing.span("store"):
+        await asyncio.to_thread(db.add_msg, user_id, "user", text_in)
+
+    # С этого момента ответ должен дойти: при остановке он отложится, а не потеряется
+    chat_id = update.effective_chat.id
+    await drain.guard(
+        _answer(context, chat_id, user_id, text_in, quota.name, update.effective_user),
+        user_id, chat_id, text_in, drain.names_of(update.effective_user),
+    )
+
+
+async def _answer(context, chat_id: int, user_id: int, text_in: str, db_name: str | None, tg_user):
+    """Генерация и отправка ответа на уже сохранённое сообщение пользователя"""
+    msgs, kind = await build_messages(user_id, db_name, text_in)
+    pref_verbosity = kind.verbosity
+    tracing.annotate(verbosity=pref_verbosity)
     
-    print(f"[BOT] Генерация ответа с verbosity={pref_verbosity}")
 
     try:
         # Определяем max_tokens для разных типов ответов
@@ -494,31 +517,79 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             max_tokens = 800  # Обычные ответы
         
-        reply = await llm.chat(
-            msgs,
-            verbosity=pref_verbosity,
-            max_tokens=max_tokens,
-            safety=True
-        )
+        with tracing.span("llm_total"):
+            reply = await _get_llm().chat(
+                msgs,
+                verbosity=pref_verbosity,
+                max_tokens=max_tokens,
+                safety=True,
+                list_request=kind.list_request,
+                user_id=user_id,
+                kind="chat",
+            )
         
-        reply = _sanitize_name_address(reply, update.effective_user, db_name)
-        print(f"[BOT] Ответ сгенерирован: {len(reply)} символов")
+        with tracing.span("postprocess"):
+            reply = _sanitize_name_address(reply, tg_user, db_name)
         
-    except Exception as e:
-        print(f"[BOT] LLM error: {e}", file=sys.stderr)
-        traceback.print_exc()
+    except Exception:
+        log.exception("ошибка генерации ответа", extra={"user_id": user_id})
         reply = "что-то с интернетом... попробуй ещё раз?"
-
-    # Имитация печати и отправка
-    await human_typing(context, update.effective_chat.id, reply)
-    db.add_msg(user_id, "assistant", reply)
+        tracing.annotate(outcome="llm_error")
+
+    # Имитация печати (при остановке — без неё) и отправка
+    if not drain.draining():
+        with tracing.span("typing"):
+            await human_typing(context, chat_id, reply)
+    drain.delivering()
+    with tracing.span("store"):
+        await asyncio.to_thread(db.add_msg, user_id, "assistant", reply)
     
-    try:
-        await update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN)
-    except Exception as e:
-        print(f"[BOT] Ошибка отправки с Markdown: {e}")
-        # Если ошибка с форматированием - отправляем без него
-        await update.message.reply_text(reply)
+    # Разметка заранее переведена в валидный HTML — отправка с первого раза
+    with tracing.span("send"):
+        await send_text(context.bot, chat_id, reply)
+    tracing.annotate(chars_out=len(reply))
+
+
+@metrics.job("replay")
+async def _replay_pending(context: ContextTypes.DEFAULT_TYPE):
+    """Отвечает на сообщения, отложенные при прошлой остановке (см. app/drain.py)"""
+    dropped = await asyncio.to_thread(db.drop_stale_pending_replies, settings.drain_replay_max_age_sec)
+    if dropped:
+        log.info("отложенные сообщения устарели", extra={"dropped": dropped})
+    rows = await asyncio.to_thread(db.list_pending_replies)
+    by_user = {}
+    for r in rows:
+        by_user.setdefault(r["user_id"], []).append(r)
+    # Разные пользователи — параллельно, сообщения одного — по порядку
+    await asyncio.gather(*(_replay_user(context, items) for items in by_user.values()))
+    if rows:
+        log.info("отложенные сообщения отвечены", extra={"messages": len(rows), "users": len(by_user)})
+
+
+async def _replay_user(context, items):
+    for r in items:
+        user_id, chat_id, text_in = r["user_id"], r["chat_id"], r["text"]
+        try:
+            if r["charged"]:
+                db_name = (await asyncio.to_thread(db.get_user, user_id))["name"]
+            else:
+                quota = await asyncio.to_thread(db.consume_message_quota, user_id)
+                if not quota.allowed:
+                    await asyncio.to_thread(db.delete_pending_reply, r["id"])
+                    continue
+                await asyncio.to_thread(db.add_msg, user_id, "user", text_in)
+                await asyncio.to_thread(db.mark_pending_charged, r["id"])
+                db_name = quota.name
+            tg_user = SimpleNamespace(**json.loads(r["names"])) if r["names"] else None
+            await drain.guard(
+                _answer(context, chat_id, user_id, text_in, db_name, tg_user),
+                user_id, chat_id, text_in, r["names"],
+            )
+            # Отвечено или заново отложено дрейном (новой строкой) — эта больше не нужна.
+            # Упавшее остаётся и повторится после следующего старта, пока не устареет
+            await asyncio.to_thread(db.delete_pending_reply, r["id"])
+        except Exception:
+            log.exception("ошибка ответа на отложенное сообщение", extra={"user_id": user_id})
 
 
 # -------------------- служебные команды (отладка) --------------------
@@ -532,17 +603,117 @@ async def pingme_cmd(update, context):
     when = datetime.now(timezone.utc) + timedelta(minutes=minutes)
 
     async def _once(ctx):
-        await ctx.bot.send_message(chat_id=update.effective_user.id, text="привет! я тут 💛")
+        await outbox.send_message(ctx.bot, update.effective_user.id, "привет! я тут 💛", priority=REMINDER)
 
     context.job_queue.run_once(_once, when=when, data={}, name=f"ping:{update.effective_user.id}")
-    await update.message.reply_text(f"окей, напишу через {minutes} мин.")
+    await outbox.reply(update.message, f"окей, напишу через {minutes} мин.")
+
+
+async def loopmon_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Монитор event loop: статус и переключение (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    await outbox.reply(update.message, loopmon.apply_command(list(context.args or [])))
+
+
+async def usage_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Расход токенов: /usage [дней] или /usage user <id> [дней] (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    args = list(context.args or [])
+    await usage.flush()
+    try:
+        if args[:1] == ["user"] and len(args) >= 2:
+            days = int(args[2]) if len(args) > 2 else 7
+            text = await asyncio.to_thread(usage.user_text, int(args[1]), days)
+        else:
+            days = int(args[0]) if args else 1
+            text = await asyncio.to_thread(usage.summary_text, days)
+    except ValueError:
+        text = "использование: /usage [дней] или /usage user <id> [дней]"
+    await outbox.reply(update.message, text)
+
+
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск по истории: /search <слова> или /search user <id> <слова> (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    args = list(context.args or [])
+    user_id = None
+    if args[:1] == ["user"] and len(args) >= 2 and args[1].isdigit():
+        user_id, args = int(args[1]), args[2:]
+    if not args:
+        await outbox.reply(update.message, "использование: /search <слова> или /search user <id> <слова>")
+        return
+    rows = await asyncio.to_thread(db.search_messages, " ".join(args), user_id, 15)
+    if not rows:
+        await outbox.reply(update.message, "ничего не нашлось")
+        return
+    lines = [f"#{r['id']} {r['user_id']} {r['role']} {r['ts']}: {r['snippet']}" for r in rows]
+    await outbox.reply(update.message, "\n".join(lines)[:4000])
+
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Рассылка (только для админов): /broadcast [фильтры] и текст со следующей строки —
+    черновик с числом получателей и кнопкой запуска; /broadcast list | pause | resume | cancel <id>
+    """
+    if not is_admin(update.effective_user.id):
+        return
+    head, _, body = (update.message.text or "").partition("\n")
+    args, body = head.split()[1:], body.strip()
+
+    if not body:
+        if args[:1] == ["list"] or not args:
+            rows = await asyncio.to_thread(db.list_broadcasts, 5)
+            text = "\n".join(broadcast.describe(b) for b in rows) or "рассылок ещё не было"
+            await outbox.reply(update.message, text if args else f"{text}\n\n{broadcast.USAGE}")
+            return
+        if len(args) == 2 and args[0] in ("pause", "resume", "cancel") and args[1].isdigit():
+            bid = int(args[1])
+            if args[0] == "pause":
+                ok = await broadcast.pause(bid)
+            elif args[0] == "resume":
+                ok = await broadcast.start(context.application, bid)
+            else:
+                ok = await broadcast.cancel(bid)
+            b = await asyncio.to_thread(db.get_broadcast, bid)
+            text = broadcast.describe(b) if b else f"нет рассылки #{bid}"
+            await outbox.reply(update.message, text if ok else f"не получилось: {text}")
+            return
+        await outbox.reply(update.message, broadcast.USAGE)
+        return
+
+    try:
+        segment = broadcast.parse_segment(args)
+    except ValueError as e:
+        await outbox.reply(update.message, f"{e}\n\n{broadcast.USAGE}")
+        return
+    b = await broadcast.create(body, segment, update.effective_user.id)
+    await outbox.reply(
+        update.message,
+        f"черновик #{b['id']}: получателей {b['total']} ({broadcast.describe_segment(segment)})\n\n{body}"[:4000],
+        reply_markup=broadcast.draft_keyboard(b["id"]),
+    )
+
+
+async def on_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пользователь заблокировал/разблокировал бота — рассылки его пропускают/снова включают"""
+    change = update.my_chat_member
+    if change is None or change.chat.type != "private":
+        return
+    status = change.new_chat_member.status
+    if status in ("kicked", "left"):
+        await asyncio.to_thread(db.set_blocked, change.chat.id, True)
+    elif status == "member":
+        await asyncio.to_thread(db.set_blocked, change.chat.id, False)
 
 
 async def jobs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает запланированные задачи"""
     jq = context.application.job_queue
     if jq is None:
-        await update.message.reply_text("JobQueue не работает...")
+        await outbox.reply(update.message, "JobQueue не работает...")
         return
 
     user_id = update.effective_user.id
@@ -551,7 +722,7 @@ async def jobs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     rems = db.list_reminders(user_id)
     if not rems:
-        await update.message.reply_text("у тебя пока нет напоминаний. добавь их в /reminders 🌿")
+        await outbox.reply(update.message, "у тебя пока нет напоминаний. добавь их в /reminders 🌿")
         return
 
     lines = []
@@ -567,22 +738,64 @@ async def jobs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             lines.append(f"{r['time_local']} ({r.get('rtype') or 'checkin'}, {state}) → не запланировано")
 
-    await update.message.reply_text("запланировано:\n" + "\n".join(lines))
+    await outbox.reply(update.message, "запланировано:\n" + "\n".join(lines))
 
 
 # -------------------- main --------------------
 
-def main():
-    """Точка входа"""
-    if not settings.telegram_bot_token:
-        print("Ошибка: TELEGRAM_BOT_TOKEN не задан в .env файле")
-        return
-    
-    if not settings.openai_api_key:
-        print("Ошибка: OPENAI_API_KEY не задан в .env файле")
-        return
-    
-    app = Application.builder().token(settings.telegram_bot_token).build()
+async def _post_init(app: Application):
+    global _llm_warmup
+    t0 = time.perf_counter()
+    db.init()
+    t_db = time.perf_counter()
+    await metrics.start()
+    loopmon.monitor.start(enabled=settings.loopmon_enabled)
+    summarizer.start()
+    drain.install(app)
+    if settings.openai_api_key:
+        # openai импортируется ~0.5 с — грузим в потоке, а не в первом ответе на event loop
+        _llm_warmup = asyncio.get_running_loop().run_in_executor(None, _get_llm)
+        _llm_warmup.add_done_callback(_warmup_done)
+    if app.job_queue is not None:
+        app.job_queue.run_once(_replay_pending, when=3, name="replay:pending")
+    ready = time.perf_counter()
+    phases = {"import": _IMPORTED - STARTED, "db_init": t_db - t0, "ready": ready - STARTED}
+    for phase, seconds in phases.items():
+        STARTUP.set(seconds, phase)
+    log.info("готов к опросу", extra={f"{k}_ms": round(v * 1e3) for k, v in phases.items()})
+
+
+async def _post_shutdown(app: Application):
+    from .llm_client import close as close_llm
+
+    await summarizer.stop()
+    await usage.flush()
+    if _llm_warmup is not None:
+        # Иначе поток может создать клиент уже после close_llm — и он не закроется
+        await asyncio.wait([_llm_warmup])
+    await close_llm()
+    drain.finish()
+    loopmon.monitor.stop()
+    await metrics.stop()
+
+
+def build_app(request=None, get_updates_request=None) -> Application:
+    """
+    Собирает Application со всеми обработчиками.
+    request/get_updates_request — свои транспорты Bot API (используются нагрузочным стендом).
+    """
+    builder = (
+        Application.builder().token(settings.telegram_bot_token)
+        .post_init(_post_init).post_shutdown(_post_shutdown)
+        .persistence(persistence.UserFlagsPersistence())
+    )
+    if settings.concurrent_updates:
+        builder = builder.concurrent_updates(settings.concurrent_updates)
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    app = builder.build()
 
     # Основные команды
     app.add_handler(CommandHandler("start", start))
@@ -595,19 +808,48 @@ def main():
     # Отладочные команды
     app.add_handler(CommandHandler("pingme", pingme_cmd))
     app.add_handler(CommandHandler("jobs", jobs_cmd))
+    app.add_handler(CommandHandler("loopmon", loopmon_cmd))
+    app.add_handler(CommandHandler("usage", usage_cmd))
+    app.add_handler(CommandHandler("search", search_cmd))
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd))
 
     # Обработчики callback'ов
     app.add_handler(CallbackQueryHandler(on_cb))
 
+    # Заблокировал/разблокировал бота
+    app.add_handler(ChatMemberHandler(on_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
+
     # Обработчики платежей
     app.add_handler(PreCheckoutQueryHandler(precheckout_stars))
     app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, on_successful_payment))
+    schedule_payment_expiry(app)
+    usage.schedule_flush(app)
+    archive.schedule_archive(app)
+    persistence.schedule_evict(app)
+    broadcast.schedule_resume(app)
+    if app.job_queue is not None:
+        JOBS_SCHEDULED.set_function(lambda: len(app.job_queue.jobs()))
 
     # Обработчик текстовых сообщений
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    return app
+
+
+def main():
+    """Точка входа"""
+    logs.setup()
+    if not settings.telegram_bot_token:
+        log.error("TELEGRAM_BOT_TOKEN не задан в .env файле")
+        return
+    
+    if not settings.openai_api_key:
+        log.error("OPENAI_API_KEY не задан в .env файле")
+        return
     
-    print("Бот запущен...")
-    app.run_polling()
+    app = build_app()
+    log.info("бот запущен")
+    # Сигналы остановки перехватывает drain.install (в _post_init)
+    app.run_polling(stop_signals=None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+# app/broadcast.py
+"""
+Рассылки объявлений и акций администраторами (/broadcast).
+
+- Получатели читаются страницами по курсору user_id (WHERE user_id > курсор
+  ORDER BY user_id LIMIT BROADCAST_PAGE) — в памяти одна страница, а не
+  вся таблица users; фильтры сегмента — в том же запросе (db._segment_sql).
+- Отправка через outbox с приоритетом BROADCAST и собственным темпом
+  BROADCAST_RATE: ответы в диалогах идут первыми и не упираются в лимит.
+- После каждой страницы прогресс (курсор и счётчики) пишется в broadcasts:
+  пауза, отмена и рестарт продолжают с места остановки. Курсор двигается
+  только по непрерывно обработанному началу страницы — повторно отправляется
+  лишь то, что не успело уйти.
+- Forbidden (бот заблокирован) и «chat not found» помечают users.blocked —
+  следующие рассылки таких пропускают. Снимается флаг, когда пользователь
+  снова пишет или разблокирует бота (my_chat_member).
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import Application, ContextTypes
+
+from .config import settings
+from .metrics import Counter, Gauge, job
+from .outbox import BROADCAST, INTERACTIVE, TokenBucket, outbox
+from .render import send_text
+import app.db as db
+
+log = logging.getLogger(__name__)
+
+BROADCAST_MESSAGES = Counter("alina_broadcast_messages_total", "Сообщения рассылок: sent, failed, blocked", ("result",))
+BROADCASTS_RUNNING = Gauge("alina_broadcasts_running", "Рассылок, которые сейчас отправляются")
+
+_GRACE = 5.0        # сек: дождаться уже поставленных в очередь отправок при паузе/остановке
+
+_tasks: Dict[int, asyncio.Task] = {}
+BROADCASTS_RUNNING.set_function(lambda: len(_tasks))
+
+USAGE = (
+    "использование:\n"
+    "/broadcast [фильтры]\n<текст со следующей строки>\n"
+    "фильтры: subscribed=yes|no free_left=N tz=Europe/Moscow|Europe/* active=ДНЕЙ idle=ДНЕЙ\n"
+    "/broadcast list | pause <id> | resume <id> | cancel <id>"
+)
+
+
+# ---------- сегмент ----------
+
+_SEGMENT_KEYS = {"subscribed", "free_left", "tz", "active", "idle"}
+
+
+def parse_segment(args: List[str]) -> Dict:
+    """
+    Фильтры вида key=value → словарь для db._segment_sql:
+    subscribed=yes|no — с подпиской / без; free_left=N — осталось не больше N
+    бесплатных; tz=Europe/Moscow или tz=Europe/* — часовой пояс (не задан — UTC);
+    active=N — писал за последние N дней; idle=N — не писал N дней и больше.
+    """
+    segment: Dict = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep or key not in _SEGMENT_KEYS or not value:
+            raise ValueError(f"непонятный фильтр: {arg}")
+        if key == "subscribed":
+            if value not in ("yes", "no"):
+                raise ValueError("subscribed=yes или subscribed=no")
+            segment[key] = value == "yes"
+        elif key == "tz":
+            segment[key] = value
+        else:
+            if not value.isdigit():
+                raise ValueError(f"{key}: нужно целое число")
+            segment[key] = int(value)
+    return segment
+
+
+def describe_segment(segment: Dict) -> str:
+    if not segment:
+        return "все"
+    parts = []
+    for k, v in segment.items():
+        parts.append(f"{k}={'yes' if v is True else 'no' if v is False else v}")
+    return " ".join(parts)
+
+
+def describe(b: Dict) -> str:
+    done = b["sent"] + b["failed"] + b["blocked"]
+    return (f"#{b['id']} {b['status']}: {done}/{b['total']} "
+            f"(отправлено {b['sent']}, ошибок {b['failed']}, заблокировали {b['blocked']}) "
+            f"— {describe_segment(b['segment'])}")
+
+
+def draft_keyboard(bid: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("▶️ запустить", callback_data=f"bc|go|{bid}"),
+        InlineKeyboardButton("✖️ отменить", callback_data=f"bc|cancel|{bid}"),
+    ]])
+
+
+async def create(body: str, segment: Dict, created_by: int) -> Dict:
+    """Черновик рассылки с оценкой числа получателей"""
+    total = await asyncio.to_thread(db.broadcast_audience, segment)
+    bid = await asyncio.to_thread(db.create_broadcast, body, segment, total, created_by)
+    return await asyncio.to_thread(db.get_broadcast, bid)
+
+
+# ---------- управление ----------
+
+async def start(app: Application, bid: int) -> bool:
+    """Запускает черновик или продолжает приостановленную рассылку"""
+    if not await asyncio.to_thread(db.set_broadcast_status, bid, "running", ("draft", "paused")):
+        return False
+    _spawn(app, bid)
+    return True
+
+
+async def pause(bid: int) -> bool:
+    if not await asyncio.to_thread(db.set_broadcast_status, bid, "paused", ("running",)):
+        return False
+    await _stop(bid)
+    return True
+
+
+async def cancel(bid: int) -> bool:
+    if not await asyncio.to_thread(db.set_broadcast_status, bid, "cancelled", ("draft", "running", "paused")):
+        return False
+    await _stop(bid)
+    return True
+
+
+async def stop_all():
+    """Остановка процесса: задачи прерываются, статус running остаётся — после старта продолжатся"""
+    await asyncio.gather(*(_stop(bid) for bid in list(_tasks)))
+
+
+def _spawn(app: Application, bid: int):
+    if bid in _tasks:
+        return
+    task = asyncio.get_running_loop().create_task(_run(app, bid), name=f"broadcast:{bid}")
+    _tasks[bid] = task
+    task.add_done_callback(lambda _t: _tasks.pop(bid, None))
+
+
+async def _stop(bid: int):
+    task = _tasks.get(bid)
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.wait([task])
+
+
+# ---------- отправка ----------
+
+def _unreachable(e: Exception) -> bool:
+    """Пользователь заблокировал бота или чата больше нет"""
+    return isinstance(e, Forbidden) or (isinstance(e, BadRequest) and "chat not found" in str(e).lower())
+
+
+async def _deliver(bot, user_id: int, body: str, results: Dict[int, str]):
+    try:
+        await send_text(bot, user_id, body, priority=BROADCAST)
+        results[user_id] = "sent"
+    except Exception as e:
+        if _unreachable(e):
+            results[user_id] = "blocked"
+        else:
+            log.warning("рассылка: не удалось отправить", extra={"user_id": user_id, "error": str(e)})
+            results[user_id] = "failed"
+
+
+async def _send_page(bot, body: str, ids: List[int], bucket: TokenBucket, results: Dict[int, str]):
+    started: List[asyncio.Task] = []
+    loop = asyncio.get_running_loop()
+    try:
+        for user_id in ids:
+            wait = bucket.delay(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            bucket.take(time.monotonic())
+            started.append(loop.create_task(_deliver(bot, user_id, body, results)))
+        await asyncio.wait(started)
+    except asyncio.CancelledError:
+        # Уже поставленные в очередь дожидаемся: иначе после продолжения они уйдут второй раз
+        if started:
+            _, pending = await asyncio.wait(started, timeout=_GRACE)
+            # Не успевшие за _GRACE отменяем: задание outbox с отменённым future не уйдёт,
+            # а без записи в results курсор остановится перед ними
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        raise
+
+
+def _progress(ids: List[int], results: Dict[int, str]):
+    """Курсор по непрерывно обработанному началу страницы и счётчики до него"""
+    cursor, counts = None, {"sent": 0, "failed": 0}
+    for user_id in ids:
+        if user_id not in results:
+            break
+        cursor = user_id
+        if results[user_id] in counts:
+            counts[results[user_id]] += 1
+    # Заблокировавших учитываем всех: при повторе страницы их уже не выберет запрос
+    blocked_ids = [u for u, r in results.items() if r == "blocked"]
+    counts["blocked"] = len(blocked_ids)
+    return cursor, counts, blocked_ids
+
+
+async def _checkpoint(bid: int, ids: List[int], results: Dict[int, str]):
+    cursor, counts, blocked_ids = _progress(ids, results)
+    if cursor is None and not blocked_ids:
+        return
+    for result, n in counts.items():
+        if n:
+            BROADCAST_MESSAGES.inc(result, amount=n)
+    await asyncio.to_thread(db.broadcast_checkpoint, bid, cursor or 0, counts["sent"],
+                            counts["failed"], counts["blocked"], blocked_ids)
+
+
+async def _run(app: Application, bid: int):
+    b = await asyncio.to_thread(db.get_broadcast, bid)
+    if b is None or b["status"] != "running":
+        return
+    log.info("рассылка: старт", extra={"broadcast": bid, "cursor": b["cursor"], "total": b["total"]})
+    rate = max(0.1, settings.broadcast_rate)
+    bucket = TokenBucket(rate, 1.0, time.monotonic())
+    cursor = b["cursor"]
+    try:
+        while True:
+            ids = await asyncio.to_thread(db.broadcast_page, b["segment"], cursor, settings.broadcast_page)
+            if not ids:
+                break
+            results: Dict[int, str] = {}
+            try:
+                await _send_page(app.bot, b["text"], ids, bucket, results)
+            finally:
+                await _checkpoint(bid, ids, results)
+            cursor = ids[-1]
+    except asyncio.CancelledError:
+        log.info("рассылка: остановлена", extra={"broadcast": bid})
+        raise
+    except Exception:
+        # На паузу, чтобы не падать заново на каждом старте; продолжить — /broadcast resume
+        log.exception("рассылка упала", extra={"broadcast": bid})
+        await asyncio.to_thread(db.set_broadcast_status, bid, "paused", ("running",))
+        return
+
+    if not await asyncio.to_thread(db.set_broadcast_status, bid, "done", ("running",)):
+        return
+    b = await asyncio.to_thread(db.get_broadcast, bid)
+    log.info("рассылка: завершена", extra={k: b[k] for k in ("sent", "failed", "blocked")} | {"broadcast": bid})
+    if b["created_by"]:
+        try:
+            await outbox.send_message(app.bot, b["created_by"], "рассылка завершена\n" + describe(b),
+                                      priority=INTERACTIVE)
+        except Exception:
+            log.warning("не удалось сообщить о завершении рассылки", extra={"broadcast": bid})
+
+
+# ---------- после старта ----------
+
+@job("broadcast_resume")
+async def _resume_job(context: ContextTypes.DEFAULT_TYPE):
+    for b in await asyncio.to_thread(db.list_broadcasts, 100, "running"):
+        log.info("рассылка: продолжаем после рестарта", extra={"broadcast": b["id"], "cursor": b["cursor"]})
+        _spawn(context.application, b["id"])
+
+
+def schedule_resume(app: Application):
+    jq = getattr(app, "job_queue", None)
+    if jq is None:
+        return
+    # Не сразу: сначала отвечаем тем, кто писал во время рестарта
+    jq.run_once(_resume_job, when=15, name="broadcast:resume")
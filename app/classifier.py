@@ -0,0 +1,127 @@
+# app/classifier.py
+"""
+Однопроходный классификатор входящего сообщения.
+
+Все ключевые слова собраны в одно регулярное выражение (альтернации
+свёрнуты в префиксное дерево), которое компилируется один раз при импорте. За один проход по тексту
+получаем все флаги: технический вопрос, просьба о списке, нужная длина ответа.
+
+Ключи трёх видов:
+- основы слов (рус. «алгоритм» → «алгоритмы», «алгоритмом») — совпадение с начала слова;
+- целые слова («if», «ai», «ml») — только отдельным словом, не внутри «gift» или «email»;
+- фрагменты кода («```», «console.log») — где угодно.
+"""
+from __future__ import annotations
+import re
+from typing import Dict, FrozenSet, Iterable, NamedTuple
+
+TECH = "tech"
+LIST = "list"
+LONG = "long"
+
+# Основы: совпадают с начала слова
+_STEMS: Dict[str, FrozenSet[str]] = {}
+# Целые слова
+_WORDS: Dict[str, FrozenSet[str]] = {}
+# Фрагменты кода — без границ слова
+_CODE: Dict[str, FrozenSet[str]] = {}
+
+
+def _add(table: Dict[str, FrozenSet[str]], keys: Iterable[str], flag: str):
+    for k in keys:
+        table[k] = table.get(k, frozenset()) | {flag}
+
+
+_add(_STEMS, [
+    "алгоритм", "код", "программ", "функци", "класс", "метод", "массив", "цикл",
+    "дейкстр", "граф", "дерев", "хеш", "сложност",
+    "база данн", "баз данн", "таблиц", "запрос", "индекс",
+    "компил", "интерпрет", "матриц", "вектор", "интеграл", "производн", "уравнен", "формул",
+    "машинн", "нейрон", "датасет", "модел", "обучен",
+    "структур данн", "стек", "очеред", "связн списк", "рекурс",
+    "javascript", "python", "debug", "docker", "function",
+], TECH)
+_add(_WORDS, [
+    "java", "sql", "for", "while", "if", "big o", "join", "select",
+    "git", "api", "rest", "ml", "ai", "import", "return",
+], TECH)
+_add(_CODE, ["```", "def ", "class ", "console.log", "o(n)"], TECH)
+
+# Просьба о списке — подсказка модели ставить пункты с новой строки
+_add(_STEMS, ["факт", "пункт", "список", "причин", "способ"], LIST)
+
+# Признаки того, что нужен длинный ответ
+_add(_STEMS, ["много", "несколько", "факт", "список"], LONG)
+_add(_WORDS, ["15", "20"], LONG)
+
+
+# Основы, которые не должны срабатывать на похожих бытовых словах:
+# «дерево», но не «деревня»; «классы», но не «классно»; «граф», но не «график»
+_STEM_EXCLUDE = {"дерев": "н", "класс": "н", "очеред": "н", "граф": "и", "стек": "л"}
+
+
+def _trie_regex(keys: Iterable[str], exclude: Dict[str, str] | None = None) -> str:
+    """
+    Альтернация ключей в виде префиксного дерева: «алгоритм|алгебр» → «алг(?:оритм|ебр)».
+    Движку re не приходится заново сравнивать общие префиксы на каждой позиции.
+    """
+    exclude = exclude or {}
+    root: dict = {}
+    for k in keys:
+        node = root
+        for ch in k:
+            node = node.setdefault(ch, {})
+        node[""] = k
+
+    def build(node: dict) -> str:
+        alts = [re.escape(ch) + build(node[ch]) for ch in sorted(node) if ch]
+        inner = alts[0] if len(alts) == 1 else "(?:%s)" % "|".join(alts)
+        if "" not in node:
+            return inner
+        stop = exclude.get(node[""])
+        end = "(?![%s])" % re.escape(stop) if stop else ""
+        if not alts:
+            return end
+        return "(?:%s|%s)" % (inner, end) if end else "(?:%s)?" % inner
+
+    return build(root)
+
+
+# Все ключи начинаются и заканчиваются буквой/цифрой, поэтому \b = граница слова
+_PATTERN = re.compile(
+    r"\b(?:(?P<stem>%s)\w*|(?P<word>%s)\b)|(?P<code>%s)" % (
+        _trie_regex(_STEMS, _STEM_EXCLUDE),
+        _trie_regex(_WORDS),
+        _trie_regex(_CODE),
+    )
+)
+
+_TABLES = {"stem": _STEMS, "word": _WORDS, "code": _CODE}
+_ALL_FLAGS = frozenset({TECH, LIST, LONG})
+
+
+class Classification(NamedTuple):
+    tech: bool
+    list_request: bool
+    verbosity: str          # "short" | "normal" | "long"
+
+
+def classify(text: str) -> Classification:
+    """Один проход регулярки по тексту → все флаги сразу"""
+    if not text:
+        return Classification(False, False, "normal")
+    found = set()
+    for m in _PATTERN.finditer(text.lower()):
+        kind = m.lastgroup
+        found |= _TABLES[kind][m.group(kind)]
+        if found == _ALL_FLAGS:
+            break
+
+    tech = TECH in found
+    if tech:
+        verbosity = "short"
+    elif LONG in found:
+        verbosity = "long"      # Для длинных списков
+    else:
+        verbosity = "normal"
+    return Classification(tech, LIST in found, verbosity)
@@ -0,0 +1,141 @@
+# app/codec.py
+"""
+Сжатие длинных сообщений в таблице messages.
+
+Кириллица в UTF-8 — 2 байта на символ, и длинные ответы (verbosity=long)
+раздувают таблицу и её кэш страниц. Сообщения от MSG_COMPRESS_MIN байт
+add_msg пишет как raw deflate (zlib) с общим словарём: messages.codec —
+номер словаря (app/zdict/<n>.txt), NULL — обычный текст. Словарь
+заполняет окно deflate лексикой Алины, поэтому жмутся и короткие
+ответы, на которых zlib без словаря почти ничего не выигрывает.
+
+Словари только добавляются: старые номера нужны для чтения уже
+записанных строк. Новый словарь из реальной истории — `train`,
+переход на него — MSG_CODEC=<n>.
+
+По умолчанию выключено (MSG_CODEC=0): распаковка на каждом чтении истории
+почти втрое замедляет last_dialog (bench/codec.py) — включать, когда
+кэш страниц горячей messages важнее задержки. Общий размер базы сжатие
+не уменьшает: полнотекстовому индексу нужен обычный текст, и для сжатых
+строк он лежит в messages_fts_text. Схема от сжатия не зависит — писать
+в messages может любой клиент SQLite.
+
+    python -m app.codec compress|decompress [--batch N]   — пережать историю
+    python -m app.codec train --out app/zdict/2.txt         — словарь по истории
+    python -m app.codec stats
+"""
+from __future__ import annotations
+import functools
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, Optional, Tuple, Union
+
+from .config import settings
+
+DICT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zdict")
+MAX_DICT = 32 * 1024        # окно deflate: больше словарь не используется
+_WBITS = -15                # raw deflate: без заголовка и контрольной суммы
+
+
+@functools.lru_cache(maxsize=None)
+def zdict(version: int) -> bytes:
+    with open(os.path.join(DICT_DIR, f"{version}.txt"), "rb") as f:
+        return f.read()[-MAX_DICT:]
+
+
+def encode(content: str) -> Tuple[Union[str, bytes], Optional[int]]:
+    """Текст → (значение для messages.content, codec)"""
+    raw = content.encode()
+    version = settings.msg_codec
+    if not version or len(raw) < settings.msg_compress_min:
+        return content, None
+    c = zlib.compressobj(6, zlib.DEFLATED, _WBITS, zdict=zdict(version))
+    data = c.compress(raw) + c.flush()
+    # Почти не сжалось — не платим за распаковку при каждом чтении
+    if len(data) > len(raw) * 0.9:
+        return content, None
+    return data, version
+
+
+def decode(value, codec: Optional[int]) -> Optional[str]:
+    if codec is None or value is None:
+        return value
+    d = zlib.decompressobj(_WBITS, zdict=zdict(codec))
+    return (d.decompress(value) + d.flush()).decode()
+
+
+_WORDS = re.compile(r"\w+[^\w\n]{0,3}")
+
+
+def train(samples: Iterable[str], size: int = 16 * 1024) -> bytes:
+    """
+    Словарь из частых фраз (1–3 слова): чем полезнее фраза (частота ×
+    длина), тем ближе к концу словаря — deflate дешевле ссылается на
+    близкие совпадения.
+    """
+    counts: Counter = Counter()
+    for text in samples:
+        words = _WORDS.findall(text.lower())
+        for n in (1, 2, 3):
+            for i in range(len(words) - n + 1):
+                counts["".join(words[i:i + n])] += 1
+    scored = sorted(
+        ((c * len(p.encode()), p) for p, c in counts.items() if c > 1 and len(p) > 3),
+        reverse=True,
+    )
+    out, used = [], 0
+    for _, phrase in scored:
+        b = phrase.encode()
+        if used + len(b) > size:
+            break
+        out.append(b)
+        used += len(b)
+    return b"".join(reversed(out))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import app.db as db
+
+    ap = argparse.ArgumentParser(prog="python -m app.codec")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("compress", "decompress"):
+        p = sub.add_parser(name)
+        p.add_argument("--batch", type=int, default=1000)
+    tr = sub.add_parser("train")
+    tr.add_argument("--out", required=True)
+    tr.add_argument("--samples", type=int, default=20000)
+    tr.add_argument("--size", type=int, default=16 * 1024)
+    sub.add_parser("stats")
+    args = ap.parse_args()
+
+    db.init()
+    if args.cmd in ("compress", "decompress"):
+        total, after = 0, 0
+        while True:
+            rows = db.messages_for_recode(after, args.batch, compressed=args.cmd == "decompress")
+            if not rows:
+                break
+            after = rows[-1]["id"]
+            updates = []
+            for r in rows:
+                text = decode(r["content"], r["codec"])
+                value, codec = encode(text) if args.cmd == "compress" else (text, None)
+                if codec != r["codec"]:
+                    updates.append({"id": r["id"], "c": value, "codec": codec})
+            db.set_message_contents(updates)
+            total += len(updates)
+            time.sleep(0.01)
+        print(f"перезаписано сообщений: {total}")
+    elif args.cmd == "train":
+        data = train(db.message_samples(args.samples), args.size)
+        with open(args.out, "wb") as f:
+            f.write(data)
+        print(f"словарь {len(data)} байт → {args.out}")
+    else:
+        for r in db.message_size_stats():
+            print(f"codec={r['codec']}: {r['n']} сообщений, {r['bytes'] / 2**20:.1f} МБ")
@@ -10,9 +10,17 @@ class Settings(BaseModel):
     telegram_bot_token: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
     free_messages: int = int(os.getenv("FREE_MESSAGES", "10"))
 
+    # Обработка апдейтов: 0 — строго по одному (по умолчанию PTB), N — до N параллельно
+    concurrent_updates: int = int(os.getenv("CONCURRENT_UPDATES", "0"))
+
+    # База данных
+    database_url: str = os.getenv("DATABASE_URL", "sqlite:///alina.db")
+
     # OpenAI API (используем gpt-4o-mini для быстрых ответов)
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    # Свой адрес OpenAI-совместимого API (например, локальный фейк для нагрузочных тестов)
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")
     
     # Прокси настройки (аналогично ai-synthesizer)
     openai_use_proxy: bool = os.getenv("OPENAI_USE_PROXY", "false").lower() == "true"
@@ -27,4 +35,94 @@ class Settings(BaseModel):
     sub_days_week: int = int(os.getenv("SUB_DAYS_WEEK", "7"))
     sub_days_month: int = int(os.getenv("SUB_DAYS_MONTH", "30"))
 
+    # Множитель имитации набора текста (0 — отвечать сразу)
+    typing_delay_scale: float = float(os.getenv("TYPING_DELAY_SCALE", "1"))
+
+    # Лимиты исходящих сообщений (Telegram: ~30/с на бота, ~1/с в чат)
+    outbox_global_rate: float = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+    outbox_chat_rate: float = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+    outbox_chat_burst: float = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+
+    # Рассылки (см. app/broadcast.py): темп ниже OUTBOX_GLOBAL_RATE, чтобы
+    # ответам в диалогах оставался запас, и размер страницы получателей
+    broadcast_rate: float = float(os.getenv("BROADCAST_RATE", "15"))
+    broadcast_page: int = int(os.getenv("BROADCAST_PAGE", "200"))
+
+    # Неоплаченные инвойсы старше этого срока помечаются expired
+    payment_pending_ttl_hours: int = int(os.getenv("PAYMENT_PENDING_TTL_HOURS", "24"))
+
+    # Цены LLM, USD за 1M токенов "модель=вход/выход" — для учёта стоимости (app/usage.py)
+    llm_prices: str = os.getenv("LLM_PRICES", "gpt-4o-mini=0.15/0.60,gpt-4o=2.50/10.00")
+    usage_flush_sec: int = int(os.getenv("USAGE_FLUSH_SEC", "60"))
+
+    # Конспект старой истории (app/summarizer.py): в промпт идёт конспект +
+    # не больше RECENT_WINDOW + SUMMARY_BATCH последних сообщений
+    summary_enabled: bool = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+    summary_model: str = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+    recent_window: int = int(os.getenv("RECENT_WINDOW", "12"))
+    summary_batch: int = int(os.getenv("SUMMARY_BATCH", "8"))
+    summary_max_chars: int = int(os.getenv("SUMMARY_MAX_CHARS", "1200"))
+
+    # Долговременная память (app/memory.py, нужен numpy): что пользователь
+    # рассказывал давно, подмешивается в промпт по похожести на новое сообщение.
+    # Выключена по умолчанию
+    memory_enabled: bool = os.getenv("MEMORY_ENABLED", "false").lower() == "true"
+    memory_path: str = os.getenv("MEMORY_PATH", "memory/vectors.f32")
+    memory_top_k: int = int(os.getenv("MEMORY_TOP_K", "3"))
+    memory_min_score: float = float(os.getenv("MEMORY_MIN_SCORE", "0.35"))
+    memory_min_chars: int = int(os.getenv("MEMORY_MIN_CHARS", "25"))
+    memory_scan_limit: int = int(os.getenv("MEMORY_SCAN_LIMIT", "20000"))
+    memory_cache_users: int = int(os.getenv("MEMORY_CACHE_USERS", "2000"))
+
+    # Сжатие длинных сообщений в messages (app/codec.py): номер словаря
+    # app/zdict/<n>.txt для новых записей (0 — не сжимать) и порог в байтах.
+    # Выключено по умолчанию: распаковка удорожает каждое чтение истории
+    msg_codec: int = int(os.getenv("MSG_CODEC", "0"))
+    msg_compress_min: int = int(os.getenv("MSG_COMPRESS_MIN", "400"))
+
+    # Архив холодной истории (app/archive.py): сообщения старше ARCHIVE_AFTER_DAYS
+    # переносятся из messages в сжатые JSONL-сегменты по дням вместо удаления
+    archive_enabled: bool = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+    archive_dir: str = os.getenv("ARCHIVE_DIR", "archive")
+    archive_after_days: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    archive_batch: int = int(os.getenv("ARCHIVE_BATCH", "5000"))
+    archive_interval_sec: int = int(os.getenv("ARCHIVE_INTERVAL_SEC", "21600"))
+    # С архивом в messages остаётся не больше стольких последних сообщений
+    # пользователя (более старые уходят в архив раньше срока; 0 — без лимита)
+    archive_keep_per_user: int = int(os.getenv("ARCHIVE_KEEP_PER_USER", "2000"))
+
+    # Плавная остановка (см. app/drain.py): сколько ждать начатые ответы
+    # после SIGTERM — меньше, чем даёт оркестратор до SIGKILL
+    drain_deadline_sec: float = float(os.getenv("DRAIN_DEADLINE_SEC", "20"))
+    # Отложенные при остановке сообщения старше этого после рестарта не отвечаем
+    drain_replay_max_age_sec: int = int(os.getenv("DRAIN_REPLAY_MAX_AGE_SEC", "3600"))
+
+    # Флаги диалога из user_data в SQLite (см. app/persistence.py): как часто
+    # PTB сбрасывает изменения и через сколько неактивных выгружать из памяти
+    user_flags_flush_sec: float = float(os.getenv("USER_FLAGS_FLUSH_SEC", "5"))
+    user_flags_ttl_sec: int = int(os.getenv("USER_FLAGS_TTL_SEC", "3600"))
+
+    # Трассировка стадий обработки сообщений (записи app.tracing в логе)
+    tracing_enabled: bool = os.getenv("TRACING", "false").lower() == "true"
+
+    # Prometheus /metrics (0 — не поднимать HTTP-сервер)
+    metrics_port: int = int(os.getenv("METRICS_PORT", "0"))
+    metrics_host: str = os.getenv("METRICS_HOST", "127.0.0.1")
+
+    # Логирование (см. app/logs.py)
+    log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    log_levels: str = os.getenv("LOG_LEVELS", "httpx=WARNING,apscheduler=WARNING")
+    log_format: str = os.getenv("LOG_FORMAT", "json")
+    log_debug_sample: float = float(os.getenv("LOG_DEBUG_SAMPLE", "0.1"))
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    # Администраторы (служебные команды), через запятую
+    admin_ids: list[int] = [int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x]
+
+    # Монитор затыков event loop (см. app/loopmon.py)
+    loopmon_enabled: bool = os.getenv("LOOPMON", "true").lower() == "true"
+    loopmon_threshold_ms: int = int(os.getenv("LOOPMON_THRESHOLD_MS", "250"))
+    loopmon_profile: bool = os.getenv("LOOPMON_PROFILE", "false").lower() == "true"
+    loopmon_profile_dir: str = os.getenv("LOOPMON_PROFILE_DIR", "profiles")
+
 settings = Settings()
\ No newline at end of file
@@ -1,82 +1,52 @@
 # app/db.py
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.engine import Engine
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from datetime import datetime
+from typing import List, Optional, Dict, NamedTuple, Sequence, Tuple
+import json
 import random
+import re
+import time
 
-engine: Engine = create_engine("sqlite:///alina.db", future=True)
+from .config import settings
+from .metrics import Histogram
+from . import codec, memory
 
+engine: Engine = create_engine(settings.database_url, future=True)
 
-def _has_column(conn, table: str, column: str) -> bool:
-    rows = conn.execute(text(f"PRAGMA table_info({table})")).mappings().all()
-    return any(r["name"] == column for r in rows)
 
+def _plain(result, reverse: bool = False) -> List[Dict]:
+    """
+    Результат запроса к messages с content/codec → словари с обычным текстом
+    в content. Через zip по кортежам: dict(RowMapping) в разы дороже, а это
+    горячий путь (last_dialog на каждом ходе).
+    """
+    keys = list(result.keys())
+    rows = result.all()
+    if reverse:
+        rows.reverse()
+    out = []
+    for r in rows:
+        d = dict(zip(keys, r))
+        d["content"] = codec.decode(d["content"], d.pop("codec"))
+        out.append(d)
+    return out
 
-def init():
-    with engine.begin() as conn:
-        # users
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS users(
-            user_id INTEGER PRIMARY KEY,
-            name TEXT,
-            style TEXT DEFAULT 'gentle',
-            verbosity TEXT DEFAULT 'normal',
-            free_left INTEGER DEFAULT 10,
-            is_subscribed INTEGER DEFAULT 0,
-            sub_until DATETIME,
-            tz TEXT,
-            last_cleanup DATETIME DEFAULT CURRENT_TIMESTAMP
-        );"""))
-
-        # messages - с индексом для быстрого поиска
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS messages(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            role TEXT,
-            content TEXT,
-            ts DATETIME DEFAULT CURRENT_TIMESTAMP
-        );"""))
-        
-        # Индекс для оптимизации выборки истории
-        conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS idx_messages_user_ts 
-        ON messages(user_id, ts DESC);
-        """))
+DB_SECONDS = Histogram("alina_db_seconds", "Время операций с базой", ("op",))
+
+
+def _timed(fn):
+    """Время каждого вызова → alina_db_seconds{op=...}"""
+    return DB_SECONDS.time(fn.__name__.lstrip("_"))(fn)
 
-        # payments
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS payments(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            provider TEXT,
-            order_id TEXT,
-            amount INTEGER,
-            currency TEXT,
-            status TEXT,
-            raw TEXT,
-            ts DATETIME DEFAULT CURRENT_TIMESTAMP
-        );"""))
-
-        # reminders
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS reminders(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            rtype TEXT,          -- 'checkin' | 'morning' | 'evening'
-            time_local TEXT,     -- 'HH:MM'
-            active INTEGER DEFAULT 1
-        );"""))
-        
-        # Миграция: добавляем last_cleanup если его нет
-        if not _has_column(conn, "users", "last_cleanup"):
-            # Добавляем колонку без DEFAULT
-            conn.execute(text("ALTER TABLE users ADD COLUMN last_cleanup DATETIME;"))
-            # Обновляем существующие записи текущим временем
-            conn.execute(text("UPDATE users SET last_cleanup = CURRENT_TIMESTAMP WHERE last_cleanup IS NULL;"))
+
+def init():
+    """Приводит схему к актуальной версии (см. app/migrations.py)"""
+    from .migrations import migrate
+    migrate(engine)
 
 
+@_timed
 def get_user(user_id: int):
     from .config import settings
     with engine.begin() as conn:
@@ -92,6 +62,7 @@ def get_user(user_id: int):
         return row
 
 
+@_timed
 def update_user(user_id: int, **fields):
     if not fields:
         return
@@ -101,21 +72,170 @@ def update_user(user_id: int, **fields):
         conn.execute(text(f"UPDATE users SET {sets} WHERE user_id=:u"), fields)
 
 
+class Quota(NamedTuple):
+    """Результат списания сообщения: можно ли отвечать и в каком статусе пользователь"""
+    allowed: bool
+    subscribed: bool
+    free_left: int
+    sub_until_ts: int
+    name: Optional[str]
+
+
+# Одним UPDATE: подписчику ничего не списываем, иначе -1 бесплатное сообщение,
+# но только если они ещё остались. Нет строки в RETURNING — доступа нет.
+# Заодно отмечаем активность: написал — значит, и бот не заблокирован.
+_CONSUME_SQL = text("""
+    UPDATE users
+    SET free_left = CASE WHEN COALESCE(sub_until_ts, 0) > :now
+                         THEN free_left ELSE free_left - 1 END,
+        last_active_ts = :now, blocked = 0
+    WHERE user_id = :u AND (COALESCE(sub_until_ts, 0) > :now OR free_left > 0)
+    RETURNING name, free_left, sub_until_ts
+""")
+
+# Строки в RETURNING у _CONSUME_SQL нет: либо пользователь новый (создаём,
+# created=1 — и списываем ещё раз), либо лимит исчерпан — тогда отмечаем
+# только активность. Сегменты рассылок считают её в днях: чаще раза в час
+# не пишем, иначе каждое сообщение без доступа — запись и fsync вместо
+# пустой транзакции. Одним запросом — это частый путь.
+_CREATE_OR_TOUCH_SQL = text("""
+    INSERT INTO users(user_id, free_left) VALUES(:u, :f)
+    ON CONFLICT(user_id) DO UPDATE SET last_active_ts = :now, blocked = 0
+    WHERE blocked != 0 OR COALESCE(last_active_ts, 0) < :now - 3600
+    RETURNING last_active_ts IS NULL AS created
+""")
+
+
+@_timed
+def consume_message_quota(user_id: int, now: Optional[int] = None) -> Quota:
+    """
+    Атомарно проверяет доступ и списывает бесплатное сообщение.
+    Параллельные сообщения не могут потратить одно и то же сообщение дважды.
+    """
+    from .config import settings
+    now = int(now if now is not None else time.time())
+    params = {"u": user_id, "now": now, "f": settings.free_messages}
+    with engine.begin() as conn:
+        row = conn.execute(_CONSUME_SQL, params).mappings().first()
+        if row is None and conn.execute(_CREATE_OR_TOUCH_SQL, params).scalar():
+            row = conn.execute(_CONSUME_SQL, params).mappings().first()
+        if row is None:
+            return Quota(False, False, 0, 0, None)
+        until = int(row["sub_until_ts"] or 0)
+        return Quota(True, until > now, row["free_left"], until, row["name"])
+
+
+@_timed
 def add_msg(user_id: int, role: str, content: str):
-    """Добавляет сообщение в историю"""
+    """Добавляет сообщение в историю (блокирующий вызов — из async через asyncio.to_thread)"""
+    value, codec_id = codec.encode(content)
     with engine.begin() as conn:
-        conn.execute(
-            text("INSERT INTO messages(user_id, role, content) VALUES(:u,:r,:c)"),
-            {"u": user_id, "r": role, "c": content},
-        )
+        msg_id = conn.execute(
+            text("INSERT INTO messages(user_id, role, content, codec) VALUES(:u,:r,:c,:z)"),
+            {"u": user_id, "r": role, "c": value, "z": codec_id},
+        ).lastrowid
+        # Несжатые индексирует триггер, сжатые — здесь: индексу нужен
+        # обычный текст (см. миграцию 8)
+        if codec_id is not None:
+            params = {"id": msg_id, "c": content}
+            conn.execute(text("INSERT INTO messages_fts_text(id, content) VALUES(:id, :c)"), params)
+            conn.execute(text("INSERT INTO messages_fts(rowid, content) VALUES(:id, :c)"), params)
         
-        # Периодическая очистка старых сообщений (раз в 50 сообщений + рандом)
-        if random.random() < 0.02:  # 2% шанс на очистку
+        # Периодическая очистка старых сообщений (раз в 50 сообщений + рандом).
+        # С архивом старое не удаляется, а переносится задачей app/archive.py
+        if not settings.archive_enabled and random.random() < 0.02:  # 2% шанс на очистку
             _cleanup_old_messages(conn, user_id)
+    _remember(user_id, role, content)
 
 
+def _remember(user_id: int, role: str, content: str):
+    """
+    Кладёт реплику в векторную память (app/memory.py) — после коммита сообщения:
+    откат транзакции не оставляет в файле векторов строк без сообщения.
+    """
+    if not memory.enabled() or not memory.worth_remembering(role, content):
+        return
+    vec = memory.embed(content)
+    if vec is None:
+        return
+    row = memory.store().append(vec)
+    # Если запись не удастся, строка вектора останется без ссылки — её никто не прочтёт
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO memories(user_id, vec_row, content) VALUES(:u, :r, :c)"),
+            {"u": user_id, "r": row, "c": content},
+        )
+    memory.cache.add(user_id, row)
+
+
+_MEMORY_TEXTS_SQL = text(
+    "SELECT vec_row, content FROM memories WHERE user_id=:u AND vec_row IN :rows"
+).bindparams(bindparam("rows", expanding=True))
+
+
+@_timed
+def recall_memories(user_id: int, query: str, k: int = 3, min_score: float = 0.35,
+                    exclude=()) -> List[str]:
+    """Самые похожие на query прошлые реплики пользователя (кроме exclude); блокирующий"""
+    if not memory.enabled():
+        return []
+    vec = memory.embed(query)
+    if vec is None:
+        return []
+    # У очень активных ищем только среди последних записей — задержка ограничена
+    limit = settings.memory_scan_limit
+    rows = memory.cache.get(user_id)
+    if rows is None:
+        with engine.begin() as conn:
+            rows = memory.cache.put(user_id, conn.execute(
+                text("SELECT vec_row FROM memories WHERE user_id=:u ORDER BY vec_row DESC LIMIT :l"),
+                {"u": user_id, "l": limit},
+            ).scalars().all()[::-1])
+    rows = rows[-limit:]
+    # С запасом: часть лучших может совпасть с тем, что и так есть в промпте
+    hits = memory.store().top_k(vec, rows, k + len(exclude), min_score)
+    if not hits:
+        return []
+    with engine.begin() as conn:
+        texts = dict(conn.execute(_MEMORY_TEXTS_SQL, {"u": user_id, "rows": [r for r, _ in hits]}).all())
+    out: List[str] = []
+    for r, _ in hits:
+        content = texts.get(r)
+        if content and content not in exclude and content not in out:
+            out.append(content)
+    return out[:k]
+
+
+_CLEANUP_SQL = text("""
+    DELETE FROM messages
+    WHERE user_id=:u
+    AND id NOT IN (
+        SELECT id FROM messages
+        WHERE user_id=:u
+        ORDER BY ts DESC
+        LIMIT 100
+    )
+""")
+# Удаляем только то, что уже свёрнуто в конспект (см. app/summarizer.py)
+_CLEANUP_SUMMARIZED_SQL = text("""
+    DELETE FROM messages
+    WHERE user_id=:u
+    AND id <= COALESCE((SELECT upto_id FROM summaries WHERE user_id=:u), 0)
+    AND id NOT IN (
+        SELECT id FROM messages
+        WHERE user_id=:u
+        ORDER BY ts DESC
+        LIMIT 100
+    )
+""")
+
+
+@_timed
 def _cleanup_old_messages(conn, user_id: int):
-    """Очищает старые сообщения, оставляя последние 100"""
+    """
+    Очищает старые сообщения, оставляя последние 100.
+    С включёнными конспектами ещё не свёрнутые сообщения не трогаем.
+    """
     try:
         # Проверяем, когда была последняя очистка
         row = conn.execute(
@@ -130,16 +250,7 @@ def _cleanup_old_messages(conn, user_id: int):
         
         # Удаляем старые сообщения
         conn.execute(
-            text("""
-            DELETE FROM messages 
-            WHERE user_id=:u 
-            AND id NOT IN (
-                SELECT id FROM messages 
-                WHERE user_id=:u 
-                ORDER BY ts DESC 
-                LIMIT 100
-            )
-            """),
+            _CLEANUP_SUMMARIZED_SQL if settings.summary_enabled else _CLEANUP_SQL,
             {"u": user_id}
         )
         
@@ -152,77 +263,188 @@ def _cleanup_old_messages(conn, user_id: int):
         pass  # Не критично, если очистка не удалась
 
 
+@_timed
 def last_dialog(user_id: int, limit: int = 20):
     """
     Возвращает последние сообщения диалога.
     По умолчанию 20 сообщений для хорошего контекста.
     """
     with engine.begin() as conn:
-        rows = conn.execute(
+        result = conn.execute(
             text("""
-            SELECT role, content FROM messages
+            SELECT role, content, codec FROM messages
             WHERE user_id=:u
             ORDER BY ts DESC
             LIMIT :l
             """),
             {"u": user_id, "l": limit},
+        )
+        return _plain(result, reverse=True)
+
+
+@_timed
+def dialog_context(user_id: int, limit: int = 20):
+    """
+    Конспект и ещё не свёрнутые в него сообщения (не больше limit последних).
+    Возвращает (summary | None, [{"role", "content"}, ...] по порядку).
+    """
+    with engine.begin() as conn:
+        srow = conn.execute(
+            text("SELECT summary, upto_id FROM summaries WHERE user_id=:u"), {"u": user_id}
+        ).mappings().first()
+        result = conn.execute(
+            text("""
+            SELECT role, content, codec FROM messages
+            WHERE user_id=:u AND id > :upto
+            ORDER BY id DESC
+            LIMIT :l
+            """),
+            {"u": user_id, "upto": srow["upto_id"] if srow else 0, "l": limit},
+        )
+        return (srow["summary"] if srow else None), _plain(result, reverse=True)
+
+
+@_timed
+def unsummarized(user_id: int, keep: int, limit: int):
+    """
+    Что свернуть в конспект: (summary | None, [{"id", "role", "content"}, ...]) —
+    до limit самых старых не свёрнутых сообщений, кроме keep последних.
+    """
+    with engine.begin() as conn:
+        srow = conn.execute(
+            text("SELECT summary, upto_id FROM summaries WHERE user_id=:u"), {"u": user_id}
+        ).mappings().first()
+        # keep последних отсекаем в базе, а не срезом: длинный хвост не читается и не распаковывается
+        result = conn.execute(
+            text("""
+            SELECT id, role, content, codec FROM messages
+            WHERE user_id=:u AND id > :upto
+              AND id < COALESCE((SELECT MIN(id) FROM (
+                      SELECT id FROM messages WHERE user_id=:u ORDER BY id DESC LIMIT :keep
+                  )), 9223372036854775807)
+            ORDER BY id
+            LIMIT :n
+            """),
+            {"u": user_id, "upto": srow["upto_id"] if srow else 0, "keep": max(0, keep), "n": limit},
+        )
+        return (srow["summary"] if srow else None), _plain(result)
+
+
+@_timed
+def save_summary(user_id: int, summary: str, upto_id: int) -> bool:
+    """Сохраняет конспект, если он покрывает больше прежнего; True — сохранён"""
+    with engine.begin() as conn:
+        return conn.execute(
+            text("""
+            INSERT INTO summaries(user_id, summary, upto_id) VALUES(:u, :s, :upto)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary=excluded.summary, upto_id=excluded.upto_id, updated_at=CURRENT_TIMESTAMP
+            WHERE excluded.upto_id > summaries.upto_id
+            """),
+            {"u": user_id, "s": summary, "upto": upto_id},
+        ).rowcount > 0
+
+
+_FTS_WORD = re.compile(r"\w+")
+
+
+def fts_query(query: str) -> Optional[str]:
+    """
+    Запрос пользователя → выражение FTS5: каждое слово в кавычках
+    (синтаксис MATCH не ломается) и с * — «кот» найдёт и «котика».
+    """
+    words = _FTS_WORD.findall(query.lower())
+    return " ".join(f'"{w}"*' for w in words) or None
+
+
+@_timed
+def search_messages(query: str, user_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+    """
+    Полнотекстовый поиск по истории (messages_fts), лучшие по bm25 — первыми.
+    Возвращает [{"id", "user_id", "role", "ts", "snippet", "score"}, ...].
+    """
+    match = fts_query(query)
+    if match is None:
+        return []
+    where = "AND m.user_id = :u" if user_id is not None else ""
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text(f"""
+            SELECT m.id, m.user_id, m.role, m.ts,
+                   snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet,
+                   bm25(messages_fts) AS score
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH :q {where}
+            ORDER BY score
+            LIMIT :l
+            """),
+            {"q": match, "u": user_id, "l": limit},
         ).mappings().all()
-        return list(reversed(rows))
+        return [dict(r) for r in rows]
 
 
+@_timed
 def set_name(user_id: int, name: str):
     # Ограничиваем длину имени
     name = name[:50] if name else name
     update_user(user_id, name=name)
 
 
+@_timed
 def set_style(user_id: int, style: str = None, verbosity: str = None):
     pass
 
 
 # ---- подписка и платежи ----
-def activate_subscription(user_id: int, days: int = 30):
+# Один запрос: строки users может ещё не быть (оплата раньше первого
+# сообщения), срок продлевается от «сейчас» или от текущего, если он позже.
+# Заодно восстанавливаем бесплатные сообщения
+_ACTIVATE_SQL = text("""
+    INSERT INTO users(user_id, free_left, sub_until_ts) VALUES(:u, :f, :now + :d)
+    ON CONFLICT(user_id) DO UPDATE SET
+        sub_until_ts = MAX(:now, COALESCE(sub_until_ts, 0)) + :d,
+        free_left = :f
+    RETURNING sub_until_ts
+""")
+
+
+def _activate_subscription(conn, user_id: int, days: int) -> int:
+    """Продлевает подписку в рамках уже открытой транзакции, возвращает новый срок (epoch)"""
+    from .config import settings
+    return conn.execute(_ACTIVATE_SQL, {
+        "u": user_id, "f": settings.free_messages, "now": int(time.time()), "d": days * 86400,
+    }).scalar()
+
+
+@_timed
+def activate_subscription(user_id: int, days: int = 30) -> int:
     with engine.begin() as conn:
-        row = conn.execute(
-            text("SELECT sub_until FROM users WHERE user_id=:u"), {"u": user_id}
-        ).mappings().first()
-        now = datetime.utcnow()
-        base = now
-        if row and row["sub_until"]:
-            try:
-                cur = datetime.fromisoformat(row["sub_until"])
-                if cur > now:
-                    base = cur
-            except Exception:
-                pass
-        new_until = (base + timedelta(days=days)).isoformat(timespec="seconds")
-        conn.execute(
-            text("UPDATE users SET is_subscribed=1, sub_until=:su WHERE user_id=:u"),
-            {"su": new_until, "u": user_id},
-        )
-        # Восстанавливаем бесплатные сообщения при активации подписки
-        from .config import settings
-        conn.execute(
-            text("UPDATE users SET free_left=:f WHERE user_id=:u"), 
-            {"f": settings.free_messages, "u": user_id}
-        )
+        return _activate_subscription(conn, user_id, days)
 
 
+@_timed
 def upsert_payment(
     user_id: int, provider: str, order_id: str,
     amount: int, currency: str, status: str, raw: str = ""
 ):
+    """Создаёт или обновляет платёж по order_id (оплаченный не откатывается)"""
     with engine.begin() as conn:
         conn.execute(
             text("""
             INSERT INTO payments(user_id, provider, order_id, amount, currency, status, raw)
             VALUES(:u,:p,:o,:a,:c,:s,:r)
+            ON CONFLICT(order_id) DO UPDATE SET
+                amount=excluded.amount, currency=excluded.currency,
+                status=excluded.status, raw=excluded.raw
+            WHERE payments.status != 'paid'
             """),
             {"u": user_id, "p": provider, "o": order_id,
              "a": amount, "c": currency, "s": status, "r": raw},
         )
 
 
+@_timed
 def mark_payment(order_id: str, status: str):
     with engine.begin() as conn:
         conn.execute(
@@ -231,7 +453,49 @@ def mark_payment(order_id: str, status: str):
         )
 
 
+@_timed
+def complete_payment(
+    user_id: int, provider: str, order_id: str,
+    amount: int, currency: str, days: int, raw: str = ""
+) -> Optional[int]:
+    """
+    Отмечает платёж оплаченным и продлевает подписку в одной транзакции.
+    Повторная доставка того же order_id подписку второй раз не продлевает.
+    Возвращает новый срок подписки (epoch) или None, если платёж уже был учтён.
+    """
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("""
+            INSERT INTO payments(user_id, provider, order_id, amount, currency, status, raw)
+            VALUES(:u,:p,:o,:a,:c,'paid',:r)
+            ON CONFLICT(order_id) DO UPDATE SET status='paid'
+            WHERE payments.status != 'paid'
+            RETURNING id
+            """),
+            {"u": user_id, "p": provider, "o": order_id,
+             "a": amount, "c": currency, "r": raw},
+        ).first()
+        if row is None:
+            return None
+        return _activate_subscription(conn, user_id, days)
+
+
+@_timed
+def expire_stale_payments(max_age_hours: int = 24) -> int:
+    """Переводит давно висящие pending-инвойсы в expired, пачками"""
+    from .migrations import run_in_batches
+    return run_in_batches(engine, """
+        UPDATE payments SET status='expired'
+        WHERE id IN (
+            SELECT id FROM payments
+            WHERE status='pending' AND ts < datetime('now', :age)
+            LIMIT :batch
+        )
+    """, {"age": f"-{int(max_age_hours)} hours"})
+
+
 # Вспомогательные функции для TZ
+@_timed
 def set_tz(user_id: int, tz: str):
     # Валидация TZ
     if len(tz) > 50:
@@ -239,6 +503,7 @@ def set_tz(user_id: int, tz: str):
     update_user(user_id, tz=tz)
 
 
+@_timed
 def get_tz(user_id: int) -> Optional[str]:
     with engine.begin() as conn:
         row = conn.execute(text("SELECT tz FROM users WHERE user_id=:u"), {"u": user_id}).mappings().first()
@@ -246,6 +511,7 @@ def get_tz(user_id: int) -> Optional[str]:
 
 
 # CRUD для напоминаний
+@_timed
 def list_reminders(user_id: int) -> List[Dict]:
     with engine.begin() as conn:
         rows = conn.execute(
@@ -255,6 +521,7 @@ def list_reminders(user_id: int) -> List[Dict]:
         return [dict(r) for r in rows]
 
 
+@_timed
 def add_reminder(user_id: int, rtype: str, time_local: str) -> int:
     # Валидация типа
     if rtype not in ["checkin", "morning", "evening"]:
@@ -270,25 +537,436 @@ def add_reminder(user_id: int, rtype: str, time_local: str) -> int:
         if existing:
             return existing["id"]
         
-        conn.execute(
-            text("INSERT INTO reminders(user_id,rtype,time_local,active) VALUES(:u,:t,:tl,1)"),
+        rid = conn.execute(
+            text("INSERT INTO reminders(user_id,rtype,time_local,active) VALUES(:u,:t,:tl,1) RETURNING id"),
             {"u": user_id, "t": rtype, "tl": time_local}
-        )
-        rid = conn.execute(text("SELECT last_insert_rowid() AS rid")).mappings().first()["rid"]
+        ).scalar_one()
         return int(rid)
 
 
-def toggle_reminder(user_id: int, rid: int, active: int):
+@_timed
+def toggle_reminder(user_id: int, rid: int) -> Optional[Dict]:
+    """
+    Переключает напоминание одним запросом; возвращает новую строку вместе
+    с часовым поясом пользователя (tz) или None, если напоминания нет
+    """
     with engine.begin() as conn:
-        conn.execute(
-            text("UPDATE reminders SET active=:a WHERE id=:rid AND user_id=:u"),
-            {"a": active, "rid": rid, "u": user_id}
-        )
+        row = conn.execute(text("""
+            UPDATE reminders SET active = CASE WHEN active THEN 0 ELSE 1 END
+            WHERE id=:rid AND user_id=:u
+            RETURNING id, user_id, rtype, time_local, active,
+                      (SELECT tz FROM users WHERE user_id=:u) AS tz
+        """), {"rid": rid, "u": user_id}).mappings().first()
+        return dict(row) if row else None
 
 
+@_timed
 def delete_reminder(user_id: int, rid: int):
     with engine.begin() as conn:
         conn.execute(
             text("DELETE FROM reminders WHERE id=:rid AND user_id=:u"),
             {"rid": rid, "u": user_id}
-        )
\ No newline at end of file
+        )
+
+# Учёт токенов LLM (агрегаты копит app/usage.py и сбрасывает пачками)
+_USAGE_UPSERT = text("""
+    INSERT INTO llm_usage(day, user_id, model, kind, verbosity, requests, truncated,
+                          prompt_tokens, completion_tokens, latency_ms, cost_usd)
+    VALUES(:day, :u, :model, :kind, :verbosity, :requests, :truncated,
+           :prompt, :completion, :latency_ms, :cost)
+    ON CONFLICT(day, user_id, model, kind, verbosity) DO UPDATE SET
+        requests = requests + excluded.requests,
+        truncated = truncated + excluded.truncated,
+        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+        completion_tokens = completion_tokens + excluded.completion_tokens,
+        latency_ms = latency_ms + excluded.latency_ms,
+        cost_usd = cost_usd + excluded.cost_usd
+""")
+
+_USAGE_TOTALS = """
+    SUM(requests) AS requests, SUM(truncated) AS truncated,
+    SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,
+    SUM(latency_ms) AS latency_ms, SUM(cost_usd) AS cost_usd
+"""
+
+
+@_timed
+def add_llm_usage(rows: List[Dict]):
+    if not rows:
+        return
+    with engine.begin() as conn:
+        conn.execute(_USAGE_UPSERT, rows)
+
+
+@_timed
+def llm_usage_summary(since_day: str) -> List[Dict]:
+    """Суммы с since_day (YYYY-MM-DD, UTC) по модели, типу запроса и verbosity"""
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT model, kind, verbosity, {_USAGE_TOTALS}
+            FROM llm_usage WHERE day >= :d
+            GROUP BY model, kind, verbosity
+            ORDER BY cost_usd DESC
+        """), {"d": since_day}).mappings().all()
+        return [dict(r) for r in rows]
+
+
+@_timed
+def llm_usage_top_users(since_day: str, limit: int = 10) -> List[Dict]:
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT user_id, {_USAGE_TOTALS}
+            FROM llm_usage WHERE day >= :d
+            GROUP BY user_id
+            ORDER BY cost_usd DESC LIMIT :n
+        """), {"d": since_day, "n": limit}).mappings().all()
+        return [dict(r) for r in rows]
+
+
+@_timed
+def llm_usage_for_user(user_id: int, since_day: str) -> List[Dict]:
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT day, {_USAGE_TOTALS}
+            FROM llm_usage WHERE user_id = :u AND day >= :d
+            GROUP BY day ORDER BY day
+        """), {"u": user_id, "d": since_day}).mappings().all()
+        return [dict(r) for r in rows]
+
+
+
+# ---------- архив холодной истории (app/archive.py) ----------
+
+@_timed
+def archive_upto(before_ts: str) -> Optional[int]:
+    """Последний id среди сообщений старше before_ts (по idx_messages_ts); None — переносить нечего"""
+    with engine.begin() as conn:
+        # INDEXED BY: иначе SQLite берёт MAX(id) с конца таблицы и при пустом результате сканирует её всю
+        return conn.execute(text("SELECT MAX(id) FROM messages INDEXED BY idx_messages_ts WHERE ts < :before"),
+                            {"before": before_ts}).scalar()
+
+
+_OVERFLOW_SQL = text("""
+    SELECT user_id, upto_id FROM (
+        SELECT o.user_id, (
+            SELECT id FROM messages WHERE user_id = o.user_id ORDER BY id DESC LIMIT 1 OFFSET :keep
+        ) AS upto_id
+        FROM (
+            SELECT DISTINCT user_id FROM messages WHERE id > :after AND id <= :hwm
+            UNION SELECT user_id FROM users WHERE user_id IN :recheck
+        ) o
+    ) WHERE upto_id IS NOT NULL
+""").bindparams(bindparam("recheck", expanding=True))
+
+
+@_timed
+def archive_overflow(keep: int, after_id: int = 0, recheck: Sequence[int] = ()) -> Tuple[List[Dict], int]:
+    """
+    Пользователи, у которых в messages больше keep сообщений:
+    [{"user_id", "upto_id"}] — сверх лимита всё с id <= upto_id.
+    Проверяются только писавшие после after_id (диапазон по первичному ключу,
+    а не GROUP BY по всей таблице) и recheck. Второе значение — последний
+    просмотренный id, after_id для следующего запуска.
+    """
+    with engine.begin() as conn:
+        hwm = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM messages")).scalar()
+        rows = conn.execute(_OVERFLOW_SQL, {"keep": keep, "after": after_id, "hwm": hwm,
+                                            "recheck": list(recheck)}).mappings().all()
+        return [dict(r) for r in rows], max(hwm, after_id)
+
+
+@_timed
+def archive_candidates(after_id: int, upto_id: int, batch: int, summarized_only: bool,
+                       before_ts: Optional[str] = None, user_id: Optional[int] = None) -> List[Dict]:
+    """
+    Следующая пачка сообщений с id в (after_id, upto_id] по возрастанию id;
+    before_ts — только старше этого момента, user_id — только этого пользователя.
+    summarized_only — только уже свёрнутые в конспект.
+    Возвращает строки с полем eligible: можно ли переносить.
+    """
+    eligible = "m.id <= COALESCE(s.upto_id, 0)" if summarized_only else "1"
+    where = ["m.id > :after", "m.id <= :upto"]
+    if before_ts is not None:
+        where.append("m.ts < :before")
+    if user_id is not None:
+        where.append("m.user_id = :u")
+    with engine.begin() as conn:
+        result = conn.execute(text(f"""
+            SELECT m.id, m.user_id, m.role, m.content, m.codec, m.ts, {eligible} AS eligible
+            FROM messages m
+            LEFT JOIN summaries s ON s.user_id = m.user_id
+            WHERE {" AND ".join(where)}
+            ORDER BY m.id
+            LIMIT :batch
+        """), {"after": after_id, "upto": upto_id, "before": before_ts, "u": user_id,
+               "batch": batch})
+        return _plain(result)
+
+
+_DELETE_ARCHIVED_SQL = text("DELETE FROM messages WHERE id IN :ids").bindparams(
+    bindparam("ids", expanding=True)
+)
+
+
+@_timed
+def commit_archive(segments: List[Dict], ids: List[int]):
+    """Записывает сегменты в индекс и удаляет перенесённые сообщения — одной транзакцией"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO archive_segments(day, path, offset, length, first_id, last_id, rows)
+            VALUES(:day, :path, :offset, :length, :first_id, :last_id, :rows)
+        """), segments)
+        for i in range(0, len(ids), 5000):
+            conn.execute(_DELETE_ARCHIVED_SQL, {"ids": ids[i:i + 5000]})
+
+
+@_timed
+def archive_segments(since_day: Optional[str] = None, until_day: Optional[str] = None) -> List[Dict]:
+    """Сегменты архива за дни [since_day, until_day] по порядку"""
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT day, path, offset, length, first_id, last_id, rows
+            FROM archive_segments
+            WHERE day >= :s AND day <= :u
+            ORDER BY day, first_id
+        """), {"s": since_day or "", "u": until_day or "9999"}).mappings().all()
+        return [dict(r) for r in rows]
+
+
+
+# ---------- сжатие истории (app/codec.py) ----------
+
+@_timed
+def messages_for_recode(after_id: int, batch: int, compressed: bool) -> List[Dict]:
+    """Следующая пачка сообщений для пережатия: сжатые или достаточно длинные несжатые"""
+    where = "codec IS NOT NULL" if compressed else "codec IS NULL AND length(CAST(content AS BLOB)) >= :min"
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT id, content, codec FROM messages
+            WHERE id > :after AND {where}
+            ORDER BY id LIMIT :batch
+        """), {"after": after_id, "batch": batch, "min": settings.msg_compress_min}).mappings().all()
+        return [dict(r) for r in rows]
+
+
+@_timed
+def set_message_contents(updates: List[Dict]):
+    """[{"id", "c", "codec"}, ...] — одной транзакцией"""
+    if not updates:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE messages SET content=:c, codec=:codec WHERE id=:id"), updates)
+
+
+@_timed
+def message_samples(limit: int) -> List[str]:
+    """Последние ответы Алины — материал для словаря"""
+    with engine.begin() as conn:
+        result = conn.execute(text("""
+            SELECT content, codec FROM messages
+            WHERE role='assistant'
+            ORDER BY id DESC LIMIT :l
+        """), {"l": limit})
+        return [r["content"] for r in _plain(result)]
+
+
+@_timed
+def message_size_stats() -> List[Dict]:
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT codec, COUNT(*) AS n, SUM(length(CAST(content AS BLOB))) AS bytes
+            FROM messages GROUP BY codec ORDER BY codec
+        """)).mappings().all()
+        return [dict(r) for r in rows]
+
+
+# ---------- отложенные ответы (app/drain.py) ----------
+
+@_timed
+def save_pending_replies(rows: List[Dict]):
+    """rows: user_id, chat_id, text, names (JSON или None), charged"""
+    if not rows:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO pending_replies(user_id, chat_id, text, names, charged)
+            VALUES(:user_id, :chat_id, :text, :names, :charged)
+        """), rows)
+
+
+@_timed
+def drop_stale_pending_replies(max_age_sec: int) -> int:
+    """Удаляет отложенные ответы старше max_age_sec, возвращает их число"""
+    with engine.begin() as conn:
+        return conn.execute(text(
+            "DELETE FROM pending_replies WHERE created_at < datetime('now', :age)"
+        ), {"age": f"-{int(max_age_sec)} seconds"}).rowcount
+
+
+@_timed
+def list_pending_replies() -> List[Dict]:
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT id, user_id, chat_id, text, names, charged
+            FROM pending_replies ORDER BY id
+        """)).mappings().all()
+        return [dict(r) for r in rows]
+
+
+@_timed
+def mark_pending_charged(reply_id: int):
+    """Квота списана и сообщение в истории — при повторе второй раз не списывать"""
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE pending_replies SET charged=1 WHERE id=:id"), {"id": reply_id})
+
+
+@_timed
+def delete_pending_reply(reply_id: int):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM pending_replies WHERE id=:id"), {"id": reply_id})
+
+
+# ---------- флаги user_data (app/persistence.py) ----------
+
+@_timed
+def user_flag_ids() -> List[int]:
+    with engine.begin() as conn:
+        return [r[0] for r in conn.execute(text("SELECT user_id FROM user_flags"))]
+
+
+@_timed
+def get_user_flags(user_id: int) -> Dict:
+    with engine.begin() as conn:
+        row = conn.execute(text("SELECT data FROM user_flags WHERE user_id=:u"), {"u": user_id}).first()
+        return json.loads(row[0]) if row else {}
+
+
+@_timed
+def save_user_flags(batch: Dict[int, Dict]):
+    """Пачка изменений: пустые флаги — удалить строку, остальные — upsert"""
+    upserts = [{"u": u, "d": json.dumps(f, ensure_ascii=False)} for u, f in batch.items() if f]
+    deletes = [{"u": u} for u, f in batch.items() if not f]
+    with engine.begin() as conn:
+        if upserts:
+            conn.execute(text("""
+                INSERT INTO user_flags(user_id, data) VALUES(:u, :d)
+                ON CONFLICT(user_id) DO UPDATE SET data=excluded.data, updated_at=CURRENT_TIMESTAMP
+            """), upserts)
+        if deletes:
+            conn.execute(text("DELETE FROM user_flags WHERE user_id=:u"), deletes)
+
+
+# ---------- рассылки (app/broadcast.py) ----------
+
+def _segment_sql(segment: Dict, now: int):
+    """Условие WHERE и параметры для сегмента рассылки (см. broadcast.parse_segment)"""
+    where, params = ["blocked = 0"], {"now": now}
+    if "subscribed" in segment:
+        where.append("COALESCE(sub_until_ts, 0) > :now" if segment["subscribed"]
+                     else "COALESCE(sub_until_ts, 0) <= :now")
+    if "free_left" in segment:
+        where.append("free_left <= :free_left")
+        params["free_left"] = int(segment["free_left"])
+    if "tz" in segment:
+        tz = segment["tz"]
+        if tz.endswith("*"):
+            where.append("substr(COALESCE(tz, 'UTC'), 1, :tz_len) = :tz")
+            params.update(tz=tz[:-1], tz_len=len(tz) - 1)
+        else:
+            where.append("COALESCE(tz, 'UTC') = :tz")
+            params["tz"] = tz
+    if "active" in segment:
+        where.append("COALESCE(last_active_ts, 0) >= :active_since")
+        params["active_since"] = now - int(segment["active"]) * 86400
+    if "idle" in segment:
+        where.append("COALESCE(last_active_ts, 0) < :idle_since")
+        params["idle_since"] = now - int(segment["idle"]) * 86400
+    return " AND ".join(where), params
+
+
+@_timed
+def broadcast_audience(segment: Dict, now: Optional[int] = None) -> int:
+    """Сколько пользователей попадает в сегмент (для предпросмотра)"""
+    where, params = _segment_sql(segment, int(now if now is not None else time.time()))
+    with engine.begin() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM users WHERE {where}"), params).scalar()
+
+
+@_timed
+def broadcast_page(segment: Dict, after_user_id: int, limit: int, now: Optional[int] = None) -> List[int]:
+    """Следующая страница получателей по курсору user_id (keyset, без OFFSET)"""
+    where, params = _segment_sql(segment, int(now if now is not None else time.time()))
+    params.update(after=after_user_id, limit=limit)
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT user_id FROM users
+            WHERE user_id > :after AND {where}
+            ORDER BY user_id LIMIT :limit
+        """), params)
+        return [r[0] for r in rows]
+
+
+@_timed
+def create_broadcast(body: str, segment: Dict, total: int, created_by: int) -> int:
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO broadcasts(text, segment, total, created_by) VALUES(:t, :s, :n, :by)
+            RETURNING id
+        """), {"t": body, "s": json.dumps(segment, ensure_ascii=False), "n": total, "by": created_by}).scalar()
+
+
+def _broadcast_row(row) -> Dict:
+    d = dict(row)
+    d["segment"] = json.loads(d["segment"] or "{}")
+    return d
+
+
+@_timed
+def get_broadcast(bid: int) -> Optional[Dict]:
+    with engine.begin() as conn:
+        row = conn.execute(text("SELECT * FROM broadcasts WHERE id=:id"), {"id": bid}).mappings().first()
+        return _broadcast_row(row) if row else None
+
+
+@_timed
+def list_broadcasts(limit: int = 5, status: Optional[str] = None) -> List[Dict]:
+    """Последние рассылки (новые первыми), при status — только в этом состоянии"""
+    cond = "WHERE status=:st" if status else ""
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"SELECT * FROM broadcasts {cond} ORDER BY id DESC LIMIT :n"),
+                            {"st": status, "n": limit}).mappings().all()
+        return [_broadcast_row(r) for r in rows]
+
+
+@_timed
+def set_broadcast_status(bid: int, status: str, from_statuses: tuple) -> bool:
+    """Переводит рассылку в status, только если она сейчас в одном из from_statuses"""
+    stmt = text(f"""
+        UPDATE broadcasts
+        SET status=:st, updated_at=CURRENT_TIMESTAMP,
+            finished_at=CASE WHEN :st IN ('done', 'cancelled') THEN CURRENT_TIMESTAMP END
+        WHERE id=:id AND status IN :prev
+    """).bindparams(bindparam("prev", expanding=True))
+    with engine.begin() as conn:
+        return conn.execute(stmt, {"st": status, "id": bid, "prev": list(from_statuses)}).rowcount > 0
+
+
+@_timed
+def broadcast_checkpoint(bid: int, cursor: int, sent: int, failed: int, blocked: int,
+                         blocked_ids: List[int]):
+    """Прогресс страницы одной транзакцией: курсор, счётчики и заблокировавшие бота"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE broadcasts
+            SET cursor=MAX(cursor, :c), sent=sent+:s, failed=failed+:f, blocked=blocked+:b,
+                updated_at=CURRENT_TIMESTAMP
+            WHERE id=:id
+        """), {"id": bid, "c": cursor, "s": sent, "f": failed, "b": blocked})
+        if blocked_ids:
+            conn.execute(text("UPDATE users SET blocked=1 WHERE user_id=:u"), [{"u": u} for u in blocked_ids])
+
+
+@_timed
+def set_blocked(user_id: int, blocked: bool):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET blocked=:b WHERE user_id=:u"), {"b": int(blocked), "u": user_id})
@@ -0,0 +1,181 @@
+# app/drain.py
+"""
+Плавная остановка при деплое.
+
+По SIGTERM (или Ctrl+C) бот переходит в режим дрейна:
+- перестаёт забирать обновления (updater.stop) и прерывает рассылки
+  (продолжатся после старта с сохранённого курсора);
+- сообщения, которые всё же дошли до on_text, не обрабатываются, а
+  откладываются в pending_replies;
+- начатые ответы (guard) дорабатывают до DRAIN_DEADLINE_SEC, «печатает…»
+  при этом пропускается. Что не успело — отменяется и тоже откладывается
+  (как и то, что упало или не завершилось даже после отмены)
+  (уже списанное сообщение помечается charged: при повторе квота не
+  списывается и сообщение в историю второй раз не пишется). Ответ, который
+  уже отправляется (delivering), не отменяется — иначе пришёл бы дважды;
+- затем обычная остановка PTB и _post_shutdown (конспекты, учёт расходов,
+  клиент LLM, метрики, лог).
+
+Повторный сигнал — не ждать дедлайна. Отложенное отвечается после
+следующего старта (bot._replay_pending); строка pending_replies удаляется
+только после ответа — рестарт посреди повтора ничего не теряет.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import json
+import logging
+import signal
+import time
+from typing import Dict, Optional
+
+from telegram.ext import Application
+
+from .config import settings
+from .metrics import Counter, Gauge
+from .outbox import outbox
+from . import broadcast
+import app.db as db
+
+log = logging.getLogger(__name__)
+
+DRAIN_SECONDS = Gauge("alina_drain_seconds", "Длительность последней остановки: от сигнала до конца")
+DEFERRED = Counter("alina_deferred_replies_total", "Сообщения, отложенные при остановке", ("reason",))
+
+_GRACE = 5.0        # сек: дождаться отмены и уже начатых отправок
+
+_draining = False
+_cut = False        # дедлайн прошёл: новые генерации сразу откладываются
+_force: Optional[asyncio.Event] = None
+_started: Optional[float] = None
+_inflight: Dict[asyncio.Task, Dict] = {}
+_current: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("drain_reply", default=None)
+_stats = {"answered": 0, "deferred": 0}
+
+
+def draining() -> bool:
+    return _draining
+
+
+def names_of(tg_user) -> Optional[str]:
+    """Имена из Telegram для _sanitize_name_address при повторе"""
+    names = {k: getattr(tg_user, k, None) for k in ("first_name", "last_name", "username")}
+    names = {k: v for k, v in names.items() if v}
+    return json.dumps(names, ensure_ascii=False) if names else None
+
+
+def _row(rec: Dict) -> Dict:
+    return {k: rec[k] for k in ("user_id", "chat_id", "text", "names", "charged")}
+
+
+async def defer(rows, reason: str):
+    """Откладывает сообщения до следующего старта"""
+    if not rows:
+        return
+    await asyncio.to_thread(db.save_pending_replies, list(rows))
+    DEFERRED.inc(reason, amount=len(rows))
+    _stats["deferred"] += len(rows)
+
+
+async def guard(coro, user_id: int, chat_id: int, text: str, names: Optional[str]) -> bool:
+    """
+    Выполняет генерацию ответа на уже списанное сообщение.
+    False — ответ отложен остановкой (запись уже в pending_replies).
+    """
+    rec = {"user_id": user_id, "chat_id": chat_id, "text": text, "names": names, "charged": 1,
+           "delivering": False}
+    if _cut:
+        coro.close()
+        await defer([_row(rec)], "deadline")
+        return False
+    token = _current.set(rec)
+    try:
+        task = asyncio.get_running_loop().create_task(coro)
+    finally:
+        _current.reset(token)
+    _inflight[task] = rec
+    try:
+        await task
+        _stats["answered"] += 1
+        return True
+    except asyncio.CancelledError:
+        # Отменил дрейн — не пробрасываем, иначе PTB посчитает обработчик упавшим
+        if not task.cancelled() or asyncio.current_task().cancelling():
+            raise
+        return False
+    finally:
+        _inflight.pop(task, None)
+
+
+def delivering():
+    """Ответ готов и отправляется — такую задачу дрейн уже не отменяет"""
+    rec = _current.get()
+    if rec is not None:
+        rec["delivering"] = True
+
+
+def _answered(task: asyncio.Task) -> bool:
+    """Задача завершилась сама и без ошибки; иначе (не успела, отменена, упала) — откладываем"""
+    return task.done() and not task.cancelled() and task.exception() is None
+
+
+async def run(app: Application, deadline_sec: Optional[float] = None):
+    """Дрейн: дождаться начатых ответов, отложить остальное, остановить приложение"""
+    global _draining, _cut, _started
+    if _draining:
+        return
+    _draining, _started = True, time.monotonic()
+    deadline = _started + (settings.drain_deadline_sec if deadline_sec is None else deadline_sec)
+    log.info("остановка: дописываем начатые ответы", extra={"in_flight": len(_inflight)})
+    try:
+        if app.updater is not None and app.updater.running:
+            await app.updater.stop()
+        # Рассылки продолжатся с чекпоинта после старта — не занимаем ими очередь
+        await broadcast.stop_all()
+
+        while _inflight and time.monotonic() < deadline and not (_force and _force.is_set()):
+            await asyncio.sleep(0.05)
+        _cut = True
+
+        late = {t: r for t, r in _inflight.items() if not r["delivering"]}
+        for task in late:
+            task.cancel()
+        if _inflight:
+            await asyncio.wait(list(_inflight), timeout=_GRACE)
+        await defer([_row(r) for t, r in late.items() if not _answered(t)], "deadline")
+        await outbox.drain(max(_GRACE, deadline - time.monotonic()))
+    except Exception:
+        log.exception("ошибка дрейна")
+    finally:
+        log.info("остановка: приём закрыт", extra={
+            "drain_ms": round((time.monotonic() - _started) * 1e3), "deferred": _stats["deferred"],
+        })
+        app.stop_running()
+
+
+def finish():
+    """Итог остановки (вызывать последним в post_shutdown)"""
+    if _started is None:
+        return
+    seconds = time.monotonic() - _started
+    DRAIN_SECONDS.set(seconds)
+    log.info("остановка завершена", extra={"drain_ms": round(seconds * 1e3), **_stats})
+
+
+def install(app: Application):
+    """Перехватывает SIGTERM/SIGINT вместо стандартной остановки PTB"""
+    global _force
+    loop = asyncio.get_running_loop()
+    _force = asyncio.Event()
+
+    def on_signal():
+        if _draining:
+            _force.set()
+        else:
+            loop.create_task(run(app), name="drain")
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, on_signal)
+        except (NotImplementedError, RuntimeError):  # Windows
+            log.warning("нет обработчика сигнала %s — плавной остановки не будет", sig)
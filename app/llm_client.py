@@ -1,9 +1,10 @@
 # app/llm_client.py
 from __future__ import annotations
-import sys
-import traceback
+import asyncio
+import logging
+import threading
+import time
 from typing import List, Dict, Optional
-import re
 
 import httpx
 from openai import AsyncOpenAI
@@ -11,73 +12,41 @@ from openai import AuthenticationError, PermissionDeniedError, APITimeoutError
 
 from .config import settings
 from .prompts import REFUSAL_STYLE
+from .classifier import classify
+from .postprocess import postprocess
+from . import tracing, usage
+from .metrics import Counter, Histogram
+
+LLM_REQUESTS = Counter(
+    "alina_llm_requests_total", "Запросы к LLM по исходу", ("model", "verbosity", "outcome"),
+)
+LLM_SECONDS = Histogram(
+    "alina_llm_seconds", "Время запроса к LLM", ("model", "verbosity"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0),
+)
+LLM_TOKENS = Counter(
+    "alina_llm_tokens_total", "Токены LLM (prompt/completion)", ("model", "verbosity", "type"),
+)
+
+log = logging.getLogger(__name__)
 
 # Базовые дефолты
 DEFAULT_TEMPERATURE =0.7
 DEFAULT_MAX_TOKENS = 2000  # Увеличиваем дефолт для полных ответов
 
 
-def _format_lists(text: str) -> str:
-    """Форматирует нумерованные списки с переносами строк"""
-    if not text:
-        return text
-    
-    # Паттерн для поиска нумерованных списков
-    patterns = [
-        (r'(\d+)\.\s+([^.!?]+?)(?=\s*\d+\.|$)', r'\1. \2'),
-        (r'(\d+)\)\s+([^.!?]+?)(?=\s*\d+\)|$)', r'\1) \2'),
-    ]
-    
-    for pattern, replacement in patterns:
-        matches = list(re.finditer(pattern, text))
-        if matches:
-            parts = []
-            last_end = 0
-            
-            for match in matches:
-                if match.start() > last_end:
-                    parts.append(text[last_end:match.start()].rstrip())
-                
-                item = match.group(1) + '. ' + match.group(2).strip()
-                parts.append('\n' + item)
-                last_end = match.end()
-            
-            if last_end < len(text):
-                remaining = text[last_end:].lstrip()
-                if remaining:
-                    parts.append('\n' + remaining)
-            
-            text = ''.join(parts).strip()
-            break
-    
-    # Форматируем списки с тире
-    text = re.sub(r'(?:^|\s)[-•]\s+', '\n• ', text)
-    return text
-
-
-def _postprocess(text: str) -> str:
-    """Постобработка ответа"""
-    if not text:
-        return text
-
-    t = text.strip()
-    
-    # Убираем префикс "Алина:"
-    for prefix in ("Алина:", "Алина —", "Алина -"):
-        if t.startswith(prefix):
-            t = t[len(prefix):].strip()
-            break
-
-    # Форматируем списки
-    t = _format_lists(t)
-    
-    # Заменяем жирный шрифт на курсив для Telegram
-    t = re.sub(r'\*\*(.*?)\*\*', r'*\1*', t)
-    
-    # Убираем лишние переносы строк
-    t = re.sub(r'\n{3,}', '\n\n', t)
-    
-    return t.strip()
+async def _mark_request(request: httpx.Request):
+    request.extensions["t0"] = time.perf_counter()
+
+
+async def _mark_response(response: httpx.Response):
+    # Заголовки ответа пришли — время до первого байта (для последней попытки)
+    t0 = response.request.extensions.get("t0")
+    if t0 is not None:
+        tracing.record("llm_ttfb", time.perf_counter() - t0)
+
+
+_EVENT_HOOKS = {"request": [_mark_request], "response": [_mark_response]}
 
 
 class LLMClient:
@@ -88,53 +57,71 @@ class LLMClient:
         self.model = settings.openai_model
         self.use_proxy = settings.openai_use_proxy
         self.proxy_address = settings.openai_proxy_address
+        self.base_url = settings.openai_base_url or None
 
         if not self.api_key:
             raise RuntimeError("OPENAI_API_KEY не задан в .env файле")
 
+        self._client: Optional[AsyncOpenAI] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
     async def _create_http_client(self) -> httpx.AsyncClient:
         """Создает HTTP клиент с правильными настройками"""
         if self.use_proxy and self.proxy_address:
-            print(f"[LLM] Создаем HTTP клиент с прокси: {self.proxy_address}")
+            log.debug("создаём HTTP клиент с прокси")
             return httpx.AsyncClient(
                 proxy=self.proxy_address,
-                timeout=httpx.Timeout(30.0, connect=10.0)
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                event_hooks=_EVENT_HOOKS,
             )
         else:
-            print("[LLM] Создаем HTTP клиент без прокси")
+            log.debug("создаём HTTP клиент без прокси")
             return httpx.AsyncClient(
-                timeout=httpx.Timeout(30.0, connect=10.0)
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                event_hooks=_EVENT_HOOKS,
+            )
+
+    async def _get_client(self) -> AsyncOpenAI:
+        """
+        Один клиент на процесс: соединения с API (TLS, прокси) переиспользуются
+        пулом httpx, а не открываются заново на каждый запрос
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # Пул httpx привязан к event loop — в новом loop нужен новый клиент
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=await self._create_http_client(),
+                max_retries=2,
             )
+            self._loop = loop
+        return self._client
 
     async def _make_request(
         self, 
         messages: List[Dict[str, str]], 
         temperature: float, 
-        max_tokens: int
+        max_tokens: int,
+        verbosity: Optional[str] = None,
+        user_id: Optional[int] = None,
+        kind: str = "chat",
+        model: Optional[str] = None,
+        fallback: bool = True,
     ) -> str:
-        """Выполняет запрос к OpenAI API"""
-        http_client = None
-        openai_client = None
+        """
+        Выполняет запрос к OpenAI API.
+        fallback=False — ошибки пробрасываются, а не заменяются фразой для пользователя.
+        """
+        model = model or self.model
+        labels = (model, verbosity or "normal")
+        outcome = "error"
+        t0 = time.perf_counter()
         
         try:
-            # Создаем HTTP клиент
-            http_client = await self._create_http_client()
-            print("[LLM] HTTP клиент создан успешно")
-            
-            # Создаем OpenAI клиент
-            openai_client = AsyncOpenAI(
-                api_key=self.api_key,
-                http_client=http_client,
-                max_retries=2
-            )
-            print("[LLM] OpenAI клиент создан успешно")
-            
-            # Выполняем запрос
-            print(f"[LLM] Отправляем запрос к модели {self.model}")
-            print(f"[LLM] Параметры: temperature={temperature}, max_tokens={max_tokens}")
-            
+            openai_client = await self._get_client()
             response = await openai_client.chat.completions.create(
-                model=self.model,
+                model=model,
                 messages=messages,
                 temperature=temperature,
                 top_p=1,
@@ -146,49 +133,57 @@ class LLMClient:
             choice = response.choices[0]
             finish_reason = choice.finish_reason
             
+            outcome = "length" if finish_reason == "length" else "ok"
             if finish_reason == "length":
-                print(f"[LLM] ВНИМАНИЕ: Ответ достиг лимита токенов (max_tokens={max_tokens})")
+                log.warning("ответ упёрся в лимит токенов", extra={"max_tokens": max_tokens})
+            used = response.usage
+            if used is not None:
+                prompt_tokens = used.prompt_tokens or 0
+                completion_tokens = used.completion_tokens or 0
+                LLM_TOKENS.inc(*labels, "prompt", amount=prompt_tokens)
+                LLM_TOKENS.inc(*labels, "completion", amount=completion_tokens)
+                usage.record(
+                    user_id, model, kind, verbosity, prompt_tokens, completion_tokens,
+                    time.perf_counter() - t0, truncated=outcome == "length",
+                )
             
             content = choice.message.content or ""
-            print(f"[LLM] Получен ответ длиной {len(content)} символов, finish_reason={finish_reason}")
+            log.debug("ответ получен", extra={"chars": len(content), "finish_reason": finish_reason})
             return content
             
         except PermissionDeniedError as e:
-            print(f"[LLM] Permission denied: {e}", file=sys.stderr)
+            outcome = "permission_denied"
+            log.error("permission denied: %s", e)
+            if not fallback:
+                raise
             if self.use_proxy:
                 return "ой, проблемы с прокси... проверь настройки"
             else:
                 return "доступ ограничен... может, нужен прокси?"
                 
         except AuthenticationError as e:
-            print(f"[LLM] Authentication error: {e}", file=sys.stderr)
+            outcome = "auth_error"
+            log.error("authentication error: %s", e)
+            if not fallback:
+                raise
             return "ой, проблемы с ключом API... проверь настройки"
             
         except APITimeoutError as e:
-            print(f"[LLM] Timeout error: {e}", file=sys.stderr)
+            outcome = "timeout"
+            log.warning("timeout: %s", e)
+            if not fallback:
+                raise
             return "хм, что-то долго думаю... может, спросишь попроще?"
             
-        except Exception as e:
-            print(f"[LLM] Unexpected error: {e}", file=sys.stderr)
-            print(f"[LLM] Error type: {type(e).__name__}", file=sys.stderr)
-            traceback.print_exc()
+        except Exception:
+            log.exception("неожиданная ошибка запроса к LLM")
+            if not fallback:
+                raise
             return "ой, что-то связь барахлит... попробуй ещё раз?"
             
         finally:
-            # Закрываем клиенты
-            if openai_client:
-                try:
-                    await openai_client.close()
-                    print("[LLM] OpenAI клиент закрыт")
-                except Exception as e:
-                    print(f"[LLM] Ошибка закрытия OpenAI клиента: {e}")
-            
-            if http_client:
-                try:
-                    await http_client.aclose()
-                    print("[LLM] HTTP клиент закрыт")
-                except Exception as e:
-                    print(f"[LLM] Ошибка закрытия HTTP клиента: {e}")
+            LLM_SECONDS.observe(time.perf_counter() - t0, *labels)
+            LLM_REQUESTS.inc(*labels, outcome)
 
     async def chat(
         self,
@@ -198,8 +193,16 @@ class LLMClient:
         *,
         verbosity: Optional[str] = None,
         safety: bool = False,
+        list_request: Optional[bool] = None,
+        user_id: Optional[int] = None,
+        kind: str = "chat",
     ) -> str:
-        """Отправляет запрос к OpenAI API"""
+        """
+        Отправляет запрос к OpenAI API.
+        list_request — уже известный флаг «просят список»; если None,
+        определяем по последнему сообщению.
+        user_id и kind (chat, reminder, ...) — для учёта токенов в llm_usage.
+        """
         
         temperature = float(temperature if temperature is not None else DEFAULT_TEMPERATURE)
         
@@ -217,23 +220,74 @@ class LLMClient:
             messages = [{"role": "system", "content": REFUSAL_STYLE}] + messages
 
         # Добавляем указания про формат ответа
-        last_user_msg = messages[-1].get("content", "").lower()
-        if any(word in last_user_msg for word in ["факт", "пункт", "список", "причин", "способ"]):
+        if list_request is None:
+            list_request = classify(messages[-1].get("content", "")).list_request
+        if list_request:
             messages.append({
                 "role": "system", 
                 "content": "Отвечай полно и интересно. Если нужен список - делай его с переносами строк, каждый пункт с новой строки."
             })
 
-        print(f"[LLM] Запрос к {self.model} с max_tokens={max_tokens}, температура={temperature}, verbosity={verbosity}")
+        log.debug("запрос к LLM", extra={
+            "model": self.model, "max_tokens": max_tokens, "temperature": temperature, "verbosity": verbosity,
+        })
         
         try:
-            txt = await self._make_request(messages, temperature, max_tokens)
-            return _postprocess(txt)
+            txt = await self._make_request(messages, temperature, max_tokens, verbosity, user_id, kind)
+            with tracing.span("postprocess"):
+                return postprocess(txt)
             
-        except Exception as e:
-            print(f"[LLM] Финальная ошибка в chat(): {e}", file=sys.stderr)
+        except Exception:
+            log.exception("ошибка в chat()")
             return "что-то пошло не так... попробуй ещё раз?"
 
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        model: Optional[str] = None,
+        max_tokens: int = 500,
+        temperature: float = 0.3,
+        user_id: Optional[int] = None,
+        kind: str = "service",
+    ) -> str:
+        """
+        Служебный запрос (например, конспект диалога): без постобработки
+        и фраз-заглушек — при ошибке бросает исключение.
+        """
+        return await self._make_request(
+            messages, temperature, max_tokens, None, user_id, kind, model=model, fallback=False,
+        )
+
     async def aclose(self):
-        """Заглушка для совместимости"""
-        pass
\ No newline at end of file
+        """Закрывает клиент и соединения пула"""
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client.close()
+            except Exception as e:
+                log.warning("ошибка закрытия OpenAI клиента: %s", e)
+
+
+_shared: Optional[LLMClient] = None
+_shared_lock = threading.Lock()
+
+
+def get() -> LLMClient:
+    """
+    Общий клиент процесса (создаётся при первом обращении). Зовётся и из
+    потока прогрева (bot._post_init), и из обработчиков — под замком.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LLMClient()
+        return _shared
+
+
+async def close():
+    """Закрывает общий клиент (из post_shutdown)"""
+    global _shared
+    if _shared is not None:
+        await _shared.aclose()
+        _shared = None
@@ -0,0 +1,135 @@
+# app/logs.py
+"""
+Логирование без блокировок event loop.
+
+Обработчики на стороне приложения только кладут запись в ограниченную
+очередь (put_nowait). Форматирование в JSON и запись в stdout делает
+фоновый поток QueueListener. Если очередь переполнена (stdout не
+успевает), запись отбрасывается и учитывается в alina_log_dropped_total —
+loop никогда не ждёт вывода.
+
+Настройки:
+    LOG_LEVEL=INFO                               — общий уровень
+    LOG_LEVELS=app.llm_client=DEBUG,httpx=WARNING — уровни по модулям
+    LOG_DEBUG_SAMPLE=0.1                         — доля DEBUG-записей, которые пишем
+    LOG_FORMAT=json|text
+"""
+from __future__ import annotations
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Optional
+
+from .config import settings
+from .metrics import Counter
+
+LOG_DROPPED = Counter("alina_log_dropped_total", "Записи лога, отброшенные из-за переполнения очереди")
+
+# Поля LogRecord, которые не считаются «extra»
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка; extra=... попадают полями верхнего уровня"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _STANDARD and not k.startswith("_"):
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-5s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = {k: v for k, v in record.__dict__.items() if k not in _STANDARD and not k.startswith("_")}
+        return f"{line} {json.dumps(extra, ensure_ascii=False, default=str)}" if extra else line
+
+
+class _DebugSampler(logging.Filter):
+    """Пропускает только долю DEBUG-записей; остальные уровни — все"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование — в потоке слушателя; здесь только подставляем аргументы
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _parse_levels(spec: str):
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, level = item.partition("=")
+        if level:
+            yield name.strip(), level.strip().upper()
+
+
+def setup():
+    """Настраивает корневой логгер (повторный вызов ничего не делает)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(_TextFormatter() if settings.log_format == "text" else JsonFormatter())
+
+    q: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+    handler = _NonBlockingQueueHandler(q)
+    handler.addFilter(_DebugSampler(settings.log_debug_sample))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(settings.log_level.upper())
+    for name, level in _parse_levels(settings.log_levels):
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(q, out, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop)
+
+
+def stop():
+    """Дописывает очередь и останавливает поток слушателя"""
+    global _listener
+    if _listener is None:
+        return
+    for _ in range(100):
+        try:
+            _listener.stop()
+            break
+        except queue.Full:
+            # Некуда положить маркер остановки — даём потоку разгрести очередь
+            time.sleep(0.02)
+    _listener = None
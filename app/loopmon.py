@@ -0,0 +1,223 @@
+# app/loopmon.py
+"""
+Монитор задержек event loop.
+
+Внутри loop работает «пульс» — задача, которая каждые INTERVAL секунд
+отмечает время и пишет задержку пробуждения в alina_event_loop_lag_seconds.
+Отдельный поток-сторож смотрит на пульс: если loop не отзывался дольше
+порога, значит какой-то колбэк держит его синхронным кодом (запрос к
+SQLite, тяжёлая регулярка и т.п.). Сторож снимает стек потока loop через
+sys._current_frames(), определяет обработчик (on_text, on_cb,
+_send_reminder, ...) и пишет предупреждение в лог.
+
+С включённым профилем сторож, пока затык длится, сэмплирует стек каждые
+PROFILE_SAMPLE секунд и после затыка сохраняет его в folded-формате
+(flamegraph.pl, speedscope) в LOOPMON_PROFILE_DIR.
+
+Включается/выключается на лету командой /loopmon (только для ADMIN_IDS).
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as Tally, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from .config import settings
+from .metrics import Counter, Histogram, LOOP_LAG, LOOP_LAG_LAST
+
+log = logging.getLogger(__name__)
+
+INTERVAL = 0.1              # период пульса, сек
+PROFILE_SAMPLE = 0.005      # период сэмплов стека во время затыка, сек
+MAX_STACK = 40              # сколько кадров писать в лог
+
+STALLS = Counter("alina_loop_stalls_total", "Затыки event loop дольше порога", ("handler",))
+STALL_SECONDS = Histogram(
+    "alina_loop_stall_seconds", "Длительность затыков event loop",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_ASYNCIO_DIR = os.path.dirname(os.path.abspath(asyncio.__file__))
+# Обёртки, которые стоят над настоящим обработчиком
+_WRAPPERS = {os.path.join(_APP_DIR, f) for f in ("loopmon.py", "metrics.py", "tracing.py")}
+
+
+def _handler_name(stack: traceback.StackSummary) -> str:
+    """
+    Первый кадр кода бота над колбэком loop — это и есть обработчик,
+    занявший loop (всё, что ниже последнего кадра asyncio, — main() и run_polling)
+    """
+    start = 0
+    for i, fs in enumerate(stack):
+        if fs.filename.startswith(_ASYNCIO_DIR):
+            start = i + 1
+    for fs in stack[start:]:
+        if fs.filename.startswith(_APP_DIR) and fs.filename not in _WRAPPERS:
+            return fs.name
+    return "?"
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float, profile: bool, profile_dir: str):
+        self.threshold = threshold
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.enabled = False
+
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=10)
+
+    # ---------- управление ----------
+
+    def start(self, enabled: bool = True):
+        loop = asyncio.get_running_loop()
+        self.enabled = enabled
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = loop.create_task(self._heartbeat(), name="loopmon:heartbeat")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loopmon", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        lag = LOOP_LAG.child()
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": round(self.threshold * 1e3),
+            "profile": self.profile,
+            "lag_p50_ms": round(lag.quantile(0.5) * 1e3, 1),
+            "lag_p99_ms": round(lag.quantile(0.99) * 1e3, 1),
+            "stalls": int(sum(STALLS.values.values())),
+            "recent": list(self.recent),
+        }
+
+    # ---------- loop ----------
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(INTERVAL)
+            lag = max(0.0, loop.time() - start - INTERVAL)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+            self._beat = time.monotonic()
+
+    # ---------- поток-сторож ----------
+
+    def _loop_frame(self):
+        return sys._current_frames().get(self._loop_thread)
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 4):
+            if not self.enabled:
+                continue
+            beat = self._beat
+            stalled = time.monotonic() - beat - INTERVAL
+            if stalled < self.threshold:
+                continue
+            frame = self._loop_frame()
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            handler = _handler_name(stack)
+            STALLS.inc(handler)
+            log.warning("event loop занят", extra={
+                "handler": handler,
+                "stalled_ms": round(stalled * 1e3),
+                "stack": traceback.format_list(stack[-MAX_STACK:]),
+            })
+            samples = self._sample_until_beat(beat) if self.profile else None
+            self._stall_ended(beat, handler, samples)
+
+    def _sample_until_beat(self, beat: float) -> Tally:
+        samples: Tally = Tally()
+        while self._beat == beat and not self._stop.is_set():
+            frame = self._loop_frame()
+            if frame is not None:
+                samples[_fold(frame)] += 1
+                del frame
+            time.sleep(PROFILE_SAMPLE)
+        return samples
+
+    def _stall_ended(self, beat: float, handler: str, samples: Optional[Tally]):
+        while self._beat == beat and not self._stop.is_set():
+            time.sleep(INTERVAL / 2)
+        duration = max(0.0, self._beat - beat - INTERVAL)
+        STALL_SECONDS.observe(duration)
+        path = self._dump(samples) if samples else None
+        self.recent.append({"handler": handler, "ms": round(duration * 1e3), "at": int(time.time())})
+        log.info("event loop освободился", extra={
+            "handler": handler, "duration_ms": round(duration * 1e3), "profile": path,
+        })
+
+    def _dump(self, samples: Tally) -> Optional[str]:
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"stall-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, n in samples.most_common():
+                    f.write(f"{stack} {n}\n")
+            return path
+        except OSError:
+            log.exception("не удалось сохранить профиль")
+            return None
+
+
+monitor = LoopMonitor(
+    threshold=settings.loopmon_threshold_ms / 1000,
+    profile=settings.loopmon_profile,
+    profile_dir=settings.loopmon_profile_dir,
+)
+
+
+def apply_command(args: List[str]) -> str:
+    """/loopmon [on|off|profile on|off|threshold <мс>] → текст ответа"""
+    if args[:1] == ["on"]:
+        monitor.enabled = True
+    elif args[:1] == ["off"]:
+        monitor.enabled = False
+    elif args[:1] == ["profile"] and args[1:2] in (["on"], ["off"]):
+        monitor.profile = args[1] == "on"
+    elif args[:1] == ["threshold"] and len(args) == 2 and args[1].isdigit():
+        monitor.threshold = max(10, int(args[1])) / 1000
+    elif args:
+        return "использование: /loopmon [on|off|profile on|off|threshold <мс>]"
+    st = monitor.status()
+    lines = [
+        f"монитор: {'вкл' if st['enabled'] else 'выкл'}, порог {st['threshold_ms']} мс, "
+        f"профиль: {'вкл' if st['profile'] else 'выкл'}",
+        f"лаг p50 ≤ {st['lag_p50_ms']} мс, p99 ≤ {st['lag_p99_ms']} мс, затыков: {st['stalls']}",
+    ]
+    for r in reversed(st["recent"]):
+        lines.append(f"• {time.strftime('%H:%M:%S', time.gmtime(r['at']))} UTC {r['handler']} — {r['ms']} мс")
+    return "\n".join(lines)
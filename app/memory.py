@@ -0,0 +1,192 @@
+# app/memory.py
+"""
+Долговременная память: векторный индекс по сообщениям пользователей.
+
+Эмбеддинг считается локально — хешированные n-граммы (слова и
+символьные триграммы) в вектор размерности DIM, без модели и сети.
+Векторы лежат одним append-only файлом float32 [N × DIM] (MEMORY_PATH),
+открытым через np.memmap; номер строки — memories.vec_row в SQLite
+(там же user_id и текст). Поиск — косинус по строкам пользователя одним
+матричным умножением и top-k через argpartition; у очень активных
+пользователей — только по MEMORY_SCAN_LIMIT последним записям.
+
+Включается MEMORY_ENABLED=true (по умолчанию выключена) и нужен numpy;
+без него память выключена. numpy импортируется при первом обращении,
+а не при импорте модуля. Эмбеддинг, дозапись и поиск — блокирующие:
+из бота они вызываются через asyncio.to_thread (add_msg, recall_memories).
+"""
+from __future__ import annotations
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from .config import settings
+
+log = logging.getLogger(__name__)
+
+DIM = 128               # размерность; при смене старый файл векторов непригоден
+DTYPE = "float32"       # 512 байт на вектор: 1M сообщений ≈ 512 МБ
+_ROW_BYTES = DIM * 4
+
+_WORD = re.compile(r"\w+")
+
+np = None               # numpy после _load_numpy()
+_numpy_checked = False
+
+
+def _load_numpy() -> bool:
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:  # память — необязательная часть
+            log.warning("numpy не установлен — долговременная память выключена")
+    return np is not None
+
+
+def enabled() -> bool:
+    return settings.memory_enabled and _load_numpy()
+
+
+def worth_remembering(role: str, content: str) -> bool:
+    """Запоминаем только содержательные реплики пользователя"""
+    return role == "user" and len(content) >= settings.memory_min_chars and not content.startswith("/")
+
+
+def embed(content: str) -> Optional["np.ndarray"]:
+    """Нормированный вектор float32 [DIM]; None — в тексте нет слов"""
+    words = _WORD.findall(content.lower().replace("ё", "е"))
+    feats = []
+    for w in words:
+        if len(w) > 2:
+            feats.append("w:" + w)
+        padded = f"<{w}>"
+        feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    if not feats:
+        return None
+    h = np.fromiter((zlib.crc32(f.encode()) for f in feats), dtype=np.uint32, count=len(feats))
+    # Знак из старшего бита хеша — коллизии гасят друг друга, а не копятся
+    signs = np.where(h & 0x80000000, -1.0, 1.0)
+    vec = np.bincount(h % DIM, weights=signs, minlength=DIM).astype(np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else None
+
+
+class VectorStore:
+    """Append-only файл векторов; читается через memmap, растёт дозаписью"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mm = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._f = open(path, "ab", buffering=0)
+        size = os.path.getsize(path)
+        if size % _ROW_BYTES:
+            # Оборванная запись после падения — отрезаем
+            self._f.truncate(size - size % _ROW_BYTES)
+        self.count = size // _ROW_BYTES
+
+    def append(self, vec: "np.ndarray") -> int:
+        """Дописывает вектор, возвращает номер строки"""
+        data = vec.astype(DTYPE).tobytes()
+        with self._lock:
+            self._f.write(data)
+            row = self.count
+            self.count += 1
+        return row
+
+    def extend(self, vecs: "np.ndarray") -> int:
+        """Дописывает пачку векторов [n × DIM], возвращает номер первой строки"""
+        data = np.ascontiguousarray(vecs, dtype=DTYPE).tobytes()
+        with self._lock:
+            self._f.write(data)
+            first = self.count
+            self.count += len(vecs)
+        return first
+
+    def matrix(self) -> "np.ndarray":
+        count = self.count
+        if self._mm is None or len(self._mm) < count:
+            if not count:
+                return np.empty((0, DIM), DTYPE)
+            self._mm = np.memmap(self.path, dtype=DTYPE, mode="r", shape=(count, DIM))
+        return self._mm
+
+    def top_k(self, query: "np.ndarray", rows: "np.ndarray", k: int,
+              min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """Лучшие k строк из rows по косинусу с query: [(строка, оценка), ...] по убыванию"""
+        m = self.matrix()
+        rows = rows[rows < len(m)]
+        if not len(rows) or k <= 0:
+            return []
+        scores = m[rows] @ query
+        if len(scores) > k:
+            best = np.argpartition(scores, -k)[-k:]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(scores[best])[::-1]]
+        return [(int(rows[i]), float(scores[i])) for i in best if scores[i] >= min_score]
+
+    def close(self):
+        self._f.close()
+        self._mm = None
+
+
+class RowCache:
+    """
+    Номера строк векторов по пользователям (LRU), чтобы не читать их из SQLite
+    на каждое сообщение. Вызывается из потоков (add_msg, recall_memories).
+    """
+
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._rows: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional["np.ndarray"]:
+        with self._lock:
+            rows = self._rows.get(user_id)
+            if rows is not None:
+                self._rows.move_to_end(user_id)
+            return rows
+
+    def put(self, user_id: int, rows: Sequence[int]) -> "np.ndarray":
+        arr = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            self._rows[user_id] = arr
+            self._rows.move_to_end(user_id)
+            while len(self._rows) > self.max_users:
+                self._rows.popitem(last=False)
+        return arr
+
+    def add(self, user_id: int, row: int):
+        # Если пользователя нет в кэше, он прочитается из базы целиком при поиске
+        with self._lock:
+            rows = self._rows.get(user_id)
+            if rows is not None:
+                self._rows[user_id] = np.append(rows, row)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+
+_store: Optional[VectorStore] = None
+cache = RowCache(settings.memory_cache_users)
+
+
+def store() -> VectorStore:
+    global _store
+    if _store is None:
+        _load_numpy()
+        _store = VectorStore(settings.memory_path)
+        log.info("векторная память: %d записей в %s", _store.count, _store.path)
+    return _store
+
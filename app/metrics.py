@@ -0,0 +1,273 @@
+# app/metrics.py
+"""
+Метрики процесса в формате Prometheus.
+
+Свой маленький реестр вместо prometheus_client: счётчик — это словарь
+«значения меток → число», гистограмма — массив корзин. Обновление —
+поиск в словаре и сложение, так что инструментацию можно держать
+включённой под полной нагрузкой. Всё обновляется из потока event loop
+(и из asyncio.to_thread — там гонка лишь теряет единичный инкремент).
+
+GET /metrics на METRICS_PORT (0 — сервер не поднимается).
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import settings
+
+# Границы корзин по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY: List["_Metric"] = []
+
+log = logging.getLogger(__name__)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _sorted(d: Dict[Tuple, object]):
+    return sorted(d.items(), key=lambda kv: tuple(map(str, kv[0])))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def _label_str(self, values: Tuple, extra: str = "") -> str:
+        parts = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._label_str(k)} {_fmt(v)}" for k, v in _sorted(self.values)]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple, float] = {}
+        self._fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def set_function(self, fn: Callable[[], float]):
+        """Значение снимается в момент чтения /metrics (только для гейджа без меток)"""
+        self._fn = fn
+
+    def samples(self) -> List[str]:
+        if self._fn is not None:
+            return [f"{self.name} {_fmt(self._fn())}"]
+        return [f"{self.name}{self._label_str(k)} {_fmt(v)}" for k, v in _sorted(self.values)]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает q-квантиль"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else math.inf
+        return math.inf
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.children: Dict[Tuple, _HistogramChild] = {}
+
+    def child(self, *labels) -> _HistogramChild:
+        c = self.children.get(labels)
+        if c is None:
+            c = self.children[labels] = _HistogramChild(self.buckets)
+        return c
+
+    def observe(self, value: float, *labels):
+        self.child(*labels).observe(value)
+
+    def time(self, *labels):
+        """Декоратор: время вызова функции (обычной или async)"""
+        def deco(fn):
+            child = self.child(*labels)
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def awrapper(*args, **kwargs):
+                    t0 = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        child.observe(time.perf_counter() - t0)
+                return awrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - t0)
+            return wrapper
+        return deco
+
+    def samples(self) -> List[str]:
+        out = []
+        for key, c in _sorted(self.children):
+            acc = 0
+            for bound, n in zip(self.buckets + (math.inf,), c.counts):
+                acc += n
+                le = 'le="' + _fmt(bound) + '"'
+                out.append(f"{self.name}_bucket{self._label_str(key, le)} {acc}")
+            out.append(f"{self.name}_sum{self._label_str(key)} {_fmt(c.sum)}")
+            out.append(f"{self.name}_count{self._label_str(key)} {c.count}")
+        return out
+
+
+def render() -> str:
+    return "".join(m.render() for m in REGISTRY)
+
+
+# ---------- метрики процесса ----------
+
+JOBS = Counter("alina_jobs_total", "Выполненные задачи JobQueue", ("job", "outcome"))
+JOB_SECONDS = Histogram("alina_job_seconds", "Длительность задач JobQueue", ("job",))
+
+
+def job(name: str):
+    """Декоратор для колбэка JobQueue: счётчик запусков по исходу и время"""
+    def deco(fn):
+        timer = JOB_SECONDS.child(name)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception:
+                JOBS.inc(name, "error")
+                raise
+            finally:
+                timer.observe(time.perf_counter() - t0)
+            JOBS.inc(name, "ok")
+            return result
+        return wrapper
+    return deco
+
+
+# Заполняются пульсом из app/loopmon.py
+LOOP_LAG = Histogram(
+    "alina_event_loop_lag_seconds", "Задержка пробуждения event loop относительно плана",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_LAG_LAST = Gauge("alina_event_loop_lag_last_seconds", "Последний замер задержки event loop")
+
+
+# ---------- HTTP /metrics ----------
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+_server: Optional[asyncio.AbstractServer] = None
+
+
+async def start(port: Optional[int] = None, host: Optional[str] = None):
+    """Поднимает /metrics (вызывать из post_init)"""
+    global _server
+    port = settings.metrics_port if port is None else port
+    host = host or settings.metrics_host
+    if port:
+        _server = await asyncio.start_server(_handle, host, port)
+        log.info("/metrics на http://%s:%d", host, port)
+
+
+async def stop():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
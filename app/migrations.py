@@ -0,0 +1,499 @@
+# app/migrations.py
+"""
+Версионированные миграции схемы.
+
+Каждая миграция — идемпотентная функция с номером. Применённые версии
+записываются в таблицу schema_version, поэтому при актуальной схеме
+старт ограничивается одним SELECT без какого-либо DDL.
+Долгие бэкфиллы выполняются пачками в отдельных транзакциях, чтобы
+не держать блокировку записи всё время миграции.
+"""
+from __future__ import annotations
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+# (версия, описание, функция)
+MIGRATIONS: List[Tuple[int, str, Callable[[Engine], None]]] = []
+
+BACKFILL_BATCH = 1000       # строк за одну транзакцию
+BACKFILL_PAUSE = 0.01       # пауза между пачками, сек — отдаём блокировку другим
+
+
+def migration(version: int, description: str):
+    """Регистрирует функцию как миграцию с номером version"""
+    def deco(fn: Callable[[Engine], None]):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise RuntimeError(f"дублирующийся номер миграции: {version}")
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return deco
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    rows = conn.execute(text(f"PRAGMA table_info({table})")).mappings().all()
+    return any(r["name"] == column for r in rows)
+
+
+def run_in_batches(engine: Engine, sql: str, params: Dict | None = None,
+                   batch: int = BACKFILL_BATCH, pause: float = BACKFILL_PAUSE) -> int:
+    """
+    Выполняет UPDATE/DELETE пачками до тех пор, пока он что-то меняет.
+    sql должен сам ограничивать пачку через :batch, например:
+        UPDATE t SET x=... WHERE rowid IN (SELECT rowid FROM t WHERE x IS NULL LIMIT :batch)
+    Каждая пачка — своя транзакция, между ними отдаём блокировку.
+    Возвращает общее число изменённых строк.
+    """
+    total = 0
+    args = dict(params or {})
+    args["batch"] = batch
+    while True:
+        with engine.begin() as conn:
+            changed = conn.execute(text(sql), args).rowcount
+        total += max(changed, 0)
+        if changed < batch:
+            return total
+        time.sleep(pause)
+
+
+def rebuild_fts(engine: Engine, batch: int = 5000, pause: float = BACKFILL_PAUSE) -> int:
+    """
+    Переиндексирует messages_fts пачками по id (а не одним 'rebuild',
+    который держит блокировку записи на всё время). Пачки доходят только
+    до последнего id на момент старта — более новые сообщения уже
+    проиндексированы триггерами. Возвращает число строк.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES('delete-all')"))
+        upto = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM messages")).scalar()
+    last, total = 0, 0
+    while True:
+        with engine.begin() as conn:
+            hi = conn.execute(text(
+                "SELECT MAX(id) FROM (SELECT id FROM messages WHERE id > :last AND id <= :upto "
+                "ORDER BY id LIMIT :batch)"
+            ), {"last": last, "upto": upto, "batch": batch}).scalar()
+            if hi is None:
+                return total
+            # Источник — то же представление, что у индекса: сжатые строки
+            # берут текст из messages_fts_text
+            total += conn.execute(text(
+                "INSERT INTO messages_fts(rowid, content) "
+                "SELECT id, content FROM messages_fts_src WHERE id > :last AND id <= :hi"
+            ), {"last": last, "hi": hi}).rowcount
+        last = hi
+        time.sleep(pause)
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'"
+        )).first()
+        if not exists:
+            return 0
+        v = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+        return int(v or 0)
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Применяет недостающие миграции по порядку. Каждая версия фиксируется
+    сразу после успешного применения — прерванный запуск продолжится
+    с того же места. Возвращает текущую версию схемы.
+    """
+    version = current_version(engine)
+    if version >= latest_version():
+        return version
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version(
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );"""))
+
+    for v, description, fn in MIGRATIONS:
+        if v <= version:
+            continue
+        log.info("миграция %d: %s", v, description)
+        fn(engine)
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT OR IGNORE INTO schema_version(version, description) VALUES(:v, :d)"),
+                {"v": v, "d": description},
+            )
+        version = v
+    return version
+
+
+# -------------------- миграции --------------------
+
+@migration(1, "базовые таблицы")
+def _m001_base(engine: Engine):
+    with engine.begin() as conn:
+        # users
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS users(
+            user_id INTEGER PRIMARY KEY,
+            name TEXT,
+            style TEXT DEFAULT 'gentle',
+            verbosity TEXT DEFAULT 'normal',
+            free_left INTEGER DEFAULT 10,
+            is_subscribed INTEGER DEFAULT 0,
+            sub_until DATETIME,
+            tz TEXT,
+            last_cleanup DATETIME DEFAULT CURRENT_TIMESTAMP
+        );"""))
+
+        # messages - с индексом для быстрого поиска
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS messages(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            role TEXT,
+            content TEXT,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP
+        );"""))
+
+        # Индекс для оптимизации выборки истории
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_messages_user_ts
+        ON messages(user_id, ts DESC);
+        """))
+
+        # payments
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS payments(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            provider TEXT,
+            order_id TEXT,
+            amount INTEGER,
+            currency TEXT,
+            status TEXT,
+            raw TEXT,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP
+        );"""))
+
+        # reminders
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS reminders(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            rtype TEXT,          -- 'checkin' | 'morning' | 'evening'
+            time_local TEXT,     -- 'HH:MM'
+            active INTEGER DEFAULT 1
+        );"""))
+
+
+@migration(2, "users.last_cleanup")
+def _m002_last_cleanup(engine: Engine):
+    with engine.begin() as conn:
+        if not has_column(conn, "users", "last_cleanup"):
+            # Добавляем колонку без DEFAULT (ALTER не умеет CURRENT_TIMESTAMP)
+            conn.execute(text("ALTER TABLE users ADD COLUMN last_cleanup DATETIME;"))
+    # Заполняем существующие записи пачками, не блокируя базу надолго
+    run_in_batches(engine, """
+        UPDATE users SET last_cleanup = CURRENT_TIMESTAMP
+        WHERE rowid IN (SELECT rowid FROM users WHERE last_cleanup IS NULL LIMIT :batch)
+    """)
+
+
+@migration(3, "payments: уникальный order_id и индекс для истечения pending")
+def _m003_payments_indexes(engine: Engine):
+    with engine.begin() as conn:
+        # Дубли order_id до появления уникального индекса: оставляем оплаченную
+        # (или самую свежую) запись
+        conn.execute(text("""
+        DELETE FROM payments WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY order_id
+                    ORDER BY (status = 'paid') DESC, id DESC
+                ) AS rn
+                FROM payments
+            ) WHERE rn > 1
+        );"""))
+        conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_order
+        ON payments(order_id);
+        """))
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_payments_status_ts
+        ON payments(status, ts);
+        """))
+
+
+@migration(4, "users.sub_until_ts: срок подписки в epoch-секундах")
+def _m004_sub_until_ts(engine: Engine):
+    with engine.begin() as conn:
+        if not has_column(conn, "users", "sub_until_ts"):
+            conn.execute(text("ALTER TABLE users ADD COLUMN sub_until_ts INTEGER;"))
+    # Конвертируем наивный ISO (UTC) в epoch; нераспознанное — 0 (нет подписки)
+    run_in_batches(engine, """
+        UPDATE users
+        SET sub_until_ts = COALESCE(CAST(strftime('%s', sub_until) AS INTEGER), 0)
+        WHERE rowid IN (SELECT rowid FROM users WHERE sub_until_ts IS NULL LIMIT :batch)
+    """)
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_users_sub_until_ts
+        ON users(sub_until_ts);
+        """))
+
+
+@migration(5, "llm_usage: токены и стоимость по дням, пользователям и моделям")
+def _m005_llm_usage(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS llm_usage(
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            verbosity TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            truncated INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            latency_ms INTEGER NOT NULL DEFAULT 0,
+            cost_usd REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id, model, kind, verbosity)
+        );
+        """))
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_llm_usage_user_day
+        ON llm_usage(user_id, day);
+        """))
+
+
+@migration(6, "summaries: свёрнутая история диалога")
+def _m006_summaries(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS summaries(
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            upto_id INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """))
+
+
+@migration(7, "memories: тексты и строки векторного индекса памяти")
+def _m007_memories(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS memories(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            vec_row INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """))
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_memories_user_row
+        ON memories(user_id, vec_row);
+        """))
+
+
+@migration(8, "messages_fts: полнотекстовый индекс по истории")
+def _m008_messages_fts(engine: Engine):
+    # external content: несжатый текст хранится только в messages. Сжатым
+    # строкам (app/codec.py) индексу нужен обычный текст — он в
+    # messages_fts_text (пишет add_msg или триггер при пережатии). Источник —
+    # обычное представление, без функций Python: писать в messages и читать
+    # индекс может любой клиент SQLite. Колонка codec нужна представлению
+    # уже здесь; сжатие начинает её заполнять с миграции 10.
+    with engine.begin() as conn:
+        if not has_column(conn, "messages", "codec"):
+            conn.execute(text("ALTER TABLE messages ADD COLUMN codec INTEGER;"))
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS messages_fts_text(
+            id INTEGER PRIMARY KEY,     -- messages.id сжатого сообщения
+            content TEXT NOT NULL
+        );
+        """))
+        conn.execute(text("""
+        CREATE VIEW IF NOT EXISTS messages_fts_src AS
+        SELECT id, content FROM messages WHERE codec IS NULL
+        UNION ALL
+        SELECT id, content FROM messages_fts_text;
+        """))
+        conn.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages_fts_src',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """))
+        for name in ("messages_fts_ai", "messages_fts_ad", "messages_fts_au"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name};"))
+    # Существующая история — пачками; триггеров ещё нет, бот не запущен
+    rebuild_fts(engine)
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages WHEN new.codec IS NULL BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END;
+        """))
+        conn.execute(text("""
+        CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content)
+            VALUES ('delete', old.id, CASE WHEN old.codec IS NULL THEN old.content
+                ELSE (SELECT content FROM messages_fts_text WHERE id = old.id) END);
+            DELETE FROM messages_fts_text WHERE old.codec IS NOT NULL AND id = old.id;
+        END;
+        """))
+        # Пережатие (python -m app.codec) текст не меняет: индекс остаётся,
+        # текст переезжает между messages и messages_fts_text
+        conn.execute(text("""
+        CREATE TRIGGER messages_fts_au AFTER UPDATE OF content, codec ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content)
+            SELECT 'delete', old.id, old.content WHERE old.codec IS NULL AND new.codec IS NULL;
+            INSERT INTO messages_fts(rowid, content)
+            SELECT new.id, new.content WHERE old.codec IS NULL AND new.codec IS NULL;
+            INSERT OR REPLACE INTO messages_fts_text(id, content)
+            SELECT new.id, old.content WHERE old.codec IS NULL AND new.codec IS NOT NULL;
+            DELETE FROM messages_fts_text WHERE new.codec IS NULL AND id = new.id;
+        END;
+        """))
+
+
+@migration(9, "archive_segments: индекс сегментов архива холодной истории")
+def _m009_archive_segments(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS archive_segments(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            day TEXT NOT NULL,
+            path TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """))
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_archive_segments_day
+        ON archive_segments(day, first_id);
+        """))
+
+
+
+@migration(10, "messages.codec: сжатие длинных сообщений")
+def _m010_messages_codec(engine: Engine):
+    # Обычно колонку уже добавила миграция 8 (её читает источник индекса)
+    with engine.begin() as conn:
+        if not has_column(conn, "messages", "codec"):
+            conn.execute(text("ALTER TABLE messages ADD COLUMN codec INTEGER;"))
+
+
+@migration(11, "pending_replies: сообщения без ответа, отложенные при остановке")
+def _m011_pending_replies(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS pending_replies(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            names TEXT,
+            charged INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """))
+
+
+@migration(12, "user_flags: флаги диалога из user_data (ожидание ввода)")
+def _m012_user_flags(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_flags(
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """))
+
+
+@migration(13, "reminders: индекс по пользователю")
+def _m013_reminders_user(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_reminders_user
+        ON reminders(user_id, time_local);
+        """))
+
+
+@migration(14, "рассылки: broadcasts, users.blocked и users.last_active_ts")
+def _m014_broadcasts(engine: Engine):
+    with engine.begin() as conn:
+        if not has_column(conn, "users", "blocked"):
+            conn.execute(text("ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0;"))
+        if not has_column(conn, "users", "last_active_ts"):
+            conn.execute(text("ALTER TABLE users ADD COLUMN last_active_ts INTEGER;"))
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS broadcasts(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            segment TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'draft',  -- draft | running | paused | done | cancelled
+            cursor INTEGER NOT NULL DEFAULT 0,     -- последний обработанный user_id
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_by INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        );
+        """))
+    # Последняя активность — по последнему сообщению пользователя; без сообщений — 0
+    run_in_batches(engine, """
+        UPDATE users SET last_active_ts = COALESCE((
+            SELECT CAST(strftime('%s', MAX(m.ts)) AS INTEGER) FROM messages m
+            WHERE m.user_id = users.user_id AND m.role = 'user'
+        ), 0)
+        WHERE rowid IN (SELECT rowid FROM users WHERE last_active_ts IS NULL LIMIT :batch)
+    """)
+
+
+@migration(15, "messages: индекс по ts для архива")
+def _m015_messages_ts(engine: Engine):
+    # Без него поиск «старше ARCHIVE_AFTER_DAYS» — полный скан messages на каждом запуске
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts);"))
+
+
+if __name__ == "__main__":
+    # python -m app.migrations [migrate | rebuild-fts]
+    import sys
+    from .db import engine as _engine
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if cmd == "migrate":
+        print(f"схема: версия {migrate(_engine)}")
+    elif cmd == "rebuild-fts":
+        migrate(_engine)
+        print(f"проиндексировано сообщений: {rebuild_fts(_engine)}")
+    else:
+        sys.exit("использование: python -m app.migrations [migrate | rebuild-fts]")
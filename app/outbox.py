@@ -0,0 +1,315 @@
+# app/outbox.py
+"""
+Очередь исходящих сообщений с учётом лимитов Telegram.
+
+Все отправки проходят через один диспетчер:
+- глобальный token bucket (~30 сообщений/с на бота) и bucket на каждый чат (~1/с);
+- приоритеты: ответы в диалоге важнее напоминаний, напоминания важнее
+  предложений продлить и рассылок;
+- RetryAfter не роняет отправку — сообщение возвращается в очередь
+  после указанной паузы, а на это время «замораживаются» и чат, и вся
+  отправка (лимит по чату мы сами не превышаем, так что 429 — это лимит бота);
+- «печатает…» не отправляется повторно, пока предыдущий статус ещё виден,
+  и пропускается, пока глобальный лимит исчерпан или стоит на паузе.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter, TelegramError
+
+from .config import settings
+from . import tracing
+from .metrics import Counter, Gauge
+
+log = logging.getLogger(__name__)
+
+# Приоритеты (меньше — раньше)
+INTERACTIVE = 0
+REMINDER = 1
+NUDGE = 2
+BROADCAST = 3
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", REMINDER: "reminder", NUDGE: "nudge", BROADCAST: "broadcast"}
+
+MAX_RETRIES = 5
+TYPING_TTL = 4.5            # статус «печатает» держится ~5 секунд
+LATENCY_WINDOW = 1000       # сколько последних замеров держим для перцентилей
+
+
+OUTBOX_DEPTH = Gauge("alina_outbox_depth", "Сообщений в очереди на отправку")
+OUTBOX_EVENTS = Counter("alina_outbox_events_total", "События очереди: sent, failed, retry_after, typing_skipped, typing_failed", ("event",))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def _refill(self, now: float):
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 — можно сейчас)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        """Запретить отправку на seconds (после RetryAfter); более длинную паузу не сокращает"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1.0 - seconds * self.rate)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "call", "priority", "future", "enqueued", "not_before", "attempts", "trace")
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.not_before = 0.0
+        self.attempts = 0
+        # Трейс отправителя: воркер живёт в своём контексте
+        self.trace = tracing.current()
+
+
+def _retry_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if isinstance(ra, timedelta) else float(ra)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Outbox:
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+        self._heap: List[Tuple[int, int, _Job]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+
+        now = time.monotonic()
+        self._global = TokenBucket(global_rate, global_rate, now)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._typing: Dict[int, float] = {}
+
+        self.counters: Dict[str, int] = {"sent": 0, "failed": 0, "retry_after": 0, "typing_skipped": 0, "typing_failed": 0}
+        self._queue_wait: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._send_latency: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    # ---------- публичный API ----------
+
+    async def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: int = INTERACTIVE):
+        """Ставит отправку в очередь и ждёт её результата"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._push(_Job(chat_id, call, priority, future))
+        return await future
+
+    async def send_message(self, bot, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs):
+        return await self.submit(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), priority)
+
+    async def reply(self, message, text: str, priority: int = INTERACTIVE, **kwargs):
+        return await self.submit(message.chat_id, lambda: message.reply_text(text, **kwargs), priority)
+
+    async def typing(self, bot, chat_id: int):
+        """«печатает…» — не чаще, чем статус успевает погаснуть.
+
+        Статус необязателен: если лимит бота исчерпан или на паузе после
+        RetryAfter, его пропускаем, а ошибки не пробрасываем отправителю.
+        """
+        now = time.monotonic()
+        if now - self._typing.get(chat_id, 0.0) < TYPING_TTL or self._global.delay(now) > 0:
+            self._count("typing_skipped")
+            return
+        self._global.take(now)
+        self._typing[chat_id] = now
+        if len(self._typing) > 10_000:
+            self._typing = {c: t for c, t in self._typing.items() if now - t < TYPING_TTL}
+        try:
+            await bot.send_chat_action(chat_id=chat_id, action="typing")
+        except RetryAfter as e:
+            self._count("retry_after")
+            now, secs = time.monotonic(), _retry_seconds(e)
+            self._global.pause(now, secs)
+            self._bucket(chat_id, now).pause(now, secs)
+        except TelegramError as e:
+            self._count("typing_failed")
+            log.debug("typing не отправлен", extra={"user_id": chat_id, "error": str(e)})
+
+    def depth(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        by_priority: Dict[str, int] = {}
+        for prio, _, _ in self._heap:
+            name = PRIORITY_NAMES.get(prio, str(prio))
+            by_priority[name] = by_priority.get(name, 0) + 1
+        qw, sl = list(self._queue_wait), list(self._send_latency)
+        return {
+            "depth": len(self._heap),
+            "depth_by_priority": by_priority,
+            "in_flight": len(self._inflight),
+            **self.counters,
+            "queue_wait_p50": _percentile(qw, 0.5),
+            "queue_wait_p95": _percentile(qw, 0.95),
+            "send_latency_p50": _percentile(sl, 0.5),
+            "send_latency_p95": _percentile(sl, 0.95),
+        }
+
+    async def drain(self, timeout: float) -> bool:
+        """Ждёт, пока очередь и текущие отправки опустеют; True — успели"""
+        deadline = time.monotonic() + timeout
+        while self._heap or self._inflight:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    # ---------- внутреннее ----------
+
+    def _count(self, event: str):
+        self.counters[event] += 1
+        OUTBOX_EVENTS.inc(event)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            # Чистый контекст: иначе воркер унаследует трейс первого отправителя
+            self._worker = asyncio.get_running_loop().create_task(
+                self._run(), name="outbox", context=contextvars.Context()
+            )
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    def _bucket(self, chat_id: int, now: float) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if len(self._chats) > 10_000:
+                self._chats = {c: b for c, b in self._chats.items() if not b.idle(now)}
+            b = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return b
+
+    def _pop_ready(self, now: float) -> Tuple[Optional[_Job], Optional[float]]:
+        """Самое приоритетное сообщение, чат которого сейчас можно писать"""
+        deferred = []
+        picked, wait = None, None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            d = max(job.not_before - now, self._bucket(job.chat_id, now).delay(now))
+            if d <= 0:
+                picked = job
+                break
+            deferred.append(entry)
+            wait = d if wait is None else min(wait, d)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return picked, wait
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            d = self._global.delay(now)
+            if d > 0:
+                await asyncio.sleep(d)
+                continue
+
+            job, wait = self._pop_ready(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job.future.cancelled():
+                # Ждавший отправку обработчик уже отменён — не тратим лимит
+                continue
+
+            self._global.take(now)
+            self._bucket(job.chat_id, now).take(now)
+            task = asyncio.get_running_loop().create_task(self._deliver(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, job: _Job):
+        start = time.monotonic()
+        self._queue_wait.append(start - job.enqueued)
+        if job.trace is not None:
+            job.trace.add("queue_wait", start - job.enqueued)
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            self._count("retry_after")
+            job.attempts += 1
+            if job.attempts > MAX_RETRIES:
+                self._count("failed")
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            secs = _retry_seconds(e)
+            now = time.monotonic()
+            # Telegram не говорит, чей лимит превышен. Чат мы держим в ~1/с, так
+            # что это скорее лимит бота — иначе остальные чаты получат ещё 429
+            self._global.pause(now, secs)
+            self._bucket(job.chat_id, now).pause(now, secs)
+            job.not_before = now + secs
+            self._push(job)
+            return
+        except Exception as e:
+            self._count("failed")
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self._send_latency.append(time.monotonic() - start)
+        self._count("sent")
+        if not job.future.done():
+            job.future.set_result(result)
+
+
+outbox = Outbox(
+    global_rate=settings.outbox_global_rate,
+    chat_rate=settings.outbox_chat_rate,
+    chat_burst=settings.outbox_chat_burst,
+)
+OUTBOX_DEPTH.set_function(outbox.depth)
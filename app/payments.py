@@ -1,10 +1,16 @@
 # app/payments.py (Stars-only)
 from __future__ import annotations
+import asyncio
+import logging
 import uuid
 from telegram import LabeledPrice, PreCheckoutQuery, Update
-from telegram.ext import ContextTypes
+from telegram.ext import Application, ContextTypes
 from .config import settings
 import app.db as db
+from .outbox import outbox
+from .metrics import Counter, job
+
+log = logging.getLogger(__name__)
 
 # Маппинг планов
 PLANS = {
@@ -13,13 +19,18 @@ PLANS = {
     "month": {"amount": settings.stars_month_amount, "days": settings.sub_days_month, "title": "месяц общения"},
 }
 
+PAYMENT_EVENTS = Counter(
+    "alina_payment_events_total", "События оплаты: invoice, precheckout, paid, duplicate, expired",
+    ("event", "plan"),
+)
+
 def _payload(plan: str) -> str:
     return f"stars_{plan}_{uuid.uuid4()}"
 
 async def send_stars_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE, plan: str) -> None:
     """Отправить инвойс в XTR для выбранного плана"""
     if plan not in PLANS:
-        await update.effective_message.reply_text("выбери один из планов: день, неделя или месяц 💛")
+        await outbox.reply(update.effective_message, "выбери один из планов: день, неделя или месяц 💛")
         return
 
     user_id = update.effective_user.id
@@ -46,11 +57,13 @@ async def send_stars_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE,
         prices=prices,
         start_parameter=f"stars-{plan}",
     )
+    PAYMENT_EVENTS.inc("invoice", plan)
 
 async def precheckout_stars(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обязательный pre-checkout для Stars"""
     query: PreCheckoutQuery = update.pre_checkout_query
     await query.answer(ok=True)
+    PAYMENT_EVENTS.inc("precheckout", _extract_plan_from_payload(query.invoice_payload))
 
 def _extract_plan_from_payload(payload: str) -> str:
     # формат: stars_<plan>_<uuid>
@@ -65,9 +78,33 @@ async def on_successful_payment(update: Update, context: ContextTypes.DEFAULT_TY
     plan = _extract_plan_from_payload(payload)
     meta = PLANS.get(plan, PLANS["month"])
 
-    db.mark_payment(order_id=payload, status="paid")
-    db.activate_subscription(update.effective_user.id, days=meta["days"])
+    # Отметка платежа и продление подписки — одной транзакцией
+    user_id = update.effective_user.id
+    new_until = await asyncio.to_thread(
+        db.complete_payment,
+        user_id=user_id, provider="stars", order_id=payload,
+        amount=sp.total_amount, currency=sp.currency, days=meta["days"], raw=plan
+    )
+    if new_until is None:
+        # Повторная доставка того же платежа — подписка уже продлена, спасибо уже сказали
+        PAYMENT_EVENTS.inc("duplicate", plan)
+        return
+    PAYMENT_EVENTS.inc("paid", plan)
 
     period_label = meta["title"].lower()
     # Обновленное сообщение
-    await update.message.reply_text(f"спасибо! буду рядом: {period_label} 💛")
\ No newline at end of file
+    await outbox.reply(update.message, f"спасибо! буду рядом: {period_label} 💛")
+
+@job("payments_expire")
+async def _expire_pending(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: помечает брошенные инвойсы как expired"""
+    n = await asyncio.to_thread(db.expire_stale_payments, settings.payment_pending_ttl_hours)
+    if n:
+        PAYMENT_EVENTS.inc("expired", "", amount=n)
+        log.info("истекло неоплаченных инвойсов: %d", n)
+
+def schedule_payment_expiry(app: Application, interval_sec: int = 3600):
+    jq = getattr(app, "job_queue", None)
+    if jq is None:
+        return
+    jq.run_repeating(_expire_pending, interval=interval_sec, first=60, name="payments:expire")
@@ -0,0 +1,203 @@
+# app/persistence.py
+"""
+Хранение context.user_data (флаги диалога: await_tz, await_custom_time)
+в таблице user_flags вместо памяти процесса.
+
+- Загрузка ленивая: при старте ничего не читается, данные пользователя
+  подгружаются в refresh_user_data перед первым его обновлением. Список
+  пользователей, у которых вообще есть строка, читается один раз — для
+  остальных в базу не ходим.
+- PTB раз в USER_FLAGS_FLUSH_SEC отдаёт update_user_data по каждому
+  пользователю с обновлениями; пишутся только те, чьи флаги изменились,
+  одной пачкой. Хранятся только истинные значения, пустой набор удаляет
+  строку — таблица не растёт от всех, кто когда-то открывал /tz.
+- evict() выгружает из памяти пользователей без обновлений дольше
+  USER_FLAGS_TTL_SEC (в базе флаги остаются).
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from telegram.ext import Application, BasePersistence, ContextTypes, PersistenceInput
+
+from .config import settings
+from .metrics import Gauge, job
+import app.db as db
+
+log = logging.getLogger(__name__)
+
+USER_FLAGS_LOADED = Gauge("alina_user_flags_loaded", "Пользователей с user_data в памяти")
+
+_WRITE_DELAY = 0.05     # сек: собрать в одну пачку все update_user_data одного сброса
+
+
+def _flags(data: Dict) -> Dict:
+    """Что сохраняем: только истинные значения, сериализуемые в JSON"""
+    out = {}
+    for k, v in data.items():
+        if not v:
+            continue
+        try:
+            json.dumps(v)
+        except (TypeError, ValueError):
+            continue
+        out[k] = v
+    return out
+
+
+class UserFlagsPersistence(BasePersistence):
+    def __init__(self, update_interval: Optional[float] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=settings.user_flags_flush_sec if update_interval is None else update_interval,
+        )
+        self._stored: Optional[Set[int]] = None   # у кого есть строка в user_flags
+        self._live: Dict[int, Dict] = {}          # user_id → тот же dict, что context.user_data
+        self._saved: Dict[int, Dict] = {}         # что сейчас лежит в базе
+        self._seen: Dict[int, float] = {}
+        self._dirty: Dict[int, Dict] = {}
+        self._evicting: Set[int] = set()
+        self._writer: Optional[asyncio.Task] = None
+        USER_FLAGS_LOADED.set_function(lambda: len(self._live))
+
+    # ---------- user_data ----------
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        self._seen[user_id] = time.monotonic()
+        if self._live.get(user_id) is user_data:
+            return
+        if self._stored is None:
+            self._stored = set(await asyncio.to_thread(db.user_flag_ids))
+        flags = await asyncio.to_thread(db.get_user_flags, user_id) if user_id in self._stored else {}
+        for k, v in flags.items():
+            user_data.setdefault(k, v)
+        self._live[user_id] = user_data
+        self._saved[user_id] = flags
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._mark(user_id, _flags(data))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._evicting:
+            # Выгрузка из памяти, а не удаление. Если пользователь успел
+            # вернуться, PTB пропустил его обновление — сверяем сами
+            self._evicting.discard(user_id)
+            if user_id in self._live:
+                self._mark(user_id, _flags(self._live[user_id]))
+            return
+        self._forget(user_id)
+        self._dirty[user_id] = {}
+        self._schedule()
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        await self._write()
+
+    # ---------- выгрузка ----------
+
+    def evict(self, application: Application, ttl_sec: Optional[float] = None) -> int:
+        """Выгружает из памяти неактивных пользователей; возвращает их число"""
+        ttl = settings.user_flags_ttl_sec if ttl_sec is None else ttl_sec
+        cutoff = time.monotonic() - ttl
+        idle = [u for u, t in self._seen.items() if t < cutoff and u not in self._dirty]
+        for user_id in idle:
+            self._forget(user_id)
+            self._evicting.add(user_id)
+            application.drop_user_data(user_id)
+        return len(idle)
+
+    # ---------- внутреннее ----------
+
+    def _forget(self, user_id: int):
+        self._live.pop(user_id, None)
+        self._saved.pop(user_id, None)
+        self._seen.pop(user_id, None)
+
+    def _mark(self, user_id: int, flags: Dict):
+        if flags != self._saved.get(user_id, {}):
+            self._dirty[user_id] = flags
+            self._schedule()
+
+    def _schedule(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write(_WRITE_DELAY))
+
+    async def _write(self, delay: float = 0.0):
+        if delay:
+            await asyncio.sleep(delay)
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(db.save_user_flags, batch)
+        except Exception:
+            log.exception("не удалось сохранить user_data", extra={"users": len(batch)})
+            for user_id, flags in batch.items():
+                self._dirty.setdefault(user_id, flags)
+            return
+        for user_id, flags in batch.items():
+            if user_id in self._live:
+                self._saved[user_id] = flags
+            if self._stored is not None and flags:
+                self._stored.add(user_id)
+            elif self._stored is not None:
+                self._stored.discard(user_id)
+
+    # ---------- не используется (store_data только user_data) ----------
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+
+@job("user_flags_evict")
+async def _evict_job(context: ContextTypes.DEFAULT_TYPE):
+    persistence = context.application.persistence
+    if isinstance(persistence, UserFlagsPersistence):
+        evicted = persistence.evict(context.application)
+        if evicted:
+            log.debug("user_data выгружены из памяти", extra={"users": evicted})
+
+
+def schedule_evict(app: Application):
+    jq = getattr(app, "job_queue", None)
+    if jq is None:
+        return
+    interval = max(60, settings.user_flags_ttl_sec // 4)
+    jq.run_repeating(_evict_job, interval=interval, first=interval, name="user_flags:evict")
@@ -0,0 +1,120 @@
+# app/postprocess.py
+"""
+Постобработка ответа модели.
+
+Конвейер из заранее скомпилированных построчных стадий. Все стадии
+работают в пределах одной строки, поэтому текст можно обрабатывать
+потоком: PostprocessStream принимает куски ответа по мере поступления
+и отдаёт готовые строки, не дожидаясь конца.
+"""
+from __future__ import annotations
+import re
+from typing import Callable, Iterable, Iterator, Tuple
+
+# Префиксы, которыми модель иногда подписывает ответ
+_PREFIXES = ("Алина:", "Алина —", "Алина -")
+
+# Маркер пункта нумерованного списка: «1. » или «1) »
+_LIST_MARKER = re.compile(r"(?:^|[ \t]+)(\d{1,3})[.)][ \t]+(?=\S)")
+# Пункт списка с тире или точкой
+_DASH_BULLET = re.compile(r"(?:^|\s)[-•]\s+")
+# Жирный → одинарные звёздочки для Telegram
+_BOLD = re.compile(r"\*\*(.*?)\*\*")
+
+
+def _split_numbered(line: str) -> str:
+    """«1. раз 2. два» в одной строке → каждый пункт с новой строки"""
+    if len(_LIST_MARKER.findall(line)) < 2:
+        return line
+    return _LIST_MARKER.sub(lambda m: "\n" + m.group(1) + ". ", line).lstrip("\n")
+
+
+def _bullets(line: str) -> str:
+    if "-" not in line and "•" not in line:
+        return line
+    return _DASH_BULLET.sub("\n• ", line).lstrip("\n")
+
+
+def _bold(line: str) -> str:
+    if "**" not in line:
+        return line
+    return _BOLD.sub(r"*\1*", line)
+
+
+LINE_STAGES: Tuple[Callable[[str], str], ...] = (_split_numbered, _bullets, _bold)
+
+
+def process_line(line: str) -> str:
+    for stage in LINE_STAGES:
+        line = stage(line)
+    return line
+
+
+def _strip_prefix(line: str) -> str:
+    for prefix in _PREFIXES:
+        if line.startswith(prefix):
+            return line[len(prefix):].lstrip()
+    return line
+
+
+class PostprocessStream:
+    """
+    Потоковая постобработка: feed() принимает очередной кусок и возвращает
+    уже готовый текст, close() — остаток. Склейка всех возвращённых
+    кусков совпадает с postprocess() от полного текста.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._emitted = False
+        self._pending_blank = False
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk
+        cut = self._buf.rfind("\n")
+        if cut < 0:
+            return ""
+        ready, self._buf = self._buf[:cut], self._buf[cut + 1:]
+        return "".join(self._line(line) for line in ready.split("\n"))
+
+    def close(self) -> str:
+        rest, self._buf = self._buf, ""
+        return self._line(rest)
+
+    def _line(self, line: str) -> str:
+        if not self._emitted:
+            line = _strip_prefix(line.lstrip())
+        out = []
+        for part in process_line(line).split("\n"):
+            part = part.rstrip()
+            if not part:
+                # Несколько пустых строк подряд схлопываются в одну,
+                # пустые строки в начале и в конце отбрасываются
+                self._pending_blank = self._emitted
+                continue
+            if self._emitted:
+                out.append("\n\n" if self._pending_blank else "\n")
+            out.append(part)
+            self._emitted = True
+            self._pending_blank = False
+        return "".join(out)
+
+
+def postprocess(text: str) -> str:
+    """Постобработка ответа целиком"""
+    if not text:
+        return text
+    s = PostprocessStream()
+    return s.feed(text) + s.close()
+
+
+def postprocess_stream(chunks: Iterable[str]) -> Iterator[str]:
+    """Постобработка потока кусков ответа (например, при stream=True)"""
+    s = PostprocessStream()
+    for chunk in chunks:
+        out = s.feed(chunk)
+        if out:
+            yield out
+    tail = s.close()
+    if tail:
+        yield tail
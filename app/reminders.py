@@ -1,23 +1,28 @@
 # app/reminders.py
 from __future__ import annotations
+import asyncio
+import logging
 import re
 import random
+from collections import OrderedDict
 from datetime import time as dtime, timezone, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, Application
-from telegram.constants import ParseMode
 
 import app.db as db
-from .llm_client import LLMClient
 from .prompts import SYSTEM_PROMPT
+from .render import send_text
+from .outbox import REMINDER
+from . import metrics
 
-# ленивый клиент LLM
-_llm = None
+log = logging.getLogger(__name__)
+
+# клиент LLM (и весь стек openai/httpx) — только при первом напоминании
 def _get_llm():
-    global _llm
-    if _llm is None:
-        _llm = LLMClient()
-    return _llm
+    from .llm_client import get
+    return get()
 
 # ----- TZ helpers -----
 def _tzinfo_from_str(tz_str: str):
@@ -77,6 +82,7 @@ def _pick_fallback(rtype: str) -> str:
     return random.choice(messages)
 
 # ----- job callback -----
+@metrics.job("reminder")
 async def _send_reminder(context: ContextTypes.DEFAULT_TYPE):
     """Отправляет напоминание пользователю"""
     data = context.job.data or {}
@@ -85,7 +91,7 @@ async def _send_reminder(context: ContextTypes.DEFAULT_TYPE):
     chat_id = user_id
 
     # Профиль пользователя
-    u = db.get_user(user_id)
+    u = await asyncio.to_thread(db.get_user, user_id)
     name = u.get("name") or ""
     style = "gentle"
     
@@ -111,19 +117,17 @@ async def _send_reminder(context: ContextTypes.DEFAULT_TYPE):
 
         try:
             llm = _get_llm()
-            text = await llm.chat(msgs, temperature=0.7, max_tokens=100, verbosity="short")
+            text = await llm.chat(
+                msgs, temperature=0.7, max_tokens=100, verbosity="short", user_id=user_id, kind="reminder",
+            )
             # Если сгенерировалось слишком длинное, обрезаем
             if text and len(text) > 150:
                 text = text[:150].rsplit(" ", 1)[0] + "..."
         except Exception:
             text = _pick_fallback(rtype)
 
-    # Отправляем с форматированием
-    try:
-        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN)
-    except Exception:
-        # Если ошибка форматирования - отправляем без него
-        await context.bot.send_message(chat_id=chat_id, text=text)
+    # Отправляем с форматированием (HTML рендерится заранее, без повторной отправки)
+    await send_text(context.bot, chat_id, text, priority=REMINDER)
 
 # ----- JobQueue glue -----
 def _job_queue(app: Application):
@@ -164,8 +168,8 @@ def schedule_one(app: Application, user_id: int, rid: int, rtype: str, time_loca
             data={"user_id": user_id, "rtype": rtype},
             name=name,
         )
-    except Exception as e:
-        print(f"Ошибка планирования напоминания: {e}")
+    except Exception:
+        log.exception("ошибка планирования напоминания", extra={"user_id": user_id, "reminder_id": rid})
 
 def deschedule_one(app: Application, user_id: int, rid: int):
     """Отменяет одно напоминание"""
@@ -186,4 +190,93 @@ def reschedule_all_for_user(app: Application, user_id: int):
         if r["active"]:
             schedule_one(app, user_id, r["id"], r["rtype"], r["time_local"], tz)
         else:
-            deschedule_one(app, user_id, r["id"])
\ No newline at end of file
+            deschedule_one(app, user_id, r["id"])
+
+
+# ----- список напоминаний и клавиатура /reminders -----
+# Список и готовая клавиатура кэшируются на пользователя: нажатие кнопки —
+# один запрос (UPDATE ... RETURNING), клавиатура пересобирается из кэша.
+# Все изменения идут через функции ниже, они же обновляют кэш.
+
+FILLER = " " * 10       # для «узкой» кнопки корзины: визуальный наполнитель
+_CACHE_USERS = 5000
+
+# Нижние строки одинаковы у всех — кнопки неизменяемые, создаются один раз
+_STATIC_ROWS = (
+    (InlineKeyboardButton("Добавить «Доброе утро» (09:00)", callback_data="rem|add|morning|0900"),),
+    (InlineKeyboardButton("Добавить «Вечерний привет» (21:00)", callback_data="rem|add|evening|2100"),),
+    (InlineKeyboardButton("Добавить своё время…", callback_data="rem|add|custom"),),
+)
+
+_cache: "OrderedDict[int, Tuple[List[Dict], InlineKeyboardMarkup]]" = OrderedDict()
+
+
+def _reminder_row(r: Dict) -> tuple:
+    state = "вкл" if r["active"] else "выкл"
+    label = f"⏰ {r['time_local']} ({state}) — {r.get('rtype') or 'checkin'}{FILLER}"
+    return (
+        InlineKeyboardButton(label, callback_data=f"rem|toggle|{r['id']}"),
+        InlineKeyboardButton("🗑", callback_data=f"rem|del|{r['id']}"),
+    )
+
+
+def _put(user_id: int, reminders: List[Dict]) -> Tuple[List[Dict], InlineKeyboardMarkup]:
+    entry = (reminders, InlineKeyboardMarkup(tuple(_reminder_row(r) for r in reminders) + _STATIC_ROWS))
+    _cache[user_id] = entry
+    _cache.move_to_end(user_id)
+    while len(_cache) > _CACHE_USERS:
+        _cache.popitem(last=False)
+    return entry
+
+
+async def _entry(user_id: int) -> Tuple[List[Dict], InlineKeyboardMarkup]:
+    entry = _cache.get(user_id)
+    if entry is not None:
+        _cache.move_to_end(user_id)
+        return entry
+    return _put(user_id, await asyncio.to_thread(db.list_reminders, user_id))
+
+
+async def keyboard(user_id: int) -> InlineKeyboardMarkup:
+    return (await _entry(user_id))[1]
+
+
+def invalidate(user_id: int):
+    _cache.pop(user_id, None)
+
+
+async def toggle(app: Application, user_id: int, rid: int) -> Optional[InlineKeyboardMarkup]:
+    """Включает/выключает напоминание; None — такого нет"""
+    row = await asyncio.to_thread(db.toggle_reminder, user_id, rid)
+    if row is None:
+        invalidate(user_id)
+        return None
+    if row["active"]:
+        schedule_one(app, user_id, rid, row["rtype"], row["time_local"], row["tz"] or "UTC")
+    else:
+        deschedule_one(app, user_id, rid)
+    entry = _cache.get(user_id)
+    if entry is None:
+        return await keyboard(user_id)
+    changed = {k: row[k] for k in ("active", "rtype", "time_local")}
+    return _put(user_id, [dict(r, **changed) if r["id"] == rid else r for r in entry[0]])[1]
+
+
+async def delete(app: Application, user_id: int, rid: int) -> InlineKeyboardMarkup:
+    deschedule_one(app, user_id, rid)
+    await asyncio.to_thread(db.delete_reminder, user_id, rid)
+    entry = _cache.get(user_id)
+    if entry is None:
+        return await keyboard(user_id)
+    return _put(user_id, [r for r in entry[0] if r["id"] != rid])[1]
+
+
+def _add_sync(user_id: int, rtype: str, hhmm: str):
+    return db.add_reminder(user_id, rtype, hhmm), db.get_tz(user_id) or "UTC"
+
+
+async def add(app: Application, user_id: int, rtype: str, hhmm: str) -> InlineKeyboardMarkup:
+    rid, tz = await asyncio.to_thread(_add_sync, user_id, rtype, hhmm)
+    schedule_one(app, user_id, rid, rtype, hhmm, tz)
+    invalidate(user_id)
+    return await keyboard(user_id)
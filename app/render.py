@@ -0,0 +1,80 @@
+# app/render.py
+"""
+Рендер ответа в HTML для Telegram.
+
+Вместо отправки «как есть» с ParseMode.MARKDOWN (и повторной отправки
+без разметки, если Telegram не смог её разобрать) заранее переводим
+лёгкую разметку из postprocess() в гарантированно валидный HTML:
+всё, что не является парной разметкой, экранируется как обычный текст.
+"""
+from __future__ import annotations
+import html
+import logging
+import re
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+from .metrics import Counter
+from .outbox import outbox, INTERACTIVE
+
+log = logging.getLogger(__name__)
+
+# ```код```, `код`, *жирный*, _курсив_. Непарные символы остаются текстом.
+_MARKUP = re.compile(
+    r"```(?:[a-zA-Z0-9_+-]*\n)?(?P<pre>.+?)```"
+    r"|`(?P<code>[^`\n]+)`"
+    r"|(?<![\w*])\*(?=\S)(?P<b>[^*\n]+?)(?<=\S)\*(?![\w*])"
+    r"|(?<![\w_])_(?=\S)(?P<i>[^_\n]+?)(?<=\S)_(?![\w_])",
+    re.DOTALL,
+)
+
+_TAGS = {"pre": "pre", "code": "code", "b": "b", "i": "i"}
+
+# sent — доставлено, failed — отправка не удалась, parse_error — Telegram отверг
+# разметку и текст ушёл без неё (должно быть 0)
+SEND_TOTAL = Counter("alina_send_total", "Отправки текста через send_text: sent, failed, parse_error", ("result",))
+
+
+def to_html(text: str) -> str:
+    """Текст с лёгкой разметкой → экранированный HTML для ParseMode.HTML"""
+    if not text:
+        return text
+    out = []
+    last = 0
+    for m in _MARKUP.finditer(text):
+        out.append(html.escape(text[last:m.start()], quote=False))
+        kind = m.lastgroup
+        tag = _TAGS[kind]
+        out.append(f"<{tag}>{html.escape(m.group(kind), quote=False)}</{tag}>")
+        last = m.end()
+    out.append(html.escape(text[last:], quote=False))
+    return "".join(out)
+
+
+def _is_parse_error(e: BadRequest) -> bool:
+    return "parse entities" in str(e).lower()
+
+
+async def _send(bot, chat_id: int, text: str, priority: int, **kwargs):
+    try:
+        return await outbox.send_message(
+            bot, chat_id, to_html(text), priority=priority, parse_mode=ParseMode.HTML, **kwargs
+        )
+    except BadRequest as e:
+        if not _is_parse_error(e):
+            raise
+        # Не должно случаться: значит, to_html пропустил что-то невалидное
+        SEND_TOTAL.inc("parse_error")
+        log.warning("Telegram не разобрал HTML: %s", e)
+        return await outbox.send_message(bot, chat_id, text, priority=priority, **kwargs)
+
+
+async def send_text(bot, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs):
+    """Отправляет текст с отрендеренной разметкой одним запросом (через очередь outbox)"""
+    try:
+        msg = await _send(bot, chat_id, text, priority, **kwargs)
+    except Exception:
+        SEND_TOTAL.inc("failed")
+        raise
+    SEND_TOTAL.inc("sent")
+    return msg
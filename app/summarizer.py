@@ -0,0 +1,126 @@
+# app/summarizer.py
+"""
+Конспект старой части диалога.
+
+В промпт идёт не вся история, а конспект + сообщения после него
+(не больше RECENT_WINDOW + SUMMARY_BATCH). Как только не свёрнутых
+сообщений набирается столько же, пользователь ставится в очередь
+фоновой задачи: она сворачивает всё, кроме RECENT_WINDOW последних,
+в новый конспект дешёвой моделью (SUMMARY_MODEL) и сдвигает
+summaries.upto_id. Ответ пользователю этого не ждёт.
+
+Очистка истории (db._cleanup_old_messages) удаляет только сообщения
+до upto_id, так что ещё не свёрнутое не теряется.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from .config import settings
+import app.db as db
+
+log = logging.getLogger(__name__)
+
+MAX_FOLD = 60           # сообщений за один вызов модели (остальное — в следующий раз)
+MAX_MSG_CHARS = 500     # длинные сообщения в запросе на конспект обрезаем
+
+SUMMARY_PROMPT = (
+    "Ты ведёшь короткую память Алины о собеседнике. Обнови конспект по новым сообщениям: "
+    "факты о человеке (имя, работа, учёба, близкие, питомцы, увлечения), важные события, "
+    "планы и договорённости, его настроение и то, что для него важно. "
+    "Пиши по-русски, в третьем лице, коротко, без воды и без оценок. "
+    "Устаревшее из прежнего конспекта убирай. Не больше {limit} символов."
+)
+
+_queue: Optional[asyncio.Queue] = None
+_queued: Set[int] = set()
+_task: Optional[asyncio.Task] = None
+
+
+def context_limit() -> int:
+    """Сколько последних не свёрнутых сообщений брать в промпт"""
+    return settings.recent_window + settings.summary_batch
+
+
+def maybe_schedule(user_id: int, unsummarized: int):
+    """Поставить пользователя в очередь, если не свёрнутых сообщений набралось на пачку"""
+    if _queue is None or not settings.summary_enabled:
+        return
+    if unsummarized < context_limit() or user_id in _queued:
+        return
+    _queued.add(user_id)
+    _queue.put_nowait(user_id)
+
+
+def _get_llm():
+    from .llm_client import get
+    return get()
+
+
+def _build_prompt(summary: Optional[str], rows: List[Dict]) -> List[Dict[str, str]]:
+    lines = []
+    for r in rows:
+        who = "Собеседник" if r["role"] == "user" else "Алина"
+        content = r["content"] or ""
+        if len(content) > MAX_MSG_CHARS:
+            content = content[:MAX_MSG_CHARS] + "…"
+        lines.append(f"{who}: {content}")
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT.format(limit=settings.summary_max_chars)},
+        {"role": "user", "content": (
+            f"Прежний конспект:\n{summary or '(пока пусто)'}\n\nНовые сообщения:\n" + "\n".join(lines)
+        )},
+    ]
+
+
+async def summarize(user_id: int) -> bool:
+    """Свернуть не свёрнутую историю пользователя; True — конспект обновлён"""
+    summary, rows = await asyncio.to_thread(db.unsummarized, user_id, settings.recent_window, MAX_FOLD)
+    if not rows:
+        return False
+    text = await _get_llm().complete(
+        _build_prompt(summary, rows),
+        model=settings.summary_model,
+        max_tokens=max(200, settings.summary_max_chars // 2),
+        user_id=user_id,
+        kind="summary",
+    )
+    text = (text or "").strip()[:settings.summary_max_chars]
+    if not text:
+        return False
+    return await asyncio.to_thread(db.save_summary, user_id, text, rows[-1]["id"])
+
+
+async def _worker():
+    while True:
+        user_id = await _queue.get()
+        try:
+            await summarize(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("не удалось обновить конспект", extra={"user_id": user_id})
+        finally:
+            _queued.discard(user_id)
+
+
+def start():
+    """Запускает фоновую задачу (из post_init)"""
+    global _queue, _task
+    if not settings.summary_enabled or _task is not None:
+        return
+    _queue = asyncio.Queue()
+    _task = asyncio.get_running_loop().create_task(_worker(), name="summarizer")
+
+
+async def stop():
+    global _queue, _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _queue, _task = None, None
+    _queued.clear()
@@ -0,0 +1,171 @@
+# app/tracing.py
+"""
+Трассировка обработки апдейта по стадиям.
+
+    @tracing.traced("on_text")
+    async def on_text(update, context):
+        with tracing.span("history"):
+            ...
+
+Текущий трейс живёт в contextvar, поэтому span() можно звать из любой
+функции ниже по стеку (и из asyncio.to_thread — контекст копируется).
+Повторные спаны с одним именем суммируются. По завершении трейс уходит
+одной записью в лог (logger app.tracing) и в гистограмму alina_stage_seconds
+(см. app/metrics.py).
+
+Выключено (TRACING=false) — span() возвращает общий пустой контекст,
+цена вызова — одно чтение contextvar.
+"""
+from __future__ import annotations
+import functools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from .config import settings
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+# (трейс, стадия) → гистограмма; стадия "total" — полное время
+STAGES = Histogram(
+    "alina_stage_seconds", "Длительность стадий обработки апдейта", ("trace", "stage"),
+)
+
+
+class Trace:
+    __slots__ = ("name", "attrs", "stages", "start")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.stages: Dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+class _Null:
+    """Пустой спан/трейс для выключенной трассировки"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "t0")
+
+    def __init__(self, trace: Trace, stage: str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.stage, time.perf_counter() - self.t0)
+        return False
+
+
+class _TraceScope:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace = Trace(name, attrs)
+
+    def __enter__(self) -> Trace:
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        if exc_type is not None:
+            self.trace.attrs["error"] = exc_type.__name__
+        _finish(self.trace)
+        return False
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def trace(name: str, **attrs):
+    """Начать трейс (контекстный менеджер)"""
+    if not settings.tracing_enabled:
+        return _NULL
+    return _TraceScope(name, attrs)
+
+
+def traced(name: str):
+    """Декоратор для async-обработчика: весь вызов — один трейс"""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not settings.tracing_enabled:
+                return await fn(*args, **kwargs)
+            with _TraceScope(name, {}):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def span(stage: str):
+    """Замер стадии внутри текущего трейса (вне трейса — ничего не делает)"""
+    tr = _current.get()
+    if tr is None:
+        return _NULL
+    return _Span(tr, stage)
+
+
+def record(stage: str, seconds: float):
+    """Добавить готовый замер в текущий трейс (например, из колбэка)"""
+    tr = _current.get()
+    if tr is not None:
+        tr.add(stage, seconds)
+
+
+def annotate(**attrs):
+    """Добавить поля к текущему трейсу (исход, размеры и т.п. — без текста сообщений)"""
+    tr = _current.get()
+    if tr is not None:
+        tr.attrs.update(attrs)
+
+
+def _finish(tr: Trace):
+    total = time.perf_counter() - tr.start
+    STAGES.observe(total, tr.name, "total")
+    for stage, secs in tr.stages.items():
+        STAGES.observe(secs, tr.name, stage)
+    log.info("trace", extra={
+        "trace": tr.name,
+        "total_ms": round(total * 1e3, 2),
+        "stages_ms": {k: round(v * 1e3, 2) for k, v in tr.stages.items()},
+        **tr.attrs,
+    })
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """Сводка гистограмм: количество, среднее, p50/p95/p99 (по корзинам), секунды"""
+    out = {}
+    for (name, stage), h in sorted(STAGES.children.items(), key=lambda kv: kv[0]):
+        out[f"{name}.{stage}"] = {
+            "count": h.count,
+            "mean": h.sum / h.count if h.count else 0.0,
+            "p50": h.quantile(0.50),
+            "p95": h.quantile(0.95),
+            "p99": h.quantile(0.99),
+        }
+    return out
@@ -1,6 +1,9 @@
 import asyncio
 import random
 
+from .config import settings
+from .outbox import outbox
+
 def estimate_typing_seconds(text: str) -> float:
     """
     Более реалистичная и быстрая симуляция печати.
@@ -22,18 +25,18 @@ def estimate_typing_seconds(text: str) -> float:
 async def human_typing(context, chat_id: int, planned_reply: str):
     """
     Имитация набора текста человеком.
-    Отправляет "печатает..." каждые 2 сек до конца задержки.
+    Отправляет "печатает..." до конца задержки (повторы гасит outbox.typing).
     """
-    secs = estimate_typing_seconds(planned_reply)
+    secs = estimate_typing_seconds(planned_reply) * settings.typing_delay_scale
     elapsed = 0
     interval = 2.0
 
     while elapsed < secs:
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+        await outbox.typing(context.bot, chat_id)
         await asyncio.sleep(interval)
         elapsed += interval
 
     # Если осталось меньше интервала — досыпаем
     if elapsed < secs:
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+        await outbox.typing(context.bot, chat_id)
         await asyncio.sleep(secs - elapsed)
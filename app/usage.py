@@ -0,0 +1,157 @@
+# app/usage.py
+"""
+Учёт токенов и стоимости запросов к LLM.
+
+LLMClient после каждого ответа зовёт record() — это только сложение
+в словаре в памяти. Раз в USAGE_FLUSH_SEC задача JobQueue забирает
+накопленное и одной транзакцией дописывает в llm_usage (суммы за день
+по пользователю, модели, типу запроса и verbosity).
+
+Цены — LLM_PRICES, USD за 1M токенов: "model=вход/выход,...".
+Стоимость фиксируется по цене на момент записи.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from telegram.ext import Application, ContextTypes
+
+from .config import settings
+import app.db as db
+
+log = logging.getLogger(__name__)
+
+# (день, user_id, модель, тип, verbosity) → [запросы, обрезанные, prompt, completion, задержка мс]
+_Key = Tuple[str, int, str, str, str]
+_pending: Dict[_Key, List[int]] = {}
+
+
+def _parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    prices = {}
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        model, _, pair = item.partition("=")
+        inp, _, out = pair.partition("/")
+        try:
+            prices[model.strip()] = (float(inp), float(out or inp))
+        except ValueError:
+            log.warning("не разобрана цена модели: %s", item)
+    return prices
+
+
+PRICES = _parse_prices(settings.llm_prices)
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    inp, out = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * inp + completion_tokens * out) / 1_000_000
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def record(user_id: Optional[int], model: str, kind: str, verbosity: Optional[str],
+           prompt_tokens: int, completion_tokens: int, latency: float, truncated: bool):
+    """Учесть один ответ модели (вызывается из потока event loop)"""
+    key = (_today(), user_id or 0, model, kind, verbosity or "normal")
+    acc = _pending.get(key)
+    if acc is None:
+        acc = _pending[key] = [0, 0, 0, 0, 0]
+    acc[0] += 1
+    acc[1] += int(truncated)
+    acc[2] += prompt_tokens
+    acc[3] += completion_tokens
+    acc[4] += int(latency * 1000)
+
+
+def _take() -> Dict[_Key, List[int]]:
+    global _pending
+    batch, _pending = _pending, {}
+    return batch
+
+
+def _restore(batch: Dict[_Key, List[int]]):
+    """Запись не удалась — возвращаем суммы, чтобы не потерять их"""
+    for key, vals in batch.items():
+        acc = _pending.setdefault(key, [0, 0, 0, 0, 0])
+        for i, v in enumerate(vals):
+            acc[i] += v
+
+
+def _rows(batch: Dict[_Key, List[int]]) -> List[Dict]:
+    return [
+        {
+            "day": day, "u": uid, "model": model, "kind": kind, "verbosity": verbosity,
+            "requests": n, "truncated": trunc, "prompt": p, "completion": c, "latency_ms": ms,
+            "cost": cost(model, p, c),
+        }
+        for (day, uid, model, kind, verbosity), (n, trunc, p, c, ms) in batch.items()
+    ]
+
+
+async def flush() -> int:
+    """Сбрасывает накопленное в БД; возвращает число записанных строк-агрегатов"""
+    batch = _take()
+    if not batch:
+        return 0
+    try:
+        await asyncio.to_thread(db.add_llm_usage, _rows(batch))
+    except Exception:
+        log.exception("не удалось записать llm_usage, повторим позже")
+        _restore(batch)
+        return 0
+    return len(batch)
+
+
+async def _flush_job(context: ContextTypes.DEFAULT_TYPE):
+    await flush()
+
+
+def schedule_flush(app: Application, interval_sec: Optional[int] = None):
+    jq = getattr(app, "job_queue", None)
+    if jq is None:
+        return
+    interval = interval_sec or settings.usage_flush_sec
+    jq.run_repeating(_flush_job, interval=interval, first=interval, name="usage:flush")
+
+
+# ---------- отчёты для /usage ----------
+
+def _since(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=max(1, days) - 1)).strftime("%Y-%m-%d")
+
+
+def _line(label: str, r: Dict) -> str:
+    n = r["requests"] or 0
+    if not n:
+        return f"{label}: 0"
+    return (
+        f"{label}: {n} запр., prompt ~{r['prompt_tokens'] // n}, ответ ~{r['completion_tokens'] // n} ток., "
+        f"обрезано {r['truncated'] / n:.0%}, ~{r['latency_ms'] // n} мс, ${r['cost_usd']:.4f}"
+    )
+
+
+def summary_text(days: int = 1) -> str:
+    since = _since(days)
+    rows = db.llm_usage_summary(since)
+    if not rows:
+        return f"с {since} запросов к модели не было"
+    total = sum(r["cost_usd"] for r in rows)
+    lines = [f"с {since} (UTC), всего ${total:.4f}"]
+    lines += [_line(f"{r['model']} / {r['kind']} / {r['verbosity']}", r) for r in rows]
+    top = db.llm_usage_top_users(since, limit=5)
+    if top:
+        lines.append("дороже всех:")
+        lines += [_line(f"  {r['user_id']}", r) for r in top]
+    return "\n".join(lines)
+
+
+def user_text(user_id: int, days: int = 7) -> str:
+    since = _since(days)
+    rows = db.llm_usage_for_user(user_id, since)
+    if not rows:
+        return f"у {user_id} с {since} запросов не было"
+    return "\n".join([f"пользователь {user_id} с {since} (UTC):"] + [_line(r["day"], r) for r in rows])
@@ -0,0 +1,105 @@
+# bench/classifier.py — точность и скорость классификатора сообщений
+#
+#   python -m bench.classifier [--iterations 20000] [--min-accuracy 0.95]
+#
+# Сравнивает app.classifier.classify с прежней реализацией
+# (линейный поиск подстрок), на размеченном наборе bench/data/classifier_cases.tsv.
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from app.classifier import classify
+
+CASES = Path(__file__).parent / "data" / "classifier_cases.tsv"
+
+# ---- прежняя реализация (для сравнения) ----
+_LEGACY_TECH = [
+    "алгоритм", "код", "программ", "python", "javascript", "java", "sql",
+    "функци", "класс", "метод", "массив", "цикл", "for", "while", "if",
+    "дейкстр", "граф", "дерев", "хеш", "сложност", "big o", "o(n)",
+    "база данн", "таблиц", "запрос", "индекс", "join", "select",
+    "компил", "интерпрет", "debug", "git", "docker", "api", "rest",
+    "матриц", "вектор", "интеграл", "производн", "уравнен", "формул",
+    "машинн", "нейрон", "ml", "ai", "датасет", "модел", "обучен",
+    "структур данн", "стек", "очеред", "связн списк", "рекурс",
+    "```", "def ", "class ", "function", "import", "return", "console.log"
+]
+
+
+def legacy_classify(text: str):
+    t = text.lower()
+    tech = any(k in t for k in _LEGACY_TECH)
+    if tech:
+        verbosity = "short"
+    elif any(w in t for w in ["20", "15", "много", "несколько", "факт", "список"]):
+        verbosity = "long"
+    else:
+        verbosity = "normal"
+    lst = any(w in t for w in ["факт", "пункт", "список", "причин", "способ"])
+    return tech, lst, verbosity
+
+
+def load_cases():
+    cases = []
+    for line in CASES.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        tech, lst, verbosity, text = line.split("\t", 3)
+        cases.append(((tech == "1", lst == "1", verbosity), text))
+    return cases
+
+
+def accuracy(fn, cases):
+    hits = [0, 0, 0]
+    misses = []
+    for expected, text in cases:
+        got = tuple(fn(text))
+        for i in range(3):
+            hits[i] += got[i] == expected[i]
+        if got != expected:
+            misses.append((text, expected, got))
+    n = len(cases)
+    return [h / n for h in hits], misses
+
+
+def bench(fn, texts, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(texts[i % len(texts)])
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=20000)
+    ap.add_argument("--min-accuracy", type=float, default=0.95)
+    ap.add_argument("-v", "--verbose", action="store_true", help="показать ошибки")
+    args = ap.parse_args()
+
+    cases = load_cases()
+    texts = [t for _, t in cases]
+    # Длинные сообщения — худший случай для линейного поиска
+    long_texts = [(t + " ") * 20 for t in texts]
+
+    print(f"размеченных примеров: {len(cases)}")
+    print(f"{'':>10} {'tech':>6} {'list':>6} {'verb':>6} {'µs/msg':>8} {'µs/long':>8}")
+    failed = False
+    for name, fn in (("legacy", legacy_classify), ("classify", classify)):
+        acc, misses = accuracy(fn, cases)
+        us = bench(fn, texts, args.iterations)
+        us_long = bench(fn, long_texts, args.iterations // 10)
+        print(f"{name:>10} {acc[0]:6.1%} {acc[1]:6.1%} {acc[2]:6.1%} {us:8.2f} {us_long:8.2f}")
+        if args.verbose:
+            for text, expected, got in misses:
+                print(f"    ✗ {text!r}: ожидалось {expected}, получено {got}")
+        if fn is classify and min(acc) < args.min_accuracy:
+            failed = True
+
+    if failed:
+        print(f"точность ниже порога {args.min_accuracy:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
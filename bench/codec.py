@@ -0,0 +1,146 @@
+# bench/codec.py — бенчмарк сжатия сообщений (app/codec.py)
+#
+#   python -m bench.codec                          # корпус из текстов app/prompts.py
+#   python -m bench.codec --from-db alina.db       # реальные ответы из базы
+#
+# Сравнивает степень сжатия и цену в CPU: zlib без словаря, со словарём
+# MSG_CODEC и со словарём, обученным (codec.train) на половине корпуса.
+# Затем засевает две временные базы одинаковой историей — без сжатия и
+# со сжатием — и сравнивает их размер и задержку чтения истории
+# (запрос last_dialog + распаковка).
+# На корпусе из промптов обученный словарь видит те же абзацы, что и
+# тест, и выглядит лучше, чем будет на живой истории — для решения о
+# новом словаре запускайте с --from-db.
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+from bench.db import measure
+
+
+def corpus_from_prompts(rng: random.Random, n: int):
+    from app import prompts
+    texts = [v for v in vars(prompts).values() if isinstance(v, str) and len(v) > 200]
+    texts += [v for d in vars(prompts).values() if isinstance(d, dict) for v in d.values() if isinstance(v, str)]
+    paragraphs = [p.strip() for t in texts for p in t.split("\n\n") if len(p.strip()) > 40]
+    out = []
+    for _ in range(n):
+        k = rng.randint(1, 6)
+        out.append("\n\n".join(rng.sample(paragraphs, min(k, len(paragraphs)))).lower())
+    return out
+
+
+def corpus_from_db(path: str, n: int):
+    from app import codec
+    con = sqlite3.connect(path)
+    rows = con.execute(
+        "SELECT content, codec FROM messages WHERE role='assistant' ORDER BY id DESC LIMIT ?", (n,)
+    ).fetchall()
+    con.close()
+    return [t for t in (codec.decode(c, z) for c, z in rows) if t]
+
+
+def deflate(raw: bytes, zdict: bytes = b"") -> bytes:
+    c = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=zdict) if zdict else zlib.compressobj(6, zlib.DEFLATED, -15)
+    return c.compress(raw) + c.flush()
+
+
+def inflate(data: bytes, zdict: bytes = b"") -> bytes:
+    d = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+    return d.decompress(data) + d.flush()
+
+
+def ratio_report(name: str, samples, zdict: bytes):
+    raw = [s.encode() for s in samples]
+    packed = [deflate(r, zdict) for r in raw]
+    ratio = sum(map(len, packed)) / sum(map(len, raw))
+    small = [p / len(r) for r, p in zip(raw, map(len, packed)) if len(r) < 1000]
+    enc = measure(lambda i: deflate(raw[i % len(raw)], zdict), 2000, 5.0)
+    dec = measure(lambda i: inflate(packed[i % len(packed)], zdict), 2000, 5.0)
+    print(f"{name:>18} {ratio:>7.1%} {statistics.mean(small) if small else 0:>11.1%} "
+          f"{enc['p50_us']:>12} {dec['p50_us']:>12}")
+
+
+def seed_db(path: str, samples, users: int, per_user: int, codec_id: int, rng: random.Random):
+    from app import codec
+    from app.config import settings
+
+    settings.msg_codec = codec_id
+    con = sqlite3.connect(path)
+    con.executescript("""
+        CREATE TABLE messages(id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, role TEXT,
+                              content TEXT, ts DATETIME DEFAULT CURRENT_TIMESTAMP, codec INTEGER);
+        CREATE INDEX idx_messages_user_ts ON messages(user_id, ts DESC);
+    """)
+    rows = []
+    for i in range(users * per_user):
+        text = rng.choice(samples) if i % 2 else "привет! как дела? что делаешь?"
+        value, c = codec.encode(text)
+        rows.append((i % users + 1, "assistant" if i % 2 else "user", value, c,
+                     time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1_700_000_000 + i))))
+    con.executemany("INSERT INTO messages(user_id, role, content, codec, ts) VALUES(?,?,?,?,?)", rows)
+    con.commit()
+    con.execute("VACUUM")
+    con.close()
+    return os.path.getsize(path)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--from-db", default=None, help="брать ответы из этой базы")
+    ap.add_argument("--samples", type=int, default=2000)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--per-user", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="alina-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'app.db')}")
+    from app import codec
+    from app.config import settings
+
+    rng = random.Random(args.seed)
+    samples = corpus_from_db(args.from_db, args.samples) if args.from_db else corpus_from_prompts(rng, args.samples)
+    if not samples:
+        sys.exit("корпус пуст")
+    rng.shuffle(samples)
+    half = len(samples) // 2
+    trained = codec.train(samples[:half])
+    test = samples[half:]
+    print(f"корпус: {len(samples)} текстов, в среднем {statistics.mean(len(s.encode()) for s in samples):.0f} байт; "
+          f"обученный словарь {len(trained)} байт", file=sys.stderr)
+
+    print(f"{'вариант':>18} {'размер':>7} {'<1КБ':>11} {'сжатие µs':>12} {'распак. µs':>12}")
+    ratio_report("zlib", test, b"")
+    codec_id = settings.msg_codec or 1     # по умолчанию сжатие выключено — меряем словарь 1
+    ratio_report(f"zdict {codec_id}", test, codec.zdict(codec_id))
+    ratio_report("zdict обученный", test, trained)
+
+    print()
+    print(f"{'база':>18} {'МБ':>8} {'last_dialog p50 µs':>20} {'p95 µs':>10}")
+    for compress in (False, True):
+        path = os.path.join(workdir, f"hist-{int(compress)}.db")
+        size = seed_db(path, test, args.users, args.per_user, codec_id if compress else 0, random.Random(args.seed))
+        con = sqlite3.connect(path)
+        pick = random.Random(args.seed)
+
+        def read(i):
+            rows = con.execute(
+                "SELECT role, content, codec FROM messages WHERE user_id=? ORDER BY ts DESC LIMIT 20",
+                (pick.randint(1, args.users),),
+            ).fetchall()
+            return [codec.decode(c, z) for _, c, z in rows]
+
+        r = measure(read, 3000, 10.0)
+        con.close()
+        print(f"{'сжатие' if compress else 'без сжатия':>18} {size / 2**20:>8.1f} {r['p50_us']:>20} {r['p95_us']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# bench/db.py — бенчмарк горячих операций app/db.py
+#
+#   python -m bench.db                     # сравнить с bench/baselines/db.json
+#   python -m bench.db --save-baseline     # записать новый эталон
+#   python -m bench.db --users 10000 --messages 200000 --threshold 0.5   # быстрый прогон
+#
+# Засевает временную базу (по умолчанию 100k пользователей, 2M сообщений,
+# активность по Ципфу — немногие пишут очень много), затем меряет задержку
+# каждой операции и полного набора запросов одного хода диалога.
+# Падает с кодом 1, если p50 или p95 хуже эталона больше чем на --threshold.
+# Эталон зависит от машины: после смены железа его нужно перезаписать.
+# Векторная память выключена (её меряет bench/memory.py); все файлы —
+# во временном каталоге, который удаляется на выходе.
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from itertools import accumulate
+from bisect import bisect
+from pathlib import Path
+
+BASELINE = Path(__file__).parent / "baselines" / "db.json"
+
+ROLES = ("user", "assistant")
+TEXTS = [
+    "привет! как дела?", "да так, день обычный. на работе запара была",
+    "расскажи что-нибудь интересное", "сегодня что-то устала... а ты как?",
+    "хорошо вроде! только кот с утра разбудил в 6, представляешь " * 3,
+]
+
+
+def _zipf_picker(n: int, s: float, rng: random.Random):
+    weights = list(accumulate(1.0 / (i ** s) for i in range(1, n + 1)))
+    total = weights[-1]
+    return lambda: bisect(weights, rng.random() * total) + 1
+
+
+def seed(path: str, users: int, messages: int, skew: float, rng: random.Random):
+    con = sqlite3.connect(path)
+    now = int(time.time())
+    con.executemany(
+        "INSERT INTO users(user_id, name, free_left, sub_until_ts, tz) VALUES(?,?,?,?,?)",
+        ((u, None if u % 3 else f"user{u}", rng.randint(0, 10),
+          now + 86400 * rng.randint(1, 30) if u % 5 == 0 else 0,
+          "Europe/Moscow" if u % 2 else None) for u in range(1, users + 1)),
+    )
+    pick = _zipf_picker(users, skew, rng)
+    batch = []
+    for i in range(messages):
+        batch.append((pick(), ROLES[i % 2], rng.choice(TEXTS),
+                      time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - messages + i))))
+        if len(batch) >= 50_000:
+            con.executemany("INSERT INTO messages(user_id, role, content, ts) VALUES(?,?,?,?)", batch)
+            batch.clear()
+    if batch:
+        con.executemany("INSERT INTO messages(user_id, role, content, ts) VALUES(?,?,?,?)", batch)
+    con.executemany(
+        "INSERT INTO reminders(user_id, rtype, time_local, active) VALUES(?,?,?,1)",
+        ((u, "morning", "09:00") for u in range(1, users + 1, 3)),
+    )
+    # Чтобы очистка реально что-то удаляла, а не выходила по «раз в час»
+    con.execute("UPDATE users SET last_cleanup=NULL")
+    con.commit()
+    con.execute("ANALYZE")
+    con.close()
+
+
+def measure(fn, iterations: int, budget: float, warmup: int = 50):
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    deadline = time.perf_counter() + budget
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - t0)
+        if time.perf_counter() > deadline:
+            break
+    samples.sort()
+    q = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6
+    return {
+        "n": len(samples),
+        "ops_per_sec": round(len(samples) / sum(samples), 1),
+        "p50_us": round(q(0.50), 1),
+        "p95_us": round(q(0.95), 1),
+        "p99_us": round(q(0.99), 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--messages", type=int, default=2_000_000)
+    ap.add_argument("--skew", type=float, default=1.1, help="показатель Ципфа для активности")
+    ap.add_argument("--iterations", type=int, default=2000)
+    ap.add_argument("--budget", type=float, default=10.0, help="макс. секунд на операцию")
+    ap.add_argument("--repeat", type=int, default=3, help="повторов; берётся лучший")
+    ap.add_argument("--threshold", type=float, default=0.25, help="допустимая деградация, доля")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="alina-bench-")
+    atexit.register(shutil.rmtree, workdir, True)
+    path = os.path.join(workdir, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["MEMORY_ENABLED"] = "false"
+    os.environ["MEMORY_PATH"] = os.path.join(workdir, "vectors.f32")
+    os.environ["ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+
+    import app.db as db
+    from sqlalchemy import text
+
+    db.init()
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    seed(path, args.users, args.messages, args.skew, rng)
+    print(f"засев: {args.users} пользователей, {args.messages} сообщений "
+          f"за {time.perf_counter() - t0:.1f} с", file=sys.stderr)
+
+    pick = _zipf_picker(args.users, args.skew, rng)
+    heavy = list(range(1, args.iterations + 1))    # самые активные пользователи
+
+    def cleanup(i):
+        u = heavy[i % len(heavy)]
+        with db.engine.begin() as conn:
+            # Сбрасываем отметку, иначе повторы упрутся в «не чаще раза в час»
+            conn.execute(text("UPDATE users SET last_cleanup=NULL WHERE user_id=:u"), {"u": u})
+            db._cleanup_old_messages(conn, u)
+
+    def turn(i):
+        u = pick()
+        q = db.consume_message_quota(u)
+        if q.allowed:
+            db.add_msg(u, "user", "привет! как дела?")
+            db.last_dialog(u, limit=20)
+            db.add_msg(u, "assistant", "да так, день обычный")
+
+    ops = {
+        "get_user": lambda i: db.get_user(pick()),
+        "consume_message_quota": lambda i: db.consume_message_quota(pick()),
+        "add_msg": lambda i: db.add_msg(pick(), "user", "привет! как дела?"),
+        "last_dialog": lambda i: db.last_dialog(pick(), limit=20),
+        "cleanup_old_messages": cleanup,
+        "activate_subscription": lambda i: db.activate_subscription(pick(), days=1),
+        "list_reminders": lambda i: db.list_reminders(pick()),
+        "turn": turn,
+    }
+
+    # Лучший из нескольких повторов — меньше шума от соседей по машине
+    results = {
+        name: min((measure(fn, args.iterations, args.budget) for _ in range(args.repeat)),
+                  key=lambda r: r["p50_us"])
+        for name, fn in ops.items()
+    }
+    with db.engine.connect() as conn:
+        size = conn.execute(text("SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()")).scalar()
+
+    params = {"users": args.users, "messages": args.messages, "skew": args.skew}
+    print(f"{'операция':>24} {'ops/s':>10} {'p50 µs':>9} {'p95 µs':>9} {'p99 µs':>9}")
+    for name, r in results.items():
+        print(f"{name:>24} {r['ops_per_sec']:>10} {r['p50_us']:>9} {r['p95_us']:>9} {r['p99_us']:>9}")
+    print(f"размер базы: {size / 2**20:.1f} МБ")
+
+    if args.save_baseline:
+        BASELINE.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE.write_text(json.dumps({"params": params, "results": results}, indent=2) + "\n")
+        print(f"эталон записан в {BASELINE}")
+        return
+
+    if not BASELINE.exists():
+        print("эталона нет — запустите с --save-baseline")
+        return
+    base = json.loads(BASELINE.read_text())
+    if base["params"] != params:
+        print(f"эталон снят на других данных {base['params']} — сравнение пропущено")
+        return
+
+    regressions = []
+    for name, r in results.items():
+        b = base["results"].get(name)
+        if not b:
+            continue
+        for key in ("p50_us", "p95_us"):
+            if r[key] > b[key] * (1 + args.threshold):
+                regressions.append(f"{name}.{key}: {b[key]} → {r[key]}")
+    if regressions:
+        print("регрессии (порог +{:.0%}):".format(args.threshold))
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+    print("регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
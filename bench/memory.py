@@ -0,0 +1,112 @@
+# bench/memory.py — бенчмарк векторной памяти (app/memory.py)
+#
+#   python -m bench.memory                              # 1M записей, 10k пользователей
+#   python -m bench.memory --snippets 100000 --users 1000   # быстрый прогон
+#
+# Засевает временные базу и файл векторов: записи распределены по
+# пользователям по Ципфу (у самых активных — десятки тысяч), векторы —
+# случайные нормированные (на скорость поиска содержимое не влияет).
+# Меряет эмбеддинг, дозапись через add_msg и поиск recall_memories:
+# по случайному пользователю, по самому активному, с холодным кэшем строк
+# (поиск ограничен MEMORY_SCAN_LIMIT последними записями) и полный
+# перебор всех записей как верхнюю оценку.
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench.db import _zipf_picker, measure
+
+QUERIES = [
+    "помнишь, я рассказывал про своего кота? он опять заболел",
+    "что подарить сестре на день рождения, есть идеи?",
+    "завтра снова экзамен, очень волнуюсь",
+    "на работе опять аврал, начальник всех задергал",
+]
+
+
+def seed(path: str, snippets: int, users: int, skew: float, rng: random.Random, np, memory):
+    store = memory.store()
+    pick = _zipf_picker(users, skew, rng)
+    gen = np.random.default_rng(rng.randrange(2 ** 32))
+    con = sqlite3.connect(path)
+    chunk = 100_000
+    for start in range(0, snippets, chunk):
+        n = min(chunk, snippets - start)
+        vecs = gen.standard_normal((n, memory.DIM), dtype=np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        first = store.extend(vecs)
+        con.executemany(
+            "INSERT INTO memories(user_id, vec_row, content) VALUES(?,?,?)",
+            ((pick(), first + i, f"заметка {first + i}") for i in range(n)),
+        )
+    con.commit()
+    con.execute("ANALYZE")
+    top = con.execute(
+        "SELECT user_id, COUNT(*) FROM memories GROUP BY user_id ORDER BY 2 DESC LIMIT 1"
+    ).fetchone()
+    con.close()
+    return top
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--snippets", type=int, default=1_000_000)
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--skew", type=float, default=1.1, help="показатель Ципфа для активности")
+    ap.add_argument("--iterations", type=int, default=1000)
+    ap.add_argument("--budget", type=float, default=10.0, help="макс. секунд на операцию")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="alina-bench-")
+    path = os.path.join(workdir, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["MEMORY_PATH"] = os.path.join(workdir, "vectors.f32")
+    os.environ["MEMORY_ENABLED"] = "true"     # по умолчанию память выключена
+
+    try:
+        import numpy as np
+    except ImportError:
+        sys.exit("нужен numpy: pip install numpy")
+    import app.db as db
+    from app import memory
+
+    db.init()
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    heavy, heavy_n = seed(path, args.snippets, args.users, args.skew, rng, np, memory)
+    print(f"засев: {args.snippets} записей у {args.users} пользователей за {time.perf_counter() - t0:.1f} с, "
+          f"у самого активного {heavy_n}", file=sys.stderr)
+
+    pick = _zipf_picker(args.users, args.skew, rng)
+    store = memory.store()
+    all_rows = np.arange(store.count, dtype=np.int64)
+    query_vecs = [memory.embed(q) for q in QUERIES]
+
+    def cold(i):
+        memory.cache.clear()
+        db.recall_memories(heavy, QUERIES[i % len(QUERIES)])
+
+    ops = {
+        "embed": lambda i: memory.embed(QUERIES[i % len(QUERIES)]),
+        "add_msg": lambda i: db.add_msg(pick(), "user", QUERIES[i % len(QUERIES)]),
+        "recall_zipf": lambda i: db.recall_memories(pick(), QUERIES[i % len(QUERIES)]),
+        "recall_heaviest": lambda i: db.recall_memories(heavy, QUERIES[i % len(QUERIES)]),
+        "recall_heaviest_cold": cold,
+        "scan_all": lambda i: store.top_k(query_vecs[i % len(query_vecs)], all_rows, 3),
+    }
+    results = {name: measure(fn, args.iterations, args.budget, warmup=5) for name, fn in ops.items()}
+
+    print(f"{'операция':>22} {'ops/s':>10} {'p50 µs':>10} {'p95 µs':>10} {'p99 µs':>10}")
+    for name, r in results.items():
+        print(f"{name:>22} {r['ops_per_sec']:>10} {r['p50_us']:>10} {r['p95_us']:>10} {r['p99_us']:>10}")
+    size = os.path.getsize(os.environ["MEMORY_PATH"])
+    print(f"файл векторов: {size / 2**20:.1f} МБ ({store.count} записей)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench/postprocess.py — скорость постобработки длинных ответов
+#
+#   python -m bench.postprocess [--replies 200] [--repeat 5]
+#
+# Корпус — синтетические ответы около 1500 токенов (~3500 символов кириллицы)
+# разной формы: нумерованные списки в строку и по строкам, списки с тире,
+# жирный текст, «сплошной» абзац. Сравнивает app.postprocess с прежней
+# реализацией и с потоковым режимом (куски по 40 символов).
+import argparse
+import random
+import re
+import time
+
+from app.postprocess import postprocess, postprocess_stream
+
+WORDS = (
+    "зебры живут в африке и питаются травой у каждой зебры свой уникальный узор полосок "
+    "они общаются звуками и мимикой спят стоя а детёныши узнают маму по рисунку полос "
+    "кот барсик опять уронил чашку кофе утром было солнечно и хотелось гулять в парке"
+).split()
+
+
+def _sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def make_reply(rng, target_chars=3500):
+    shape = rng.choice(("inline", "inline_sentences", "lines", "dashes", "prose"))
+    parts = ["Алина: " if rng.random() < 0.2 else ""]
+    i = 1
+    while sum(map(len, parts)) < target_chars:
+        item = _sentence(rng, rng.randint(6, 18))
+        if rng.random() < 0.3:
+            item = f"**{item}**"
+        if shape == "inline":
+            parts.append(f"{i}. {item} ")
+        elif shape == "inline_sentences":
+            # пункты с точками внутри — худший случай для ленивых lookahead-шаблонов
+            parts.append(f"{i}. {item}. {_sentence(rng, 40)}! ")
+        elif shape == "lines":
+            parts.append(f"{i}) {item}.\n\n\n")
+        elif shape == "dashes":
+            parts.append(f"- {item}\n")
+        else:
+            parts.append(item.capitalize() + ". ")
+        i += 1
+    return "".join(parts)
+
+
+# ---- прежняя реализация (для сравнения) ----
+def legacy_format_lists(text):
+    patterns = [
+        (r'(\d+)\.\s+([^.!?]+?)(?=\s*\d+\.|$)', r'\1. \2'),
+        (r'(\d+)\)\s+([^.!?]+?)(?=\s*\d+\)|$)', r'\1) \2'),
+    ]
+    for pattern, replacement in patterns:
+        matches = list(re.finditer(pattern, text))
+        if matches:
+            parts = []
+            last_end = 0
+            for match in matches:
+                if match.start() > last_end:
+                    parts.append(text[last_end:match.start()].rstrip())
+                item = match.group(1) + '. ' + match.group(2).strip()
+                parts.append('\n' + item)
+                last_end = match.end()
+            if last_end < len(text):
+                remaining = text[last_end:].lstrip()
+                if remaining:
+                    parts.append('\n' + remaining)
+            text = ''.join(parts).strip()
+            break
+    text = re.sub(r'(?:^|\s)[-•]\s+', '\n• ', text)
+    return text
+
+
+def legacy_postprocess(text):
+    t = text.strip()
+    for prefix in ("Алина:", "Алина —", "Алина -"):
+        if t.startswith(prefix):
+            t = t[len(prefix):].strip()
+            break
+    t = legacy_format_lists(t)
+    t = re.sub(r'\*\*(.*?)\*\*', r'*\1*', t)
+    t = re.sub(r'\n{3,}', '\n\n', t)
+    return t.strip()
+
+
+def _stream(text, size=40):
+    return "".join(postprocess_stream(text[i:i + size] for i in range(0, len(text), size)))
+
+
+def run(fn, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus) * 1e3
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--replies", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_reply(rng) for _ in range(args.replies)]
+    avg = sum(map(len, corpus)) / len(corpus)
+    print(f"ответов: {len(corpus)}, средняя длина: {avg:.0f} символов")
+
+    mismatched = sum(postprocess(t) != _stream(t) for t in corpus)
+    print(f"потоковый режим расходится с полным: {mismatched}")
+
+    for name, fn in (("legacy", legacy_postprocess), ("pipeline", postprocess), ("stream", _stream)):
+        print(f"{name:>10}: {run(fn, corpus, args.repeat):8.3f} мс/ответ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# bench/startup.py — время старта бота
+#
+#   python -m bench.startup                   # отчёт
+#   python -m bench.startup --budget-ms 800   # падать с кодом 1, если дольше
+#
+# В отдельных процессах (без OPENAI_API_KEY, в пустом каталоге):
+#  1. `import app.bot` под -X importtime — самые дорогие модули, плюс
+#     проверка, что импорт не создаёт базу и не тянет openai/numpy;
+#  2. от импорта до «готов к опросу»: build_app → initialize → post_init
+#     (миграции на пустой базе, метрики, фоновые задачи) через фейковый
+#     Bot API из loadtest — сеть не нужна.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY = ("openai", "numpy")       # httpx тянет сам telegram
+
+READY = """
+import asyncio, json, time
+t0 = time.perf_counter()
+from app.bot import build_app
+from loadtest.fake_telegram import FakeBotApi, FakeRequest
+t_import = time.perf_counter()
+
+async def main():
+    api = FakeBotApi()
+    app = build_app(request=FakeRequest(api), get_updates_request=FakeRequest(api))
+    await app.initialize()
+    await app.post_init(app)
+    ready = time.perf_counter()
+    await app.post_shutdown(app)
+    await app.shutdown()
+    return ready
+
+ready = asyncio.run(main())
+print(json.dumps({"import_ms": (t_import - t0) * 1e3, "ready_ms": (ready - t0) * 1e3}))
+"""
+
+
+def _env(workdir: str) -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "TELEGRAM_BOT_TOKEN")}
+    env["TELEGRAM_BOT_TOKEN"] = "123456:BENCH"     # ходит только в фейковый Bot API
+    env["PYTHONPATH"] = str(ROOT)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'alina.db')}"
+    env["MEMORY_PATH"] = os.path.join(workdir, "memory", "vectors.f32")
+    env["ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    env["METRICS_PORT"] = "0"
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def import_profile(top: int):
+    workdir = tempfile.mkdtemp(prefix="alina-bench-")
+    code = "import sys, app.bot; print(','.join(m for m in %r if m in sys.modules))" % (HEAVY,)
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                       cwd=workdir, env=_env(workdir), capture_output=True, text=True)
+    if p.returncode:
+        sys.exit(f"import app.bot упал:\n{p.stderr[-2000:]}")
+    rows = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cum_us), name.rstrip()[1:]))
+    total = max((us for us, n in rows if n.strip() == "app.bot"), default=0)
+    # По пакетам верхнего уровня: cumulative самого внешнего импорта пакета
+    by_pkg = {}
+    for us, n in rows:
+        pkg = n.strip().split(".")[0]
+        by_pkg[pkg] = max(by_pkg.get(pkg, 0), us)
+    by_pkg.pop("app", None)
+    roots = sorted(((us, n) for n, us in by_pkg.items()), reverse=True)[:top]
+    heavy = [m for m in p.stdout.strip().split(",") if m]
+    created = sorted(os.listdir(workdir))
+    return total, roots, heavy, created
+
+
+def ready_time():
+    workdir = tempfile.mkdtemp(prefix="alina-bench-")
+    p = subprocess.run([sys.executable, "-c", READY], cwd=workdir, env=_env(workdir),
+                       capture_output=True, text=True)
+    if p.returncode:
+        sys.exit(f"старт упал:\n{p.stderr[-2000:]}")
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--top", type=int, default=12)
+    ap.add_argument("--runs", type=int, default=3, help="прогонов старта, берётся лучший")
+    ap.add_argument("--budget-ms", type=float, default=None, help="макс. время до готовности")
+    args = ap.parse_args()
+
+    total, roots, heavy, created = import_profile(args.top)
+    print(f"import app.bot: {total / 1e3:.0f} мс (cumulative)")
+    for us, name in roots:
+        print(f"  {us / 1e3:>8.1f} мс  {name}")
+    runs = [ready_time() for _ in range(args.runs)]
+    best = min(runs, key=lambda r: r["ready_ms"])
+    print(f"импорт {best['import_ms']:.0f} мс, готов к опросу за {best['ready_ms']:.0f} мс "
+          f"(лучший из {args.runs})")
+
+    failed = False
+    if heavy:
+        print(f"при импорте загружены тяжёлые модули: {', '.join(heavy)}")
+        failed = True
+    if created:
+        print(f"импорт создал файлы: {', '.join(created)}")
+        failed = True
+    if args.budget_ms is not None and best["ready_ms"] > args.budget_ms:
+        print(f"дольше бюджета {args.budget_ms:.0f} мс")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# loadtest/fake_openai.py
+"""
+Фейковый OpenAI-совместимый сервер (/v1/chat/completions) на asyncio.
+
+Задержка ответа берётся из настраиваемого распределения (константа,
+равномерное или логнормальное), поддерживается stream=True (SSE).
+Запускается в отдельном потоке со своим event loop, чтобы не мешать
+замерам в процессе бота.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from typing import Optional
+
+REPLIES = [
+    "да так, день обычный. на работе запара была",
+    "хорошо вроде! только кот с утра разбудил в 6, представляешь",
+    "слушай, я обычный человек, а не википедия 😅",
+    "1. зебры полосатые 2. живут в Африке 3. спят стоя — всё, мои знания закончились",
+    "сегодня что-то устала... а ты как?",
+]
+
+
+class Latency:
+    """Распределение задержки: 'const:0.8', 'uniform:0.3:1.5', 'lognormal:0.9:0.5' (медиана, sigma)"""
+
+    def __init__(self, spec: str):
+        kind, *args = spec.split(":")
+        self.kind = kind
+        self.args = [float(a) for a in args]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "const":
+            return self.args[0]
+        if self.kind == "uniform":
+            return rng.uniform(self.args[0], self.args[1])
+        if self.kind == "lognormal":
+            median, sigma = self.args
+            return rng.lognormvariate(math.log(median), sigma)
+        raise ValueError(f"неизвестное распределение: {self.kind}")
+
+
+class FakeOpenAI:
+    def __init__(self, latency: str = "lognormal:0.8:0.4", ttfb: str = "const:0.2", seed: int = 1):
+        self.latency = Latency(latency)
+        self.ttfb = Latency(ttfb)
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.port: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._ready = threading.Event()
+
+    # ----- HTTP -----
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                headers = {k.lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                await self._respond(writer, json.loads(body or b"{}"))
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, req: dict):
+        self.requests += 1
+        model = req.get("model", "gpt-4o-mini")
+        text = self.rng.choice(REPLIES)
+        prompt_tokens = sum(len(m.get("content", "")) for m in req.get("messages", [])) // 4
+        completion_tokens = max(1, len(text) // 4)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        created = int(time.time())
+
+        if not req.get("stream"):
+            await asyncio.sleep(self.latency.sample(self.rng))
+            payload = json.dumps({
+                "id": f"chatcmpl-{self.requests}", "object": "chat.completion", "created": created,
+                "model": model, "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+            }).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\n\r\n" % len(payload) + payload)
+            await writer.drain()
+            return
+
+        # stream=True: первый кусок через TTFB, остальное равномерно до полной задержки
+        total = self.latency.sample(self.rng)
+        first = min(total, self.ttfb.sample(self.rng))
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n")
+        await asyncio.sleep(first)
+        words = text.split(" ")
+        step = (total - first) / max(1, len(words))
+        for i, w in enumerate(words):
+            chunk = {"id": f"chatcmpl-{self.requests}", "object": "chat.completion.chunk",
+                     "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": (" " if i else "") + w},
+                                  "finish_reason": None}]}
+            self._write_chunk(writer, b"data: " + json.dumps(chunk).encode() + b"\n\n")
+            await writer.drain()
+            if step > 0:
+                await asyncio.sleep(step)
+        done = {"id": f"chatcmpl-{self.requests}", "object": "chat.completion.chunk", "created": created,
+                "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": usage}
+        self._write_chunk(writer, b"data: " + json.dumps(done).encode() + b"\n\n")
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(b"%x\r\n" % len(data) + data + b"\r\n")
+
+    # ----- жизненный цикл -----
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер в фоновом потоке, возвращает base_url"""
+        threading.Thread(target=self._run, args=(host, port), daemon=True, name="fake-openai").start()
+        self._ready.wait()
+        return f"http://{host}:{self.port}/v1"
+
+    def _run(self, host: str, port: int):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, host, port, backlog=1024)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="фейковый OpenAI API")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="lognormal:0.8:0.4")
+    args = ap.parse_args()
+    srv = FakeOpenAI(latency=args.latency)
+    print("слушаю", srv.start(port=args.port))
+    threading.Event().wait()
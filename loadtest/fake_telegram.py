@@ -0,0 +1,133 @@
+# loadtest/fake_telegram.py
+"""
+Фейковый Bot API внутри процесса.
+
+Подставляется в Application как транспорт (BaseRequest): getUpdates
+отдаёт синтетические апдейты из очереди, sendMessage и прочие вызовы
+записываются вместе с моментом отправки. Сеть не используется.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Alina", "username": "alina_load_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False,
+            "supports_inline_queries": False}
+
+
+class FakeBotApi:
+    """Общее состояние фейкового Bot API: входящие апдейты и записанные отправки"""
+
+    def __init__(self):
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self._update_id = itertools.count(1)
+        self._message_id = itertools.count(1)
+        # chat_id → моменты отправки ещё не отвеченных сообщений пользователя
+        self._pending: Dict[int, Deque[float]] = defaultdict(deque)
+        # chat_id → ожидающие ответа (для замкнутого цикла «написал → ждёт ответ»)
+        self._waiters: Dict[int, Deque[asyncio.Future]] = defaultdict(deque)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.latencies: List[float] = []
+        self.replies = 0
+
+    # ----- сторона «пользователей» -----
+
+    def user_message(self, user_id: int, text: str) -> asyncio.Future:
+        """Кладёт сообщение пользователя в getUpdates; future завершится ответом бота"""
+        now = time.time()
+        self._pending[user_id].append(time.perf_counter())
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[user_id].append(fut)
+        self.updates.put_nowait({
+            "update_id": next(self._update_id),
+            "message": {
+                "message_id": next(self._message_id),
+                "date": int(now),
+                "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+            },
+        })
+        return fut
+
+    # ----- сторона бота -----
+
+    def _record_reply(self, chat_id: int, text: str):
+        self.replies += 1
+        pending = self._pending.get(chat_id)
+        if pending:
+            self.latencies.append(time.perf_counter() - pending.popleft())
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(text)
+
+    def _message(self, chat_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "message_id": next(self._message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def handle(self, method: str, params: Dict[str, Any], timeout: Optional[float]) -> Any:
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method in ("deleteWebhook", "setMyCommands", "answerCallbackQuery", "sendChatAction"):
+            return True
+        if method == "getUpdates":
+            return await self._get_updates(params, timeout)
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self._record_reply(chat_id, params.get("text", ""))
+            return self._message(chat_id, params.get("text", ""))
+        if method in ("editMessageText", "editMessageReplyMarkup"):
+            return self._message(int(params.get("chat_id") or 0), params.get("text", ""))
+        return True
+
+    async def _get_updates(self, params: Dict[str, Any], timeout: Optional[float]) -> List[Dict]:
+        batch = []
+        limit = int(params.get("limit") or 100)
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=float(params.get("timeout") or 0) or 0.1)
+            batch.append(first)
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+
+class FakeRequest(BaseRequest):
+    """Транспорт PTB, который вместо HTTP обращается к FakeBotApi"""
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        timeout = read_timeout if isinstance(read_timeout, (int, float)) else None
+        result = await self.api.handle(api_method, params, timeout)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
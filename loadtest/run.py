@@ -0,0 +1,190 @@
+# loadtest/run.py — нагрузочный прогон бота без сети
+#
+#   python -m loadtest.run --users 2000 --messages 3 --concurrent-updates 64
+#
+# Поднимает фейковый OpenAI-сервер и фейковый Bot API, собирает настоящий
+# Application из app.bot и гоняет через него синтетических пользователей
+# (каждый пишет, ждёт ответа, «думает» и пишет снова).
+# Отчёт: пропускная способность, p50/p95/p99 задержки ответа,
+# время в БД и лаг event loop.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from loadtest.fake_openai import FakeOpenAI
+from loadtest.fake_telegram import FakeBotApi, FakeRequest
+
+MESSAGES = [
+    "привет! как дела?",
+    "что делаешь вечером?",
+    "расскажи 15 фактов о зебрах",
+    "у меня был тяжёлый день",
+    "как работает алгоритм Дейкстры?",
+    "посоветуй несколько сериалов",
+    "скучаю",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _configure_env(args, openai_url: str, workdir: Path):
+    """Настройки бота — до импорта app.*"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_USE_PROXY": "false",
+        "DATABASE_URL": f"sqlite:///{workdir / 'load.db'}",
+        "FREE_MESSAGES": str(args.messages + 10),
+        "TYPING_DELAY_SCALE": str(args.typing_scale),
+        "CONCURRENT_UPDATES": str(args.concurrent_updates),
+        "TRACING": "true" if args.trace else "false",
+    })
+    # Логи бота не должны перемешиваться с отчётом; стадии и так попадут в отчёт
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+class DbTimer:
+    """Суммарное время SQL-запросов через события SQLAlchemy"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.total = 0.0
+        self.statements = 0
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_t0", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        self.total += time.perf_counter() - conn.info["_t0"].pop()
+        self.statements += 1
+
+
+async def loop_lag_sampler(samples: list, interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def simulated_user(api: FakeBotApi, user_id: int, messages: int, think: float,
+                         rng: random.Random, timeout: float, errors: list):
+    await asyncio.sleep(rng.uniform(0, think))      # разносим старт
+    for _ in range(messages):
+        try:
+            await asyncio.wait_for(api.user_message(user_id, rng.choice(MESSAGES)), timeout)
+        except asyncio.TimeoutError:
+            errors.append(user_id)
+            return
+        # Рейт-лимит бота — 1 сообщение в секунду, «думаем» дольше
+        await asyncio.sleep(think + rng.uniform(0, think))
+
+
+async def run(args) -> dict:
+    import app.db as db
+    from app.bot import build_app
+
+    db.init()
+    db_timer = DbTimer(db.engine)
+    api = FakeBotApi()
+    application = build_app(request=FakeRequest(api), get_updates_request=FakeRequest(api))
+
+    lag = []
+    lag_task = asyncio.create_task(loop_lag_sampler(lag))
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0.0, timeout=1)
+
+    rng = random.Random(args.seed)
+    errors = []
+    started = time.perf_counter()
+    db_before = db_timer.total
+    await asyncio.gather(*(
+        simulated_user(api, uid, args.messages, args.think, random.Random(rng.random()),
+                       args.reply_timeout, errors)
+        for uid in range(1, args.users + 1)
+    ))
+    elapsed = time.perf_counter() - started
+    db_time = db_timer.total - db_before
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    lag_task.cancel()
+
+    lat = api.latencies
+    report = {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "concurrent_updates": args.concurrent_updates,
+        "elapsed_s": round(elapsed, 2),
+        "replies": api.replies,
+        "timeouts": len(errors),
+        "throughput_rps": round(api.replies / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_s": round(percentile(lat, 0.50), 3),
+        "latency_p95_s": round(percentile(lat, 0.95), 3),
+        "latency_p99_s": round(percentile(lat, 0.99), 3),
+        "db_time_s": round(db_time, 3),
+        "db_statements": db_timer.statements,
+        "db_ms_per_reply": round(db_time / max(1, api.replies) * 1e3, 3),
+        "loop_lag_p50_ms": round(percentile(lag, 0.50) * 1e3, 2),
+        "loop_lag_p99_ms": round(percentile(lag, 0.99) * 1e3, 2),
+        "loop_lag_max_ms": round(max(lag, default=0.0) * 1e3, 2),
+        "bot_api_calls": dict(api.calls),
+    }
+    if args.trace:
+        from app import tracing
+        report["stages_ms"] = {
+            key: {k: round(v * 1e3, 2) if k != "count" else v for k, v in row.items()}
+            for key, row in tracing.snapshot().items()
+        }
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--messages", type=int, default=3, help="сообщений на пользователя")
+    ap.add_argument("--think", type=float, default=1.5, help="пауза между сообщениями, сек")
+    ap.add_argument("--latency", default="lognormal:0.8:0.4", help="задержка фейкового LLM")
+    ap.add_argument("--concurrent-updates", type=int, default=0, help="0 — как в проде по умолчанию")
+    ap.add_argument("--typing-scale", type=float, default=0.0, help="множитель имитации набора")
+    ap.add_argument("--reply-timeout", type=float, default=120.0)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--trace", action="store_true", help="включить трассировку и вывести стадии")
+    ap.add_argument("--json", help="куда сохранить отчёт")
+    args = ap.parse_args()
+
+    fake_llm = FakeOpenAI(latency=args.latency)
+    openai_url = fake_llm.start()
+    workdir = Path(tempfile.mkdtemp(prefix="alina-load-"))
+    _configure_env(args, openai_url, workdir)
+
+    report = asyncio.run(run(args))
+    report["llm_requests"] = fake_llm.requests
+    fake_llm.stop()
+
+    out = json.dumps(report, ensure_ascii=False, indent=2)
+    print(out)
+    if args.json:
+        Path(args.json).write_text(out, encoding="utf-8")
+    if report["timeouts"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# tests/conftest.py
+"""
+Общая настройка: база — временный файл SQLite (app.db создаёт движок при
+импорте, поэтому DATABASE_URL задаём до него), схема — миграциями.
+Векторная память и архив выключены: тесты не пишут ничего в рабочий каталог.
+
+Зависимости: pip install -r requirements-dev.txt
+"""
+import os
+import tempfile
+
+import pytest
+
+_workdir = tempfile.mkdtemp(prefix="alina-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["MEMORY_ENABLED"] = "false"
+os.environ["ARCHIVE_ENABLED"] = "false"
+
+import app.db as db  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    db.init()
+
+
+@pytest.fixture
+def user_id():
+    """Новый пользователь на каждый тест — тесты не делят строки users"""
+    user_id.n = getattr(user_id, "n", 1000) + 1
+    return user_id.n
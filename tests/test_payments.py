@@ -0,0 +1,67 @@
+# tests/test_payments.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+import app.db as db
+
+
+def _pay(user_id: int, order_id: str):
+    return db.complete_payment(user_id=user_id, provider="stars", order_id=order_id,
+                               amount=100, currency="XTR", days=30, raw="month")
+
+
+def _payment(order_id: str):
+    with db.engine.begin() as conn:
+        return conn.execute(
+            text("SELECT status, COUNT(*) OVER () AS n FROM payments WHERE order_id=:o"), {"o": order_id}
+        ).mappings().first()
+
+
+def test_duplicate_successful_payment_extends_once(user_id):
+    order = f"order-{user_id}"
+    db.upsert_payment(user_id=user_id, provider="stars", order_id=order,
+                      amount=100, currency="XTR", status="pending", raw="month")
+
+    until = _pay(user_id, order)
+    assert until is not None
+    assert db.get_user(user_id)["sub_until_ts"] == until
+
+    # Telegram доставил successful_payment ещё раз
+    assert _pay(user_id, order) is None
+    assert db.get_user(user_id)["sub_until_ts"] == until
+    assert dict(_payment(order)) == {"status": "paid", "n": 1}
+
+
+def test_duplicate_without_pending_row(user_id):
+    order = f"order-{user_id}"
+    until = _pay(user_id, order)
+    assert until is not None
+    assert _pay(user_id, order) is None
+    assert db.get_user(user_id)["sub_until_ts"] == until
+
+
+def test_concurrent_duplicates_extend_once(user_id):
+    order = f"order-{user_id}"
+    start = threading.Barrier(8)
+
+    def deliver(_):
+        start.wait()
+        return _pay(user_id, order)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(deliver, range(8)))
+
+    applied = [r for r in results if r is not None]
+    assert len(applied) == 1
+    assert db.get_user(user_id)["sub_until_ts"] == applied[0]
+
+
+def test_paid_payment_is_not_reset_to_pending(user_id):
+    order = f"order-{user_id}"
+    _pay(user_id, order)
+    db.upsert_payment(user_id=user_id, provider="stars", order_id=order,
+                      amount=100, currency="XTR", status="pending", raw="month")
+    assert _payment(order)["status"] == "paid"
+    assert _pay(user_id, order) is None
@@ -0,0 +1,48 @@
+# tests/test_quota.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app.db as db
+from app.config import settings
+
+
+def _race(fn, n: int):
+    """n вызовов fn() из n потоков, отпущенных одновременно"""
+    start = threading.Barrier(n)
+
+    def call(_):
+        start.wait()
+        return fn()
+
+    with ThreadPoolExecutor(n) as pool:
+        return list(pool.map(call, range(n)))
+
+
+def test_concurrent_consume_stops_at_zero(user_id):
+    db.get_user(user_id)
+    db.update_user(user_id, free_left=5, sub_until_ts=0)
+
+    results = _race(lambda: db.consume_message_quota(user_id), 20)
+
+    assert sum(q.allowed for q in results) == 5
+    assert db.get_user(user_id)["free_left"] == 0
+    # Каждое разрешённое списание увидело своё значение остатка
+    assert sorted(q.free_left for q in results if q.allowed) == [0, 1, 2, 3, 4]
+
+
+def test_concurrent_consume_creates_new_user_once(user_id):
+    results = _race(lambda: db.consume_message_quota(user_id), settings.free_messages + 5)
+
+    assert sum(q.allowed for q in results) == settings.free_messages
+    assert db.get_user(user_id)["free_left"] == 0
+
+
+def test_subscriber_is_not_charged(user_id):
+    db.get_user(user_id)
+    db.update_user(user_id, free_left=0, sub_until_ts=int(time.time()) + 86400)
+
+    results = _race(lambda: db.consume_message_quota(user_id), 10)
+
+    assert all(q.allowed and q.subscribed for q in results)
+    assert db.get_user(user_id)["free_left"] == 0